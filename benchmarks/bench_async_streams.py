@@ -0,0 +1,58 @@
+"""
+Batches/s of many concurrent AsyncNakadiStream consumers driven by a single
+event loop and thread, against a local asyncio server.
+
+    PYTHONPATH=. python benchmarks/bench_async_streams.py --streams 1000
+"""
+import argparse
+import asyncio
+import threading
+import time
+
+from pyNakadi.aio import AsyncNakadiClient
+from pyNakadi.client import EndOfStreamException0
+from replay import chunk_body, synthetic_payload
+
+
+async def consume(client, counts):
+    stream = await client.get_subscription_events_stream('bench')
+    try:
+        async for _ in stream:
+            counts[0] += 1
+    except EndOfStreamException0:
+        pass
+    stream.close()
+
+
+async def main(args):
+    body = chunk_body(synthetic_payload(args.batches, args.events_per_batch, 200), 8192)
+
+    async def handle(reader, writer):
+        await reader.readuntil(b'\r\n\r\n')
+        writer.write(b'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n' + body)
+        await writer.drain()
+        writer.close()
+
+    server = await asyncio.start_server(handle, '127.0.0.1', 0, backlog=args.streams)
+    client = AsyncNakadiClient('dummy_token', f'http://127.0.0.1:{server.sockets[0].getsockname()[1]}')
+    counts = [0]
+    started = time.perf_counter()
+    await asyncio.gather(*[consume(client, counts) for _ in range(args.streams)])
+    elapsed = time.perf_counter() - started
+    print(f'{args.streams} streams: {counts[0] / elapsed:10.0f} batches/s '
+          f'{counts[0] * args.events_per_batch / elapsed:10.0f} events/s '
+          f'{threading.active_count()} threads')
+    server.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--streams', type=int, default=500)
+    parser.add_argument('--batches', type=int, default=100)
+    parser.add_argument('--events-per-batch', type=int, default=10)
+    # asyncio.run needs Python 3.7
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(main(parser.parse_args()))
+    finally:
+        loop.close()
@@ -0,0 +1,126 @@
+"""
+Micro-benchmark of the chunked transfer decoder used by NakadiStream.
+
+Replays a recorded (or synthetic) chunked stream body through the current
+NakadiStream and through the byte-at-a-time implementation it replaced.
+Use --events-per-batch in the thousands to compare multi-MB batches that
+span many chunks.
+
+    PYTHONPATH=. python benchmarks/bench_chunk_decoder.py [--recording FILE]
+
+A recording is the raw HTTP body of an event stream, chunk headers included,
+e.g. captured with `curl --raw`.
+"""
+import argparse
+import time
+
+from pyNakadi.client import NakadiStream, EndOfStreamException, EndOfStreamException0
+from replay import ReplaySocket, replay_response, synthetic_stream
+
+
+class LegacyNakadiStream(NakadiStream):
+    """
+    NakadiStream.read_chunk and __next__ as they were before the buffered
+    decoder and the line framing.
+    """
+
+    def __init__(self, response):
+        super().__init__(response)
+        self.raw_buffer = b''
+        self.buffer = b''
+
+    def __next__(self):
+        data_read_arr = list()
+        data_read = self.buffer
+        data_read_arr.append(data_read)
+        while b'\n' not in data_read:
+            data_read = self.read_chunk()
+            data_read_arr.append(data_read)
+        data_read_arr[-1], self.buffer = data_read_arr[-1].split(b'\n', 1)
+        data_b = b''.join(data_read_arr)
+        self.current_batch = data_b
+        return self.current_batch
+
+    def read_chunk(self):
+        if b'\r\n' not in self.raw_buffer:
+            while self.raw_buffer[-2:] != b'\r\n':
+                received_byte = self.sock.recv(1)
+                if received_byte == b'':
+                    raise EndOfStreamException
+                self.raw_buffer += received_byte
+            size_b = self.raw_buffer[:-2]
+            self.raw_buffer = b''
+        else:
+            size_b, self.raw_buffer = self.raw_buffer.split(b'\r\n', 1)
+        size = int(size_b, 16) + 2
+
+        data_read_arr = list()
+        remaining = size
+        data_read = self.raw_buffer
+        data_read_arr.append(data_read)
+        remaining -= len(data_read)
+        while remaining > 0:
+            data_read = self.sock.recv(self.BUFFER_SIZE)
+            if data_read == b'':
+                raise EndOfStreamException
+            data_read_arr.append(data_read)
+            remaining -= len(data_read)
+        if remaining != 0:
+            self.raw_buffer = data_read_arr[-1][remaining:]
+        else:
+            self.raw_buffer = b''
+
+        if len(data_read) + remaining == 1:
+            data_read_arr[-2] = data_read_arr[-2][:-1]
+            data_read_arr.pop(-1)
+        else:
+            data_read_arr[-1] = data_read_arr[-1][:remaining - 2]
+        data_b = b''.join(data_read_arr)
+
+        if size == 0:
+            raise EndOfStreamException0
+
+        return data_b
+
+
+def run(stream_class, data, flushes):
+    sock = ReplaySocket(data, flushes)
+    stream = stream_class(replay_response(sock))
+    batches = 0
+    started = time.perf_counter()
+    try:
+        for _ in stream:
+            batches += 1
+    except (EndOfStreamException, EndOfStreamException0):
+        pass
+    return time.perf_counter() - started, batches, sock.calls
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--recording', help='raw chunked body to replay')
+    parser.add_argument('--batches', type=int, default=2000)
+    parser.add_argument('--events-per-batch', type=int, default=10)
+    parser.add_argument('--event-size', type=int, default=200)
+    parser.add_argument('--chunk-size', type=int, default=4096)
+    parser.add_argument('--segment-size', type=int, default=1460,
+                        help='bytes per read when replaying a recording')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    if args.recording:
+        with open(args.recording, 'rb') as f:
+            data = f.read()
+        flushes = list(range(args.segment_size, len(data), args.segment_size))
+    else:
+        data, flushes = synthetic_stream(args.batches, args.events_per_batch, args.event_size,
+                                         args.chunk_size)
+
+    for name, stream_class in [('legacy', LegacyNakadiStream), ('buffered', NakadiStream)]:
+        elapsed, batches, calls = min(run(stream_class, data, flushes) for _ in range(args.repeat))
+        print(f'{name:>10}: {len(data) / elapsed / 2 ** 20:8.1f} MB/s '
+              f'{batches / elapsed:10.0f} batches/s {calls:8d} reads')
+
+
+if __name__ == '__main__':
+    main()
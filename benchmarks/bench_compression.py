@@ -0,0 +1,53 @@
+"""
+Bytes on the wire and client CPU time of plain vs gzip event streams, read
+through NakadiClient from a local test server.
+
+    PYTHONPATH=. python benchmarks/bench_compression.py
+"""
+import argparse
+import gzip
+import time
+
+from pyNakadi import NakadiClient
+from pyNakadi.client import EndOfStreamException0
+from replay import StreamServer, chunk_body, synthetic_payload
+
+
+def run(url, compression):
+    stream = NakadiClient('dummy_token', url).get_subscription_events_stream('bench', compression=compression)
+    batches = 0
+    started_cpu = time.thread_time()
+    started = time.perf_counter()
+    try:
+        for _ in stream:
+            batches += 1
+    except EndOfStreamException0:
+        pass
+    return time.perf_counter() - started, time.thread_time() - started_cpu, batches
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--batches', type=int, default=2000)
+    parser.add_argument('--events-per-batch', type=int, default=50)
+    parser.add_argument('--event-size', type=int, default=200)
+    parser.add_argument('--chunk-size', type=int, default=16384)
+    parser.add_argument('--level', type=int, default=6, help='server side gzip level')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    payload = synthetic_payload(args.batches, args.events_per_batch, args.event_size)
+    gzip_body = chunk_body(gzip.compress(payload, args.level), args.chunk_size)
+    server = StreamServer(chunk_body(payload, args.chunk_size), gzip_body)
+
+    for compression in [None, 'gzip']:
+        sent_before = server.bytes_sent
+        elapsed, cpu, batches = min(run(server.url, compression) for _ in range(args.repeat))
+        wire = (server.bytes_sent - sent_before) / args.repeat
+        print(f'{compression or "identity":>10}: {wire / 2 ** 20:8.2f} MB on wire '
+              f'{cpu * 1000:8.1f} ms client cpu {elapsed * 1000:8.1f} ms wall '
+              f'{len(payload) / cpu / 2 ** 20:8.1f} MB/s per core')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+"""
+Events/s of NakadiStream.batches() with every installed json decoder, and
+of lazy batches that only decode the cursor.
+
+    PYTHONPATH=. python benchmarks/bench_json_decoders.py
+"""
+import argparse
+import time
+
+from pyNakadi.client import NakadiStream, EndOfStreamException, EndOfStreamException0
+from pyNakadi.serialization import JSON_DECODERS, get_json_decoder
+from replay import ReplaySocket, replay_response, synthetic_stream
+
+
+def run(json_decoder, data, flushes, lazy=False):
+    stream = NakadiStream(replay_response(ReplaySocket(data, flushes)), json_decoder=json_decoder)
+    batches = 0
+    started = time.perf_counter()
+    try:
+        for batch in stream.batches(lazy):
+            batches += 1
+    except (EndOfStreamException, EndOfStreamException0):
+        pass
+    return time.perf_counter() - started, batches
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--batches', type=int, default=2000)
+    parser.add_argument('--events-per-batch', type=int, default=50)
+    parser.add_argument('--event-size', type=int, default=200)
+    parser.add_argument('--chunk-size', type=int, default=16384)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    data, flushes = synthetic_stream(args.batches, args.events_per_batch, args.event_size, args.chunk_size)
+    for name in JSON_DECODERS:
+        try:
+            get_json_decoder(name)
+        except ImportError:
+            print(f'{name:>14}: not installed')
+            continue
+        for lazy in [False, True]:
+            elapsed, batches = min(run(name, data, flushes, lazy) for _ in range(args.repeat))
+            events = batches * args.events_per_batch
+            label = f'{name} lazy' if lazy else name
+            print(f'{label:>14}: {events / elapsed:12.0f} events/s {len(data) / elapsed / 2 ** 20:8.1f} MB/s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""
+Client CPU time and request bytes per event of NakadiClient.post_events
+against a local HTTP sink, for every way of handing over events.
+
+    PYTHONPATH=. python benchmarks/bench_publish.py
+"""
+import argparse
+import time
+
+from pyNakadi import NakadiClient
+from pyNakadi.serialization import JSON_ENCODERS, get_json_encoder
+from replay import PublishSink, synthetic_events
+
+
+def run(client, batches, compression, legacy=False):
+    started_cpu = time.thread_time()
+    for events in batches:
+        if legacy:
+            client.session.post(f'{client.nakadi_url}/event-types/bench/events', json=events)
+        else:
+            client.post_events('bench', events, compression=compression)
+    return time.thread_time() - started_cpu
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--events-per-request', type=int, default=100)
+    parser.add_argument('--event-size', type=int, default=200)
+    args = parser.parse_args()
+
+    sink = PublishSink()
+    events = synthetic_events(args.events_per_request, args.event_size)
+    total_events = args.requests * args.events_per_request
+
+    cases = [('requests json=', 'json', False, None)]
+    for name in JSON_ENCODERS:
+        try:
+            get_json_encoder(name)
+        except ImportError:
+            print(f'{name:>22}: not installed')
+            continue
+        cases.append((name, name, False, None))
+        cases.append((f'{name} gzip', name, False, 'gzip'))
+    cases.append(('pre-encoded', None, True, None))
+    cases.append(('pre-encoded gzip', None, True, 'gzip'))
+
+    for label, encoder, pre_encoded, compression in cases:
+        client = NakadiClient('dummy_token', sink.url, json_encoder=encoder)
+        batch = [client.json_dumps(event) for event in events] if pre_encoded else events
+        received_before = sink.bytes_received
+        cpu = run(client, [batch] * args.requests, compression, legacy=label == 'requests json=')
+        wire = sink.bytes_received - received_before
+        print(f'{label:>22}: {cpu / total_events * 1e6:8.2f} us cpu/event '
+              f'{wire / total_events:8.1f} bytes/event')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+"""
+Wall time of publishing to many event types with sequential post_events
+calls vs one post_events_many call, against a local HTTP sink that answers
+after a simulated round-trip latency.
+
+    PYTHONPATH=. python benchmarks/bench_publish_many.py
+"""
+import argparse
+import time
+
+from pyNakadi import NakadiClient
+from replay import PublishSink, synthetic_events
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--event-types', type=int, default=32)
+    parser.add_argument('--events-per-type', type=int, default=100)
+    parser.add_argument('--latency', type=float, default=0.02)
+    parser.add_argument('--pool-maxsize', type=int, default=16)
+    args = parser.parse_args()
+
+    sink = PublishSink(latency=args.latency)
+    events = synthetic_events(args.events_per_type, 200)
+    events_by_event_type = {f'bench_{i}': events for i in range(args.event_types)}
+    client = NakadiClient('dummy_token', sink.url, pool_maxsize=args.pool_maxsize)
+
+    started = time.perf_counter()
+    for event_type_name, events in events_by_event_type.items():
+        client.post_events(event_type_name, events)
+    sequential = time.perf_counter() - started
+
+    started = time.perf_counter()
+    result = client.post_events_many(events_by_event_type)
+    concurrent = time.perf_counter() - started
+    assert all(value is True for value in result.values())
+
+    print(f'{"sequential":>16}: {sequential * 1000:8.1f} ms')
+    print(f'{"post_events_many":>16}: {concurrent * 1000:8.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
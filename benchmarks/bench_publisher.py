@@ -0,0 +1,42 @@
+"""
+Events/s of publishing single events with one post_events call each vs
+through NakadiPublisher, against a local HTTP sink.
+
+    PYTHONPATH=. python benchmarks/bench_publisher.py
+"""
+import argparse
+import time
+
+from pyNakadi import NakadiClient, NakadiPublisher
+from replay import PublishSink, synthetic_events
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--events', type=int, default=20000)
+    parser.add_argument('--event-size', type=int, default=200)
+    parser.add_argument('--max-batch-count', type=int, default=1000)
+    args = parser.parse_args()
+
+    sink = PublishSink()
+    events = synthetic_events(args.events, args.event_size)
+    client = NakadiClient('dummy_token', sink.url)
+
+    count = min(len(events), 2000)
+    started = time.perf_counter()
+    for event in events[:count]:
+        client.post_events('bench', [event])
+    print(f'{"post_events":>16}: {count / (time.perf_counter() - started):10.0f} events/s '
+          f'{sink.requests:6d} requests')
+
+    requests_before = sink.requests
+    started = time.perf_counter()
+    with NakadiPublisher(client, max_batch_count=args.max_batch_count) as publisher:
+        futures = [publisher.publish('bench', event) for event in events]
+    assert all(future.result() for future in futures)
+    print(f'{"NakadiPublisher":>16}: {len(events) / (time.perf_counter() - started):10.0f} events/s '
+          f'{sink.requests - requests_before:6d} requests')
+
+
+if __name__ == '__main__':
+    main()
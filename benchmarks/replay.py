@@ -0,0 +1,182 @@
+"""
+Replay helpers shared by the benchmarks.
+"""
+import json
+import random
+import socket
+import socketserver
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from itertools import accumulate
+from types import SimpleNamespace
+
+
+class ReplaySocket:
+    """
+    Socket stand-in that replays a recorded body. A single recv never crosses
+    a flush boundary, the way a server flushing every chunk is seen over TCP.
+    Every recv call would be a system call on a real socket, so their number
+    is reported next to the throughput.
+    """
+
+    def __init__(self, data, flushes):
+        self.data = memoryview(data)
+        self.flushes = flushes
+        self.pos = 0
+        self.flush = 0
+        self.calls = 0
+
+    def _next_size(self, bufsize):
+        while self.flush < len(self.flushes) and self.flushes[self.flush] <= self.pos:
+            self.flush += 1
+        end = self.flushes[self.flush] if self.flush < len(self.flushes) else len(self.data)
+        return min(bufsize, end - self.pos)
+
+    def recv(self, bufsize):
+        self.calls += 1
+        n = self._next_size(bufsize)
+        result = bytes(self.data[self.pos:self.pos + n])
+        self.pos += n
+        return result
+
+    def recv_into(self, buffer):
+        self.calls += 1
+        n = self._next_size(len(buffer))
+        buffer[:n] = self.data[self.pos:self.pos + n]
+        self.pos += n
+        return n
+
+    def settimeout(self, timeout):
+        pass
+
+    def setsockopt(self, *args):
+        pass
+
+
+WORDS = ['order', 'shipped', 'customer', 'article', 'price', 'EUR', 'warehouse', 'return',
+         'payment', 'size', 'colour', 'black', 'delivered', 'cancelled', 'zalando', 'berlin']
+
+
+def replay_response(sock):
+    return SimpleNamespace(raw=SimpleNamespace(connection=SimpleNamespace(sock=sock)),
+                           headers={})
+
+
+def synthetic_events(count, event_size, rnd=None):
+    """
+    Builds events with a random eid and a payload of about event_size bytes.
+    """
+    rnd = rnd or random.Random(0)
+    events = []
+    for _ in range(count):
+        payload = ' '.join(rnd.choice(WORDS) for _ in range(event_size // 6))
+        events.append({'metadata': {'eid': str(uuid.UUID(int=rnd.getrandbits(128))),
+                                    'occurred_at': '2020-02-01T20:00:00.000000+00:00'},
+                       'payload': payload[:event_size]})
+    return events
+
+
+def synthetic_payload(batches, events_per_batch, event_size):
+    """
+    Builds newline separated batch lines in Nakadi's compact layout.
+    """
+    rnd = random.Random(0)
+    lines = []
+    for offset in range(batches):
+        events = synthetic_events(events_per_batch, event_size, rnd)
+        batch = {'cursor': {'partition': str(offset % 8), 'offset': f'001-0001-{offset:018d}',
+                            'event_type': 'bench', 'cursor_token': 'token'},
+                 'events': events}
+        lines.append(json.dumps(batch, separators=(',', ':')).encode() + b'\n')
+    return b''.join(lines)
+
+
+def synthetic_stream(batches, events_per_batch, event_size, chunk_size):
+    """
+    Builds a chunked stream body and the offsets where the server flushed.
+    """
+    body = synthetic_payload(batches, events_per_batch, event_size)
+    chunks = [b'%x\r\n%s\r\n' % (len(body[i:i + chunk_size]), body[i:i + chunk_size])
+              for i in range(0, len(body), chunk_size)]
+    chunks.append(b'0\r\n\r\n')
+    flushes = list(accumulate(len(c) for c in chunks))
+    return b''.join(chunks), flushes
+
+
+def chunk_body(payload, chunk_size):
+    """
+    Frames payload into a chunked transfer encoded body.
+    """
+    chunks = [payload[i:i + chunk_size] for i in range(0, len(payload), chunk_size)]
+    return b''.join(b'%x\r\n%s\r\n' % (len(c), c) for c in chunks) + b'0\r\n\r\n'
+
+
+class _Server(socketserver.ThreadingMixIn, HTTPServer):
+    # http.server.ThreadingHTTPServer needs Python 3.7
+    daemon_threads = True
+
+
+class StreamServer:
+    """
+    Local HTTP server answering every request with a prepared chunked body.
+    Responses are gzip encoded when the request accepts it and a gzip body
+    is given. Counts the body bytes put on the wire.
+    """
+
+    def __init__(self, body, gzip_body=None):
+        self.body = body
+        self.gzip_body = gzip_body
+        self.bytes_sent = 0
+        self.server = socket.socket()
+        self.server.bind(('127.0.0.1', 0))
+        self.server.listen(16)
+        self.url = f'http://127.0.0.1:{self.server.getsockname()[1]}'
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    def _serve(self):
+        while True:
+            conn, _ = self.server.accept()
+            request = conn.recv(65536).lower()
+            headers = b'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n'
+            body = self.body
+            if self.gzip_body is not None and b'accept-encoding: gzip' in request:
+                headers += b'Content-Encoding: gzip\r\n'
+                body = self.gzip_body
+            conn.sendall(headers + b'\r\n')
+            conn.sendall(body)
+            self.bytes_sent += len(body)
+            conn.close()
+
+
+class PublishSink:
+    """
+    Local HTTP server accepting publish requests with 200 after latency
+    seconds. Counts requests and the request body bytes put on the wire.
+    """
+
+    def __init__(self, status=200, response_body=b'', latency=0):
+        sink = self
+        self.requests = 0
+        self.bytes_received = 0
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers['Content-Length']))
+                sink.requests += 1
+                sink.bytes_received += len(body)
+                time.sleep(latency)
+                self.send_response(status)
+                self.send_header('Content-Length', str(len(response_body)))
+                self.end_headers()
+                self.wfile.write(response_body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = _Server(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
@@ -0,0 +1,243 @@
+"""
+Benchmark suite comparing stream decode, publish and consume throughput
+across releases.
+
+Every case runs against a local socket: streams are replayed by a local
+server through NakadiStream, events are published to a local HTTP sink, and
+subscriptions are consumed from FakeNakadi with a commit per batch. Cases
+report MB/s, events/s, p50/p99 per-batch (or per-request) latency and the
+peak of memory allocated while they run, traced in an extra run with
+tracemalloc. Results are written as json; --compare prints the change
+against the results of an earlier run.
+
+    PYTHONPATH=. python benchmarks/suite.py --output results.json
+    PYTHONPATH=. python benchmarks/suite.py --quick --compare results.json
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import requests
+
+from pyNakadi import NakadiClient
+from pyNakadi.batch import LazyBatch
+from pyNakadi.client import NakadiStream, EndOfStreamException, EndOfStreamException0
+from pyNakadi.testing import FakeNakadi
+from replay import PublishSink, StreamServer, chunk_body, synthetic_events, synthetic_payload
+
+# metrics where lower is better, for --compare
+LOWER_IS_BETTER = ['p50_us', 'p99_us', 'alloc_peak_bytes']
+
+
+def percentile(values, q):
+    """
+    :param values: sorted list
+    :param q: 0 to 1
+    :return: nearest rank percentile
+    """
+    if not values:
+        return 0
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def summarize(elapsed, nbytes, nevents, latencies):
+    latencies = sorted(latencies)
+    return {'mb_per_s': nbytes / elapsed / 2 ** 20,
+            'events_per_s': nevents / elapsed,
+            'p50_us': percentile(latencies, 0.5) * 1e6,
+            'p99_us': percentile(latencies, 0.99) * 1e6}
+
+
+def measure(run, repeat):
+    """
+    Keeps the fastest of repeat runs and adds the allocation peak of one
+    more run traced by tracemalloc.
+    :param run: returns a summary
+    :return: summary
+    """
+    result = max((run() for _ in range(repeat)), key=lambda summary: summary['mb_per_s'])
+    tracemalloc.start()
+    try:
+        run()
+        result['alloc_peak_bytes'] = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return result
+
+
+def bench_stream(server, parse, events_per_batch):
+    """
+    :param events_per_batch: None to count the events of every batch, for
+        recordings
+    """
+    def run():
+        stream = NakadiStream(requests.get(server.url, stream=True), parse=parse)
+        nbytes = 0
+        nevents = 0
+        latencies = []
+        started = last = time.perf_counter()
+        try:
+            while True:
+                if parse:
+                    stream.next_parsed_batch()
+                else:
+                    stream.next_batch()
+                now = time.perf_counter()
+                latencies.append(now - last)
+                last = now
+                nbytes += len(stream.current_batch) + 1
+                if events_per_batch is None:
+                    nevents += LazyBatch(stream.current_batch, json.loads).count_events()
+                else:
+                    nevents += events_per_batch
+        except (EndOfStreamException, EndOfStreamException0):
+            pass
+        stream.close()
+        return summarize(time.perf_counter() - started, nbytes, nevents, latencies)
+
+    return run
+
+
+def bench_publish(sink, events, requests_count, compression):
+    client = NakadiClient('dummy_token', sink.url)
+
+    def run():
+        received = sink.bytes_received
+        latencies = []
+        started = time.perf_counter()
+        for _ in range(requests_count):
+            request_started = time.perf_counter()
+            client.post_events('bench', events, compression=compression)
+            latencies.append(time.perf_counter() - request_started)
+        elapsed = time.perf_counter() - started
+        return summarize(elapsed, sink.bytes_received - received, requests_count * len(events), latencies)
+
+    return run
+
+
+def bench_consume(events, batch_limit):
+    def run():
+        with FakeNakadi(partitions=4, batch_flush_timeout=0.01) as nakadi:
+            nakadi.create_event_type({'name': 'bench', 'owning_application': 'bench'})
+            nakadi.publish('bench', events)
+            subscription = nakadi.create_subscription({'owning_application': 'bench', 'event_types': ['bench'],
+                                                       'read_from': 'begin'})
+            client = NakadiClient('dummy_token', nakadi.url)
+            stream = client.get_subscription_events_stream(subscription['id'], batch_limit=batch_limit,
+                                                           max_uncommitted_events=4 * batch_limit, parse=True)
+            nbytes = 0
+            consumed = 0
+            latencies = []
+            started = last = time.perf_counter()
+            while consumed < len(events):
+                batch = stream.next_parsed_batch()
+                client.commit_subscription_cursors(subscription['id'], stream.stream_id, [batch['cursor']])
+                now = time.perf_counter()
+                latencies.append(now - last)
+                last = now
+                nbytes += len(stream.current_batch) + 1
+                consumed += len(batch['events'])
+            elapsed = time.perf_counter() - started
+            stream.close()
+        return summarize(elapsed, nbytes, consumed, latencies)
+
+    return run
+
+
+def stream_cases(args):
+    if args.recording:
+        with open(args.recording, 'rb') as f:
+            body = f.read()
+        yield {'recording': os.path.basename(args.recording), 'parse': False}, body, None
+        return
+    sizes = [(1, 200), (100, 200), (10, 5000)] if not args.quick else [(1, 200), (100, 200)]
+    chunk_sizes = [1024, 65536] if not args.quick else [65536]
+    for (events_per_batch, event_size), chunk_size, parse in itertools.product(sizes, chunk_sizes, [False, True]):
+        batches = max(1, args.events // events_per_batch)
+        payload = synthetic_payload(batches, events_per_batch, event_size)
+        params = {'events_per_batch': events_per_batch, 'event_size': event_size, 'chunk_size': chunk_size,
+                  'parse': parse}
+        yield params, chunk_body(payload, chunk_size), events_per_batch
+
+
+def run_suite(args):
+    results = []
+
+    def record(benchmark, params, run):
+        result = dict({'benchmark': benchmark, 'params': params}, **measure(run, args.repeat))
+        results.append(result)
+        print(f"{benchmark:>8} {json.dumps(params, sort_keys=True):<90} {result['mb_per_s']:8.1f} MB/s "
+              f"{result['events_per_s']:10.0f} events/s p50 {result['p50_us']:8.0f} us "
+              f"p99 {result['p99_us']:8.0f} us {result['alloc_peak_bytes'] / 1024:8.0f} KiB")
+
+    for params, body, events_per_batch in stream_cases(args):
+        server = StreamServer(body)
+        record('stream', params, bench_stream(server, params['parse'], events_per_batch))
+
+    sink = PublishSink()
+    for events_per_request, event_size, compression in itertools.product(
+            [1, 100] if args.quick else [1, 100, 1000], [200, 2000], [None, 'gzip']):
+        events = synthetic_events(events_per_request, event_size)
+        requests_count = max(10, args.events // events_per_request // 10)
+        record('publish', {'events_per_request': events_per_request, 'event_size': event_size,
+                           'compression': compression},
+               bench_publish(sink, events, requests_count, compression))
+
+    for batch_limit in [10, 100] if args.quick else [1, 10, 100]:
+        events = synthetic_events(min(args.events, 200 * batch_limit), 200)
+        record('consume', {'batch_limit': batch_limit, 'event_size': 200}, bench_consume(events, batch_limit))
+    return results
+
+
+def compare(results, baseline):
+    """
+    Prints the change of every metric against the baseline run.
+    """
+    previous = {(result['benchmark'], json.dumps(result['params'], sort_keys=True)): result
+                for result in baseline['results']}
+    for result in results:
+        key = (result['benchmark'], json.dumps(result['params'], sort_keys=True))
+        if key not in previous:
+            continue
+        changes = []
+        for metric in ['mb_per_s', 'events_per_s'] + LOWER_IS_BETTER:
+            if previous[key][metric]:
+                changes.append(f'{metric} {(result[metric] / previous[key][metric] - 1) * 100:+6.1f}%')
+        print(f'{key[0]:>8} {key[1]:<90} ' + ' '.join(changes))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--output', help='json file to write the results to')
+    parser.add_argument('--compare', help='json results of an earlier run')
+    parser.add_argument('--recording', help='raw chunked body to replay instead of synthetic streams')
+    parser.add_argument('--events', type=int, default=20000, help='events per stream case')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--quick', action='store_true', help='fewer cases, e.g. for CI')
+    args = parser.parse_args()
+
+    results = run_suite(args)
+    with open(os.path.join(os.path.dirname(__file__), '..', 'VERSION')) as f:
+        version = f.read().strip()
+    report = {'version': version,
+              'created_at': datetime.now(timezone.utc).isoformat(),
+              'python': platform.python_version(),
+              'implementation': platform.python_implementation(),
+              'machine': platform.machine(),
+              'arguments': vars(args),
+              'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
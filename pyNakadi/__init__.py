@@ -1 +1,14 @@
-from pyNakadi.client import NakadiClient, NakadiStream, NakadiException
+from pyNakadi.client import NakadiClient, NakadiStream, NakadiException, NakadiPublishException, StreamOptions
+from pyNakadi.publisher import NakadiPublisher
+from pyNakadi.aio import AsyncNakadiClient, AsyncNakadiStream
+from pyNakadi.consumer import CursorCommitter, PartitionDispatcher, SubscriptionConsumer
+from pyNakadi.adaptive import AdaptiveConsumer, BatchSizeController
+from pyNakadi.multiplexer import StreamMultiplexer
+from pyNakadi.reconnect import ReconnectingStream
+from pyNakadi.prefetch import PrefetchStream
+from pyNakadi.monitoring import LagMonitor
+from pyNakadi.cache import MetadataCache
+from pyNakadi.partitioning import Partitioner
+from pyNakadi.validation import EventValidator
+from pyNakadi.metrics import NoopMetrics, PrometheusMetrics, StatsdMetrics
+from pyNakadi.recording import RecordedStream, StreamRecorder
@@ -0,0 +1,220 @@
+import threading
+import time
+
+from pyNakadi.client import NakadiClient, NakadiException
+from pyNakadi.consumer import SubscriptionConsumer
+
+
+class BatchSizeController:
+    """
+    Decides the batch_limit of a subscription stream from its lag and the
+    time batches take to handle. The batch_limit doubles while the
+    subscription falls behind by more than grow_lag_batches batches, and
+    halves once it is caught up to shrink_lag_batches batches or batches
+    take longer than target_batch_seconds to handle, which delays their
+    events and commits. A change needs patience evaluations in a row voting
+    for it and cooldown seconds since the last change, so the stream is not
+    reopened over and over at a boundary.
+    """
+
+    def __init__(self, batch_limit=None, min_batch_limit=1, max_batch_limit=1000,
+                 grow_lag_batches=10, shrink_lag_batches=1, target_batch_seconds=1.0,
+                 patience=2, cooldown=60, uncommitted_batches=4):
+        """
+        :param batch_limit: initial batch_limit, min_batch_limit if None
+        :param min_batch_limit:
+        :param max_batch_limit:
+        :param grow_lag_batches: grow while more batches than this are
+            unconsumed and the lag does not shrink
+        :param shrink_lag_batches: shrink when at most this many batches are
+            unconsumed
+        :param target_batch_seconds: shrink when handling a batch takes longer
+            on average
+        :param patience: evaluations in a row a change needs
+        :param cooldown: min seconds between changes
+        :param uncommitted_batches: max_uncommitted_events in batches, so
+            Nakadi can send ahead while batches are handled
+        """
+        NakadiClient.assert_it(0 < min_batch_limit <= max_batch_limit,
+                               NakadiException(code=1, msg='min_batch_limit must be in 1..max_batch_limit'))
+        NakadiClient.assert_it(shrink_lag_batches < grow_lag_batches,
+                               NakadiException(code=1, msg='shrink_lag_batches must be below grow_lag_batches'))
+        self.batch_limit = min(max(batch_limit or min_batch_limit, min_batch_limit), max_batch_limit)
+        self.min_batch_limit = min_batch_limit
+        self.max_batch_limit = max_batch_limit
+        self.grow_lag_batches = grow_lag_batches
+        self.shrink_lag_batches = shrink_lag_batches
+        self.target_batch_seconds = target_batch_seconds
+        self.patience = patience
+        self.cooldown = cooldown
+        self.uncommitted_batches = uncommitted_batches
+        self._batches = 0
+        self._seconds = 0.0
+        self._previous_lag = None
+        self._votes = 0
+        self._changed_at = None
+
+    def stream_params(self):
+        """
+        :return: stream parameters for the current batch_limit
+        """
+        return {'batch_limit': self.batch_limit,
+                'max_uncommitted_events': self.batch_limit * self.uncommitted_batches}
+
+    def observe(self, seconds):
+        """
+        Records the time one batch took to handle.
+        :param seconds:
+        :return:
+        """
+        self._batches += 1
+        self._seconds += seconds
+
+    def evaluate(self, lag, now=None):
+        """
+        Decides on the batches observed since the last evaluation.
+        :param lag: unconsumed events of the subscription
+        :param now: time.monotonic() value
+        :return: the new batch_limit, or None if it stays
+        """
+        now = time.monotonic() if now is None else now
+        batch_seconds = self._seconds / self._batches if self._batches else 0.0
+        lag_batches = lag / self.batch_limit
+        vote = 0
+        if batch_seconds > self.target_batch_seconds or lag_batches <= self.shrink_lag_batches:
+            vote = -1
+        elif lag_batches > self.grow_lag_batches and (self._previous_lag is None or lag >= self._previous_lag):
+            vote = 1
+        self._batches = 0
+        self._seconds = 0.0
+        self._previous_lag = lag
+        if vote == 0 or (vote > 0) != (self._votes > 0):
+            self._votes = vote
+        else:
+            self._votes += vote
+        if abs(self._votes) < self.patience:
+            return None
+        if self._changed_at is not None and now - self._changed_at < self.cooldown:
+            return None
+        if vote > 0:
+            batch_limit = min(self.batch_limit * 2, self.max_batch_limit)
+        else:
+            batch_limit = max(self.batch_limit // 2, self.min_batch_limit)
+        if batch_limit == self.batch_limit:
+            return None
+        self.batch_limit = batch_limit
+        self._votes = 0
+        self._changed_at = now
+        return batch_limit
+
+
+class AdaptiveConsumer:
+    """
+    SubscriptionConsumer whose batch_limit and max_uncommitted_events follow
+    the load. Handler times are collected for a BatchSizeController, which
+    a background thread evaluates every check_interval seconds together
+    with the lag from get_subscription_stats, so the stats request never
+    delays batches. When it decides on a new batch_limit the current stream
+    is stopped after the batch being handled, its cursors are committed and
+    a stream with the new parameters is opened.
+    """
+
+    def __init__(self, client, subscription_id, handler, controller=None, check_interval=30,
+                 **consumer_params):
+        """
+        :param client: NakadiClient
+        :param subscription_id:
+        :param handler: called with every batch carrying events
+        :param controller: BatchSizeController, one with default settings if
+            None
+        :param check_interval: seconds between evaluations
+        :param consumer_params: passed to SubscriptionConsumer, except
+            batch_limit and max_uncommitted_events. Handler times are taken
+            in worker threads, processes are not supported.
+        """
+        NakadiClient.assert_it(not {'batch_limit', 'max_uncommitted_events'} & set(consumer_params),
+                               NakadiException(code=1, msg='batch_limit and max_uncommitted_events are adaptive'))
+        NakadiClient.assert_it(not consumer_params.get('processes'),
+                               NakadiException(code=1, msg='AdaptiveConsumer does not support processes'))
+        self.client = client
+        self.subscription_id = subscription_id
+        self.handler = handler
+        self.controller = controller or BatchSizeController()
+        self.check_interval = check_interval
+        self.consumer_params = consumer_params
+        self.consumer = None
+        self.resizes = 0
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._running = False
+        self._resize = False
+        self._stopped = False
+
+    def run(self):
+        """
+        Consumes streams until one ends without a resize or stop is called.
+        :return: number of batches handled
+        """
+        sampler = threading.Thread(target=self._sample, name='NakadiLagSampler', daemon=True)
+        sampler.start()
+        handled = 0
+        try:
+            while not self._stopped:
+                consumer = SubscriptionConsumer(self.client, self.subscription_id, self._handle,
+                                                **self.consumer_params, **self.controller.stream_params())
+                with self._lock:
+                    self.consumer = consumer
+                    self._resize = False
+                    self._running = True
+                if self._stopped:
+                    break
+                try:
+                    handled += consumer.run()
+                finally:
+                    with self._lock:
+                        self._running = False
+                if not self._resize:
+                    break
+                self.resizes += 1
+        finally:
+            self._wakeup.set()
+            sampler.join()
+            self._wakeup.clear()
+        return handled
+
+    def stop(self):
+        """
+        Stops run like SubscriptionConsumer.stop.
+        :return:
+        """
+        self._stopped = True
+        self._wakeup.set()
+        if self.consumer is not None:
+            self.consumer.stop()
+
+    def get_lag(self):
+        """
+        :return: unconsumed events of the subscription
+        """
+        stats = self.client.get_subscription_stats(self.subscription_id)
+        return sum(partition.get('unconsumed_events', 0)
+                   for item in stats['items'] for partition in item['partitions'])
+
+    def _handle(self, batch):
+        started = time.monotonic()
+        self.handler(batch)
+        seconds = time.monotonic() - started
+        with self._lock:
+            self.controller.observe(seconds)
+
+    def _sample(self):
+        while not self._wakeup.wait(self.check_interval):
+            try:
+                lag = self.get_lag()
+            except (NakadiException, OSError):
+                # the next sample decides
+                continue
+            with self._lock:
+                if self._running and not self._resize and self.controller.evaluate(lag) is not None:
+                    self._resize = True
+                    self.consumer.stop()
@@ -0,0 +1,669 @@
+import asyncio
+import gzip
+import json
+import time
+import uuid
+from urllib.parse import urlsplit
+
+from requests.structures import CaseInsensitiveDict
+
+from pyNakadi.batch import LazyBatch
+from pyNakadi.client import NakadiClient, NakadiException, NakadiPublishException, \
+    EndOfStreamException, EndOfStreamException0, _PublishRetry, _check_publish_response, _encode_publish_body, \
+    _prepare_publish
+from pyNakadi.framing import ChunkedDecoder, GzipDecompressor, LineBuffer
+from pyNakadi.metrics import REQUEST, endpoint
+from pyNakadi.serialization import get_json_decoder, get_json_encoder
+
+
+class _Connection:
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    def close(self):
+        self.writer.close()
+
+    def closed(self):
+        return self.writer.transport.is_closing() or self.reader.at_eof()
+
+
+class AsyncNakadiStream:
+    """
+    Asynchronous iterator that generates batches, the asyncio counterpart of
+    NakadiStream with the same chunk decoding and batch framing. This stream
+    is either created by a get_subscription_events_stream method or
+    get_event_type_events_stream method of AsyncNakadiClient.
+    """
+    BUFFER_SIZE = 64 * 1024
+
+    def __init__(self, connection, headers, parse=False, json_decoder=None, read_timeout=30):
+        """
+        :param connection: connection the response headers were read from
+        :param headers: response headers
+        :param parse: see NakadiStream
+        :param json_decoder: see NakadiStream
+        :param read_timeout: seconds to wait for data, None waits forever
+        """
+        self.connection = connection
+        self.headers = headers
+        self.parse = parse
+        self.json_loads = get_json_decoder(json_decoder)
+        self.read_timeout = read_timeout
+        self.current_batch = None
+        # set by StreamRecorder.record
+        self.recorder = None
+        self.decoder = ChunkedDecoder(self.BUFFER_SIZE)
+        self.lines = LineBuffer(self.BUFFER_SIZE)
+        if headers.get('Content-Encoding') == 'gzip':
+            self._payload_sink = GzipDecompressor(self.lines)
+        else:
+            self._payload_sink = self.lines
+
+        if 'X-Nakadi-StreamId' in headers:
+            self.stream_id = headers['X-Nakadi-StreamId']
+        else:
+            self.stream_id = str(uuid.uuid4())
+
+    async def read_buffer(self):
+        """
+        Receives at most BUFFER_SIZE bytes into the decoder's buffer.
+        :return: number of bytes received
+        """
+        read = self.connection.reader.read(self.BUFFER_SIZE)
+        if self.read_timeout is not None:
+            read = asyncio.wait_for(read, self.read_timeout)
+        data = await read
+        if not data:
+            raise EndOfStreamException
+        self.decoder.feed(data)
+        return len(data)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.parse:
+            return await self.next_parsed_batch(lazy=self.parse == 'lazy')
+        return await self.next_batch()
+
+    async def next_batch(self, view=False):
+        """
+        Reads the next batch line of the stream.
+        :param view: see NakadiStream.next_batch
+        :return: batch without its trailing newline
+        """
+        batch = self.lines.next_line(view)
+        while batch is None:
+            if not self.decoder.decode_into(self._payload_sink):
+                if self.decoder.finished:
+                    raise EndOfStreamException0
+                await self.read_buffer()
+            batch = self.lines.next_line(view)
+        self.current_batch = batch
+        if self.recorder is not None:
+            self.recorder.write(self.stream_id, batch)
+        return self.current_batch
+
+    async def next_parsed_batch(self, lazy=False):
+        """
+        Reads and decodes the next batch that carries events. Keep-alive
+        batches without events are skipped.
+        :param lazy: only decode the cursor and return a LazyBatch
+        :return: batch map with cursor, events and optionally info
+        """
+        batch = self._decode(await self.next_batch(), lazy)
+        while 'events' not in batch:
+            batch = self._decode(await self.next_batch(), lazy)
+        return batch
+
+    async def batches(self, lazy=False):
+        """
+        Generates decoded batches that carry events.
+        :param lazy: generate LazyBatch objects
+        :return: asynchronous generator of batch maps
+        """
+        while True:
+            yield await self.next_parsed_batch(lazy)
+
+    def _decode(self, raw, lazy):
+        if lazy:
+            return LazyBatch(raw, self.json_loads)
+        return self.json_loads(raw)
+
+    def get_stream_id(self):
+        """
+        :return: X-Nakadi-StreamId
+        """
+        return self.stream_id
+
+    def close(self):
+        """
+        Closes network stream.
+        :return:
+        """
+        self.connection.close()
+
+    def closed(self):
+        """
+        Flag if network stream is closed or not.
+        :return:
+        """
+        return self.connection.closed()
+
+
+class AsyncNakadiClient:
+    """
+    asyncio counterpart of NakadiClient with the same methods as coroutines.
+    It speaks HTTP/1.1 over asyncio streams: requests share a pool of at
+    most pool_maxsize keep-alive connections while every event stream holds
+    its own connection, so one event loop can drive thousands of streams.
+    """
+    BUFFER_SIZE = 64 * 1024
+    PUBLISH_COMPRESS_LEVEL = NakadiClient.PUBLISH_COMPRESS_LEVEL
+    PUBLISH_RETRY_BACKOFF = NakadiClient.PUBLISH_RETRY_BACKOFF
+    PUBLISH_RETRY_BACKOFF_MAX = NakadiClient.PUBLISH_RETRY_BACKOFF_MAX
+    IDEMPOTENT_METHODS = ['GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS']
+
+    def __init__(self, token, nakadi_url, json_decoder=None, json_encoder=None,
+                 pool_maxsize=10, ssl=None, metrics=None):
+        """
+        Initiates an asynchronous Nakadi client using the token and aiming for url
+        :param token: token string to be used
+        :param nakadi_url: url for nakadi server
+        :param json_decoder: see NakadiClient
+        :param json_encoder: see NakadiClient
+        :param pool_maxsize: max concurrent requests other than event streams
+        :param ssl: ssl.SSLContext for https urls, default context if None
+        :param metrics: sink of request metrics, see NakadiClient
+        """
+        self.token = token
+        self.nakadi_url = nakadi_url
+        self.json_decoder = json_decoder
+        self.json_dumps = get_json_encoder(json_encoder)
+        self.pool_maxsize = pool_maxsize
+        self.metrics = metrics
+        url = urlsplit(nakadi_url)
+        self.host = url.hostname
+        self.port = url.port or (443 if url.scheme == 'https' else 80)
+        self.ssl = (ssl or True) if url.scheme == 'https' else None
+        self.base_path = url.path.rstrip('/')
+        self.headers = {
+            "Host": url.netloc,
+            "Authorization": f"Bearer {token}",
+            "Content-Type": "application/json"
+        }
+        self._idle = []
+        self._slots = None
+
+    async def close(self):
+        """
+        Closes idle pooled connections. Event streams are closed on their own.
+        :return:
+        """
+        idle, self._idle = self._idle, []
+        for connection in idle:
+            connection.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def _connect(self):
+        reader, writer = await asyncio.open_connection(self.host, self.port, ssl=self.ssl,
+                                                       limit=self.BUFFER_SIZE)
+        return _Connection(reader, writer)
+
+    async def _request(self, method, path, body=None, headers=None):
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.pool_maxsize)
+        async with self._slots:
+            while True:
+                reused = bool(self._idle)
+                connection = self._idle.pop() if reused else await self._connect()
+                if reused and connection.closed():
+                    connection.close()
+                    continue
+                try:
+                    status, response_headers = await self._exchange(connection, method, path, body, headers)
+                    content, keep_alive = await self._read_body(connection, status, response_headers)
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    connection.close()
+                    if reused and method in self.IDEMPOTENT_METHODS:
+                        # the server closed the pooled connection meanwhile.
+                        # Others are not sent again, the server may have
+                        # handled them already.
+                        continue
+                    raise
+                except BaseException:
+                    # e.g. cancelled, the response may still be pending
+                    connection.close()
+                    raise
+                if keep_alive:
+                    self._idle.append(connection)
+                else:
+                    connection.close()
+                return status, response_headers, content
+
+    async def _exchange(self, connection, method, path, body, headers):
+        request_headers = dict(self.headers)
+        if headers is not None:
+            request_headers.update(headers)
+        request_headers['Content-Length'] = str(len(body or b''))
+        head = f"{method} {self.base_path}{path} HTTP/1.1\r\n" + \
+               ''.join(f"{k}: {v}\r\n" for k, v in request_headers.items()) + "\r\n"
+        started = time.perf_counter()
+        connection.writer.write(head.encode('latin-1') + (body or b''))
+        await connection.writer.drain()
+
+        response_head = await connection.reader.readuntil(b'\r\n\r\n')
+        status_line, *header_lines = response_head.decode('latin-1').split('\r\n')
+        status = int(status_line.split(' ', 2)[1])
+        if self.metrics is not None:
+            self.metrics.timing(REQUEST, time.perf_counter() - started,
+                                {'method': method, 'endpoint': endpoint(path), 'status': status})
+        response_headers = CaseInsensitiveDict()
+        for line in header_lines:
+            if line:
+                key, value = line.split(':', 1)
+                response_headers[key.strip()] = value.strip()
+        return status, response_headers
+
+    async def _read_body(self, connection, status, headers):
+        keep_alive = headers.get('Connection', '').lower() != 'close'
+        if headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            decoder = ChunkedDecoder(self.BUFFER_SIZE)
+            chunks = []
+            while True:
+                chunk = decoder.read_chunk()
+                if chunk is None or (chunk == b'' and decoder.pending() < 2):
+                    # need more data, for the last chunk its closing CRLF
+                    data = await connection.reader.read(self.BUFFER_SIZE)
+                    if not data:
+                        raise asyncio.IncompleteReadError(b''.join(chunks), None)
+                    decoder.feed(data)
+                elif chunk == b'':
+                    break
+                else:
+                    chunks.append(chunk)
+            content = b''.join(chunks)
+        elif 'Content-Length' in headers:
+            content = await connection.reader.readexactly(int(headers['Content-Length']))
+        elif status in [204, 304] or status < 200:
+            content = b''
+        else:
+            content = await connection.reader.read()
+            keep_alive = False
+        if headers.get('Content-Encoding') == 'gzip':
+            content = gzip.decompress(content)
+        return content, keep_alive
+
+    async def _call(self, method, path, name, expected=(200,), json_data=None, headers=None):
+        body = None if json_data is None else self.json_dumps(json_data)
+        status, _, content = await self._request(method, path, body, headers)
+        response_content_str = content.decode('utf-8')
+        if status not in expected:
+            raise NakadiException(
+                code=status,
+                msg=f"Error during {name}. "
+                    + f"Message from server:{status} {response_content_str}")
+        return status, response_content_str
+
+    async def _call_json(self, method, path, name, expected=(200,), json_data=None):
+        _, response_content_str = await self._call(method, path, name, expected, json_data)
+        return json.loads(response_content_str)
+
+    async def _open_stream(self, path, name, headers, parse, read_timeout):
+        connection = await self._connect()
+        try:
+            status, response_headers = await self._exchange(connection, 'GET', path, None, headers)
+            if status not in [200]:
+                content, _ = await self._read_body(connection, status, response_headers)
+                response_content_str = content.decode('utf-8')
+                raise NakadiException(
+                    code=status,
+                    msg=f"Error during {name}. "
+                        + f"Message from server:{status} {response_content_str}")
+        except BaseException:
+            connection.close()
+            raise
+        return AsyncNakadiStream(connection, response_headers, parse=parse,
+                                 json_decoder=self.json_decoder, read_timeout=read_timeout)
+
+    @classmethod
+    def _stream_headers(cls, compression):
+        NakadiClient.assert_it(compression in [None, 'gzip'],
+                               NakadiException(code=1, msg='compression must be None or gzip'))
+        return {} if compression is None else {'Accept-Encoding': compression}
+
+    @classmethod
+    def _query(cls, **params):
+        query_str = ''.join(f'&{k}={v}' for k, v in params.items() if v is not None)
+        return '?' + query_str[1:] if query_str != '' else ''
+
+    async def get_metrics(self):
+        """
+        GET /metrics
+        :return:
+        """
+        return await self._call_json('GET', '/metrics', 'get_metrics')
+
+    async def get_event_types(self):
+        """
+        GET /event-types
+        :return:
+        """
+        return await self._call_json('GET', '/event-types', 'get_event_types')
+
+    async def create_event_type(self, event_type_data_map):
+        """
+        POST /event-types
+        :param event_type_data_map:
+        :return:
+        """
+        await self._call('POST', '/event-types', 'create_event_type', [201], event_type_data_map)
+        return True
+
+    async def get_event_type(self, event_type_name):
+        """
+        GET /event-types/{name}
+        :param event_type_name:
+        :return:
+        """
+        return await self._call_json('GET', f'/event-types/{event_type_name}', 'get_event_type')
+
+    async def update_event_type(self, event_type_name, event_type_data_map):
+        """
+        PUT /event-types/{name}
+        :param event_type_name:
+        :param event_type_data_map:
+        :return:
+        """
+        await self._call('PUT', f'/event-types/{event_type_name}', 'update_event_type', [200],
+                         event_type_data_map)
+        return True
+
+    async def delete_event_type(self, event_type_name):
+        """
+        DELETE /event-types/{name}
+        :param event_type_name:
+        :return:
+        """
+        await self._call('DELETE', f'/event-types/{event_type_name}', 'delete_event_type')
+        return True
+
+    async def get_event_type_cursor_distances(self, event_type_name, query_map):
+        """
+        POST /event-types/{name}/cursor-distances
+        :param event_type_name:
+        :param query_map:
+        :return:
+        """
+        return await self._call_json('POST', f'/event-types/{event_type_name}/cursor-distances',
+                                     'get_event_type_cursor_distances', json_data=query_map)
+
+    async def get_event_type_cursor_lag(self, event_type_name, cursors_map):
+        """
+        POST /event-types/{name}/cursors-lag
+        :param event_type_name:
+        :param cursors_map:
+        :return:
+        """
+        return await self._call_json('POST', f'/event-types/{event_type_name}/cursors-lag',
+                                     'get_event_type_cursor_lag', json_data=cursors_map)
+
+    async def post_events(self, event_type_name, events, compression=None,
+                          retry_failed_only=False, max_retries=3):
+        """
+        POST /event-types/{name}/events
+        :param event_type_name:
+        :param events: see NakadiClient.post_events
+        :param compression: 'gzip' to send a compressed request body
+        :param retry_failed_only: see NakadiClient.post_events
+        :param max_retries: max re-posts when retry_failed_only is set
+        :return: True, NakadiPublishException names the events not published
+        """
+        events = _prepare_publish(events, compression)
+        if not retry_failed_only:
+            return await self._post_events(event_type_name, events, compression)
+
+        retry = _PublishRetry(events, max_retries, self.PUBLISH_RETRY_BACKOFF, self.PUBLISH_RETRY_BACKOFF_MAX)
+        for delay, pending_events in retry.attempts():
+            if delay:
+                await asyncio.sleep(delay)
+            try:
+                await self._post_events(event_type_name, pending_events, compression)
+            except NakadiPublishException as ex:
+                retry.failed(ex)
+            else:
+                retry.submitted()
+        return retry.result()
+
+    async def _post_events(self, event_type_name, events, compression):
+        data, headers = _encode_publish_body(events, self.json_dumps, compression, self.PUBLISH_COMPRESS_LEVEL)
+        status, _, content = await self._request('POST', f'/event-types/{event_type_name}/events',
+                                                 data, headers)
+        _check_publish_response(status, content.decode('utf-8'), events)
+        return True
+
+    async def post_events_many(self, events_by_event_type, compression=None):
+        """
+        Posts events of several event types concurrently, one post_events
+        request per event type, at most pool_maxsize at once.
+        :param events_by_event_type: map of event type name to events
+        :param compression: see post_events
+        :return: map of event type name to True, or to the exception its
+            post_events raised
+        """
+        results = await asyncio.gather(
+            *[self.post_events(event_type_name, events, compression=compression)
+              for event_type_name, events in events_by_event_type.items()],
+            return_exceptions=True)
+        return dict(zip(events_by_event_type, results))
+
+    async def get_event_type_events_stream(self,
+                                           event_name,
+                                           batch_limit=1,
+                                           stream_limit=0,
+                                           batch_flush_timeout=30,
+                                           stream_timeout=0,
+                                           stream_keep_alive_limit=0,
+                                           cursors=None,
+                                           parse=False,
+                                           compression=None,
+                                           read_timeout=30):
+        """
+        GET /event-types/{name}/events
+        :param event_name:
+        :param batch_limit:
+        :param stream_limit:
+        :param batch_flush_timeout:
+        :param stream_timeout:
+        :param stream_keep_alive_limit:
+        :param cursors:
+        :param parse: see NakadiClient.get_event_type_events_stream
+        :param compression: 'gzip' to receive a compressed stream
+        :param read_timeout: seconds to wait for data, None waits forever
+        :return: AsyncNakadiStream
+        """
+        headers = self._stream_headers(compression)
+        if cursors is not None:
+            headers['X-nakadi-cursors'] = json.dumps(cursors)
+        query_str = self._query(batch_limit=batch_limit,
+                                stream_limit=stream_limit,
+                                batch_flush_timeout=batch_flush_timeout,
+                                stream_timeout=stream_timeout,
+                                stream_keep_alive_limit=stream_keep_alive_limit)
+        return await self._open_stream(f'/event-types/{event_name}/events{query_str}',
+                                       'get_event_type_events_stream', headers, parse, read_timeout)
+
+    async def get_event_type_partitions(self, event_type_name):
+        """
+        GET /event-types/{name}/partitions
+        :param event_type_name:
+        :return:
+        """
+        return await self._call_json('GET', f'/event-types/{event_type_name}/partitions',
+                                     'get_event_type_partitions')
+
+    async def get_event_type_partition(self, event_type_name, partition_id):
+        """
+        GET /event-types/{name}/partitions/{partition}
+        :param event_type_name:
+        :param partition_id:
+        :return:
+        """
+        return await self._call_json('GET', f'/event-types/{event_type_name}/partitions/{partition_id}',
+                                     'get_event_type_partition')
+
+    async def get_subscriptions(self, owning_application=None, event_type=None,
+                                limit=20,
+                                offset=0):
+        """
+        GET /subscriptions
+        :param owning_application:
+        :param event_type:
+        :param limit:
+        :param offset:
+        :return:
+        """
+        NakadiClient.assert_it(limit >= 1,
+                               NakadiException(code=1, msg='limit must be >=1'))
+        NakadiClient.assert_it(limit <= 1000,
+                               NakadiException(code=1, msg='limit must be <=1000'))
+        NakadiClient.assert_it(offset >= 0,
+                               NakadiException(code=1, msg='offset must be >=0'))
+        query_str = self._query(limit=limit, offset=offset, owning_application=owning_application)
+        if event_type is not None:
+            query_str += ''.join(f'&event_type={item}' for item in event_type)
+        return await self._call_json('GET', f'/subscriptions{query_str}', 'get_subscriptions')
+
+    async def get_next_subscriptions(self, subscriptions_response):
+        if 'next' not in subscriptions_response['_links']:
+            return None
+        return await self._call_json('GET', subscriptions_response['_links']['next']['href'],
+                                     'get_subscriptions')
+
+    async def get_prev_subscriptions(self, subscriptions_response):
+        if 'prev' not in subscriptions_response['_links']:
+            return None
+        return await self._call_json('GET', subscriptions_response['_links']['prev']['href'],
+                                     'get_subscriptions')
+
+    async def create_subscription(self, subscription_data_map):
+        """
+        POST /subscriptions
+        :param subscription_data_map:
+        :return:
+        """
+        return await self._call_json('POST', '/subscriptions', 'create_subscription', [200, 201],
+                                     subscription_data_map)
+
+    async def create_subscription_v2(self, subscription_data_map):
+        """
+        POST /subscriptions
+        :param subscription_data_map:
+        :return: (status code, subscription)
+        """
+        status, response_content_str = await self._call('POST', '/subscriptions', 'create_subscription',
+                                                        [200, 201], subscription_data_map)
+        return (status, json.loads(response_content_str))
+
+    async def get_subscription(self, subscription_id):
+        """
+        GET /subscriptions/{subscription_id}
+        :param subscription_id:
+        :return:
+        """
+        return await self._call_json('GET', f'/subscriptions/{subscription_id}', 'get_subscription')
+
+    async def delete_subscription(self, subscription_id):
+        """
+        DELETE /subscriptions/{subscription_id}
+        :param subscription_id:
+        :return:
+        """
+        await self._call('DELETE', f'/subscriptions/{subscription_id}', 'delete_subscription', [204])
+
+    async def get_subscription_events_stream(self,
+                                             subscription_id,
+                                             max_uncommitted_events=None,
+                                             batch_limit=None,
+                                             stream_limit=None,
+                                             batch_flush_timeout=None,
+                                             stream_timeout=None,
+                                             stream_keep_alive_limit=None,
+                                             commit_timeout=None,
+                                             parse=False,
+                                             compression=None,
+                                             read_timeout=30):
+        """
+        GET /subscriptions/{subscription_id}/events
+        :param subscription_id:
+        :param max_uncommitted_events:
+        :param batch_limit:
+        :param stream_limit:
+        :param batch_flush_timeout:
+        :param stream_timeout:
+        :param stream_keep_alive_limit:
+        :param commit_timeout:
+        :param parse: see NakadiClient.get_subscription_events_stream
+        :param compression: 'gzip' to receive a compressed stream
+        :param read_timeout: seconds to wait for data, None waits forever
+        :return: AsyncNakadiStream
+        """
+        query_str = self._query(max_uncommitted_events=max_uncommitted_events,
+                                batch_limit=batch_limit,
+                                stream_limit=stream_limit,
+                                batch_flush_timeout=batch_flush_timeout,
+                                stream_timeout=stream_timeout,
+                                stream_keep_alive_limit=stream_keep_alive_limit,
+                                commit_timeout=commit_timeout)
+        return await self._open_stream(f'/subscriptions/{subscription_id}/events{query_str}',
+                                       'get_subscription_events_stream', self._stream_headers(compression),
+                                       parse, read_timeout)
+
+    async def get_subscription_stats(self, subscription_id, show_time_lag=False):
+        """
+        GET /subscriptions/{subscription_id}/stats
+        :param subscription_id:
+        :param show_time_lag:
+        :return:
+        """
+        return await self._call_json(
+            'GET', f'/subscriptions/{subscription_id}/stats?show_time_lag={str(show_time_lag).lower()}',
+            'get_subscription_stats')
+
+    async def get_subscription_cursors(self, subscription_id):
+        """
+        GET /subscriptions/{subscription_id}/cursors
+        :param subscription_id:
+        :return:
+        """
+        return await self._call_json('GET', f'/subscriptions/{subscription_id}/cursors',
+                                     'get_subscription_cursors')
+
+    async def commit_subscription_cursors(self, subscription_id, stream_id, cursors):
+        """
+        POST /subscriptions/{subscription_id}/cursors
+        :param subscription_id:
+        :param stream_id:
+        :param cursors:
+        :return:
+        """
+        await self._call('POST', f'/subscriptions/{subscription_id}/cursors', 'commit_subscription_cursors',
+                         [204], {'items': cursors}, {'X-Nakadi-StreamId': stream_id})
+        return True
+
+    async def reset_subscription_cursors(self, subscription_id, cursors):
+        """
+        PATCH /subscriptions/{subscription_id}/cursors
+        :param subscription_id:
+        :param cursors:
+        :return:
+        """
+        await self._call('PATCH', f'/subscriptions/{subscription_id}/cursors', 'reset_subscription_cursors',
+                         [204], {'items': cursors})
+        return True
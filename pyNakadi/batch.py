@@ -0,0 +1,143 @@
+import json
+import re
+
+_STRING = re.compile(rb'"(?:[^"\\]|\\.)*"')
+_NESTED = re.compile(rb'[{\[][^{}\[\]]*[}\]]')
+
+
+class LazyBatch:
+    """
+    Stream batch whose cursor is decoded eagerly while its events are kept
+    as raw bytes until they are accessed. Commit-only, forwarding and
+    sampling consumers never pay for decoding the events.
+
+    Supports the read access of a decoded batch map: batch['cursor'],
+    batch.get('info') and 'events' in batch.
+    """
+    EVENTS_KEY = b',"events":['
+    INFO_KEY = b'],"info":'
+
+    def __init__(self, raw, json_loads=json.loads):
+        """
+        :param raw: batch line as bytes without the trailing newline
+        :param json_loads: decoder used for the cursor and the events
+        """
+        self.raw = raw
+        self.json_loads = json_loads
+        self._raw_events = None
+        self._events = None
+
+        head = None
+        events_start = raw.find(self.EVENTS_KEY)
+        if events_start != -1:
+            if raw.endswith(b']}'):
+                head = self._split(raw, events_start, len(raw) - 1)
+            else:
+                # info may hold the info key itself, e.g. in a nested map,
+                # so try from the right until the rest is a valid map
+                info_start = raw.rfind(self.INFO_KEY)
+                while head is None and info_start > events_start:
+                    head = self._split(raw, events_start, info_start + 1)
+                    info_start = raw.rfind(self.INFO_KEY, events_start, info_start)
+        if head is None:
+            # keep-alive batch or formatting other than Nakadi's own
+            head = json_loads(raw)
+            self._events = head.pop('events', None)
+        self.cursor = head['cursor']
+        self.info = head.get('info')
+
+    def _split(self, raw, events_start, events_end):
+        try:
+            head = self.json_loads(raw[:events_start] + raw[events_end:])
+        except ValueError:
+            return None
+        self._raw_events = raw[events_start + len(self.EVENTS_KEY) - 1:events_end]
+        return head
+
+    def has_events(self):
+        """
+        :return: False for keep-alive batches
+        """
+        return self._raw_events is not None or self._events is not None
+
+    @property
+    def raw_events(self):
+        """
+        Events json array as bytes, None for keep-alive batches. Batches that
+        had to be decoded whole are encoded again with the standard library.
+        """
+        if self._raw_events is None and self._events is not None:
+            self._raw_events = json.dumps(self._events).encode('utf-8')
+        return self._raw_events
+
+    @property
+    def events(self):
+        """
+        All events of the batch, decoded on first access. None for keep-alive
+        batches.
+        """
+        if self._events is None and self._raw_events is not None:
+            self._events = self.json_loads(self._raw_events)
+        return self._events
+
+    def count_events(self):
+        """
+        Counts the events without decoding them.
+        :return: number of events, 0 for keep-alive batches
+        """
+        if self._events is not None:
+            return len(self._events)
+        if self._raw_events is None:
+            return 0
+        # collapse strings, then nested values from the innermost out, so
+        # that only the separators of the events array are left
+        body = _STRING.sub(b'0', self._raw_events)[1:-1]
+        collapsed = 1
+        while collapsed:
+            body, collapsed = _NESTED.subn(b'0', body)
+        return body.count(b',') + 1 if body.strip() else 0
+
+    def iter_events(self):
+        """
+        Decodes events one at a time, so stopping early skips decoding the
+        rest of the batch. Only the standard library decodes a document
+        piecewise, so json_loads is not used here; use events to decode all
+        events with it.
+        :return: generator of events
+        """
+        if self._events is not None or self._raw_events is None:
+            yield from self._events or []
+            return
+        text = self._raw_events.decode('utf-8')
+        decoder = json.JSONDecoder()
+        index = _skip_whitespace(text, 1)
+        if text[index] == ']':
+            return
+        while True:
+            event, index = decoder.raw_decode(text, _skip_whitespace(text, index))
+            yield event
+            index = _skip_whitespace(text, index)
+            if text[index] == ']':
+                return
+            index += 1
+
+    def __contains__(self, key):
+        if key == 'events':
+            return self.has_events()
+        if key == 'info':
+            return self.info is not None
+        return key == 'cursor'
+
+    def __getitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+
+def _skip_whitespace(text, index):
+    while text[index] in ' \t\n\r':
+        index += 1
+    return index
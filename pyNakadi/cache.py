@@ -0,0 +1,78 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class MetadataCache:
+    """
+    LRU cache of event type metadata responses for NakadiClient, keyed by
+    url. Entries are fresh for ttl seconds; stale entries that came with an
+    ETag are revalidated with If-None-Match, so an unchanged event type costs
+    a 304 response instead of a full body.
+
+    Cached results are shared between callers and must not be modified.
+    """
+
+    def __init__(self, ttl=60, maxsize=256):
+        """
+        :param ttl: seconds an entry is used without asking Nakadi
+        :param maxsize: max entries, the least recently used are evicted
+        """
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        :param key: url
+        :return: (value, etag, fresh) or None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            value, etag, expires = entry
+            fresh = expires > time.monotonic()
+            if fresh:
+                self.hits += 1
+            else:
+                self.misses += 1
+            return value, etag, fresh
+
+    def put(self, key, value, etag=None):
+        """
+        Stores a value fresh for ttl seconds.
+        :param key: url
+        :param value: decoded response
+        :param etag: ETag of the response
+        :return:
+        """
+        with self._lock:
+            self._entries[key] = (value, etag, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key, below=True):
+        """
+        Drops the entry of key.
+        :param key: url
+        :param below: drop the entries of urls below key too
+        :return:
+        """
+        with self._lock:
+            for cached in [cached for cached in self._entries
+                           if cached == key or (below and cached.startswith(key + '/'))]:
+                del self._entries[cached]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
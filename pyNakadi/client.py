@@ -1,10 +1,22 @@
+import gzip
+import io
 import json
 import socket
+import ssl
+import time
 import uuid
 from functools import reduce
+from urllib.parse import urlsplit
 
 import requests
-import copy
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+
+from pyNakadi.batch import LazyBatch
+from pyNakadi.framing import ChunkedDecoder, GzipDecompressor, LineBuffer
+from pyNakadi.metrics import REQUEST, STREAM_BATCHES, STREAM_BYTES, STREAM_EVENTS, STREAM_RECV, STREAM_USER, \
+    endpoint
+from pyNakadi.serialization import encode_events, get_json_decoder, get_json_encoder
 
 
 class NakadiException(Exception):
@@ -16,6 +28,153 @@ class NakadiException(Exception):
         return f"NakadiException(code={self.code}, msg={self.msg})"
 
 
+class NakadiPublishException(NakadiException):
+    """
+    Raised when Nakadi rejects some or all events of a publish request.
+    items holds Nakadi's batch item responses in the order of events, each
+    with eid, publishing_status (submitted, failed or aborted), step (none,
+    validating, partitioning, enriching or publishing) and detail.
+    """
+
+    def __init__(self, code, msg, items, events=None):
+        super().__init__(code, msg)
+        self.items = items
+        self.events = events
+
+    def failed(self):
+        """
+        :return: list of (index, item) of the events that were not submitted
+        """
+        return [(index, item) for index, item in enumerate(self.items)
+                if item is None or item.get('publishing_status') != 'submitted']
+
+    def failed_steps(self):
+        """
+        :return: map of step to the number of events that failed at it
+        """
+        result_map = {}
+        for _, item in self.failed():
+            step = 'unknown' if item is None else item.get('step', 'unknown')
+            result_map[step] = result_map.get(step, 0) + 1
+        return result_map
+
+    def __str__(self):
+        return f"NakadiPublishException(code={self.code}, failed={len(self.failed())}/{len(self.items)}, " \
+               f"steps={self.failed_steps()}, msg={self.msg})"
+
+
+def _merge_publish_items(items, pending, response_items):
+    """
+    Stores the batch item responses of a publish request for the pending
+    event indexes, all submitted when response_items is None.
+    :return: indexes of the events worth posting again
+    """
+    for position, index in enumerate(pending):
+        if response_items is None:
+            items[index] = {'publishing_status': 'submitted', 'step': 'none', 'detail': ''}
+        else:
+            items[index] = response_items[position] if position < len(response_items) else None
+    return [index for index in pending if _is_retryable(items[index])]
+
+
+def _is_retryable(item):
+    if item is None:
+        return False
+    return item.get('publishing_status') == 'aborted' or \
+        (item.get('publishing_status') == 'failed' and item.get('step') == 'publishing')
+
+
+def _prepare_publish(events, compression):
+    if compression not in [None, 'gzip']:
+        raise NakadiException(code=1, msg='compression must be None or gzip')
+    if not isinstance(events, (bytes, bytearray, memoryview, list, tuple)):
+        events = list(events)
+    return events
+
+
+def _encode_publish_body(events, dumps, compression, compresslevel):
+    """
+    :return: request body and the headers it needs
+    """
+    data = encode_events(events, dumps)
+    if compression == 'gzip':
+        return gzip.compress(data, compresslevel=compresslevel), {'Content-Encoding': 'gzip'}
+    return data, {}
+
+
+def _check_publish_response(status, response_content_str, events):
+    """
+    Raises NakadiPublishException for 207/422 responses naming the failed
+    events, NakadiException for other errors.
+    """
+    if status in [207, 422]:
+        try:
+            items = json.loads(response_content_str)
+        except ValueError:
+            items = None
+        if isinstance(items, list):
+            raise NakadiPublishException(
+                code=status,
+                msg="Error during post_events. "
+                    + f"Message from server:{status} {response_content_str}",
+                items=items,
+                events=events)
+    if status not in [200]:
+        raise NakadiException(
+            code=status,
+            msg="Error during post_events. "
+                + f"Message from server:{status} {response_content_str}")
+
+
+class _PublishRetry:
+    """
+    Tracks the events of a retry_failed_only post_events call over its
+    attempts. The clients only post and sleep.
+    """
+
+    def __init__(self, events, max_retries, backoff, backoff_max):
+        if isinstance(events, (bytes, bytearray, memoryview)):
+            events = json.loads(bytes(events))
+        self.events = events
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.items = [None] * len(events)
+        self.pending = list(range(len(events)))
+        self.exception = None
+        self.attempt = 0
+        self._done = False
+
+    def attempts(self):
+        """
+        :return: generator of (seconds to sleep, events to post)
+        """
+        for attempt in range(self.max_retries + 1):
+            if self._done:
+                return
+            self.attempt = attempt
+            delay = min(self.backoff * 2 ** (attempt - 1), self.backoff_max) if attempt > 0 else 0
+            yield delay, [self.events[index] for index in self.pending]
+
+    def failed(self, exception):
+        self.exception = exception
+        self.pending = _merge_publish_items(self.items, self.pending, exception.items)
+        self._done = not self.pending
+
+    def submitted(self):
+        _merge_publish_items(self.items, self.pending, None)
+        self._done = True
+
+    def result(self):
+        if all(item is not None and item.get('publishing_status') == 'submitted' for item in self.items):
+            return True
+        raise NakadiPublishException(
+            code=self.exception.code,
+            msg=f"Error during post_events after {self.attempt} retries. {self.exception.msg}",
+            items=self.items,
+            events=self.events)
+
+
 class EndOfStreamException(Exception):
     pass
 
@@ -24,97 +183,346 @@ class EndOfStreamException0(Exception):
     pass
 
 
+class StreamOptions:
+    """
+    Socket and buffer settings of a NakadiStream, passed to
+    get_subscription_events_stream or get_event_type_events_stream.
+    """
+    BUFFER_SIZE = 64 * 1024
+    # Nakadi sends a keep-alive batch after batch_flush_timeout seconds
+    # without events, 30 unless requested otherwise
+    BATCH_FLUSH_TIMEOUT = 30
+    KEEP_ALIVE_GRACE = 5
+
+    def __init__(self, read_timeout=None, buffer_size=BUFFER_SIZE, receive_buffer=None, tcp_nodelay=True,
+                 keepalive=False, keepalive_idle=None, keepalive_interval=None, keepalive_count=None,
+                 max_batch_bytes=None):
+        """
+        :param read_timeout: seconds a read waits for data. None waits for
+            one keep-alive interval, batch_flush_timeout of the stream, plus
+            KEEP_ALIVE_GRACE. stream_keep_alive_limit does not lengthen it:
+            it bounds how many keep-alive batches come before Nakadi ends
+            the stream, not the interval between them.
+        :param buffer_size: initial size of the receive and batch buffers
+        :param receive_buffer: SO_RCVBUF of the socket. The connection is open
+            already, so the TCP window scale stays the one of the system
+            default buffer size.
+        :param tcp_nodelay: set TCP_NODELAY
+        :param keepalive: enable TCP keepalive probes
+        :param keepalive_idle: seconds idle before the first probe
+        :param keepalive_interval: seconds between probes
+        :param keepalive_count: unanswered probes before the connection drops
+        :param max_batch_bytes: fail reading a batch line longer than that,
+            instead of buffering it whole. The stream has to be closed then.
+        """
+        self.read_timeout = read_timeout
+        self.buffer_size = buffer_size
+        self.receive_buffer = receive_buffer
+        self.tcp_nodelay = tcp_nodelay
+        self.keepalive = keepalive
+        self.keepalive_idle = keepalive_idle
+        self.keepalive_interval = keepalive_interval
+        self.keepalive_count = keepalive_count
+        self.max_batch_bytes = max_batch_bytes
+
+    def get_read_timeout(self, batch_flush_timeout=None):
+        """
+        :param batch_flush_timeout: batch_flush_timeout the stream was
+            requested with
+        :return: read timeout in seconds
+        """
+        if self.read_timeout is not None:
+            return self.read_timeout
+        return (batch_flush_timeout or self.BATCH_FLUSH_TIMEOUT) + self.KEEP_ALIVE_GRACE
+
+    def apply(self, sock, read_timeout):
+        """
+        Applies the options to a connected socket.
+        :param sock: socket, the plain socket under a TLS wrapper
+        :param read_timeout:
+        :return:
+        """
+        sock.settimeout(read_timeout)
+        if self.tcp_nodelay:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if self.receive_buffer is not None:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.receive_buffer)
+        if self.keepalive:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            # not every platform lets these be set per socket
+            for name, value in [('TCP_KEEPIDLE', self.keepalive_idle),
+                                ('TCP_KEEPINTVL', self.keepalive_interval),
+                                ('TCP_KEEPCNT', self.keepalive_count)]:
+                if value is not None and hasattr(socket, name):
+                    sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, name), value)
+
+
 class NakadiStream():
     """
     Iterator that generates batches. This stream is either created by a
     get_subscription_events_stream method or get_event_type_events_stream
     method.
     """
-    BUFFER_SIZE = 64 * 1024
+    # default buffer size, see StreamOptions
+    BUFFER_SIZE = StreamOptions.BUFFER_SIZE
 
-    def __init__(self, response):
+    def __init__(self, response, parse=False, json_decoder=None, options=None, batch_flush_timeout=None,
+                 metrics=None):
+        """
+        :param response: streamed response of an events endpoint
+        :param parse: iterate decoded batches instead of raw batch bytes,
+            skipping keep-alive batches. 'lazy' iterates LazyBatch objects.
+        :param json_decoder: see pyNakadi.serialization.get_json_decoder
+        :param options: StreamOptions
+        :param batch_flush_timeout: batch_flush_timeout the stream was
+            requested with, see StreamOptions.read_timeout
+        :param metrics: sink of the stream metrics, see
+            pyNakadi.metrics.NoopMetrics
+        """
         self.response = response
+        self.parse = parse
+        self.metrics = metrics
+        self._recv_seconds = 0.0
+        self._returned_at = None
+        self.json_loads = get_json_decoder(json_decoder)
+        self.options = options or StreamOptions()
+        self.read_timeout = self.options.get_read_timeout(batch_flush_timeout)
+        self.max_batch_bytes = self.options.max_batch_bytes
         self.sock = self.response.raw.connection.sock
 
-        self.raw_buffer = b''
-        self.buffer = b''
         self.current_batch = None
-        self.__it = response.iter_lines(chunk_size=1)
-
-        if hasattr(self.sock, 'socket'):
-            self.sock.socket.settimeout(30)
-            self.sock.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        # set by StreamRecorder.record
+        self.recorder = None
+        self.decoder = ChunkedDecoder(self.options.buffer_size)
+        self.lines = LineBuffer(self.options.buffer_size)
+        if self.response.headers.get('Content-Encoding') == 'gzip':
+            self._payload_sink = GzipDecompressor(self.lines)
         else:
-            self.sock.settimeout(30)
-            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self._payload_sink = self.lines
+        self._recv_into = self.sock.recv_into
+        self._socket = getattr(self.sock, 'socket', self.sock)
+        # http.client may have buffered the first body bytes together with
+        # the headers. They are taken over once, later reads go to the socket:
+        # readinto1 of the buffered reader would wait for more data whenever
+        # it had buffered less than the view it fills.
+        fp = getattr(getattr(response.raw, '_fp', None), 'fp', None)
+        if hasattr(fp, 'read1'):
+            self._take_buffered(fp)
+        self.options.apply(self._socket, self.read_timeout)
 
         if 'X-Nakadi-StreamId' in self.response.headers:
             self.stream_id = self.response.headers['X-Nakadi-StreamId']
         else:
             self.stream_id = str(uuid.uuid4())
 
+    def _take_buffered(self, fp):
+        size = max(io.DEFAULT_BUFFER_SIZE, self.options.buffer_size)
+        self._socket.settimeout(0)
+        try:
+            data = fp.read1(size)
+            self.decoder.feed(data)
+            # read1 returns the buffered bytes without reading the socket
+            # unless there are none, so more may be buffered only if size
+            # bytes were returned
+            while len(data) == size:
+                data = fp.read1(size)
+                self.decoder.feed(data)
+        except (BlockingIOError, ssl.SSLWantReadError):
+            pass
+
     def read_buffer(self):
-        buffer = self.sock.recv(self.BUFFER_SIZE)
-        return buffer
+        """
+        Receives what fits into the free space of the decoder's buffer.
+        :return: number of bytes received
+        """
+        if self.metrics is None:
+            nbytes = self._recv_into(self.decoder.get_buffer())
+        else:
+            started = time.perf_counter()
+            nbytes = self._recv_into(self.decoder.get_buffer())
+            self._recv_seconds += time.perf_counter() - started
+        if not nbytes:
+            raise EndOfStreamException
+        self.decoder.buffer_updated(nbytes)
+        return nbytes
 
-    def read_chunk(self):
+    def fileno(self):
+        """
+        :return: file descriptor of the stream's socket, for selectors
+        """
+        return self._socket.fileno()
 
-        if b'\r\n' not in self.raw_buffer:
+    def setblocking(self, flag):
+        """
+        Switches between blocking reads that time out after read_timeout
+        seconds and non-blocking reads with read_nowait.
+        :param flag:
+        :return:
+        """
+        self._socket.settimeout(self.read_timeout if flag else 0)
 
-            while self.raw_buffer[-2:] != b'\r\n':
-                received_byte = self.sock.recv(1)
-                if received_byte == b'':
-                    raise EndOfStreamException
-                self.raw_buffer += received_byte
-            size_b = self.raw_buffer[:-2]
-            self.raw_buffer = b''
-        else:
-            size_b, self.raw_buffer = self.raw_buffer.split(b'\r\n', 1)
-        size = int(size_b, 16) + 2
-
-        data_read_arr = list()
-        remaining = size
-        data_read = self.raw_buffer
-        data_read_arr.append(data_read)
-        remaining -= len(data_read)
-        while remaining > 0:
-            data_read = self.sock.recv(self.BUFFER_SIZE)
-            if data_read == b'':
+    def read_nowait(self, max_bytes=1024 * 1024):
+        """
+        Receives and decodes what is available without blocking, until the
+        socket would block or max_bytes are received. Reading until the
+        socket would block also drains bytes buffered by the TLS layer, which
+        a selector does not report as readable.
+        Requires setblocking(False).
+        :param max_bytes:
+        :return: number of bytes received, 0 if nothing was available
+        """
+        total = 0
+        while total < max_bytes:
+            try:
+                nbytes = self._recv_into(self.decoder.get_buffer())
+            except (BlockingIOError, ssl.SSLWantReadError):
+                nbytes = None
+            if nbytes is None:
+                break
+            if not nbytes:
                 raise EndOfStreamException
-            data_read_arr.append(data_read)
-            remaining -= len(data_read)
-        if remaining != 0:
-            self.raw_buffer = data_read_arr[-1][remaining:]
-        else:
-            self.raw_buffer = b''
+            self.decoder.buffer_updated(nbytes)
+            self.decoder.decode_into(self._payload_sink)
+            total += nbytes
+        return total
 
-        if len(data_read) + remaining == 1:
-            data_read_arr[-2] = data_read_arr[-2][:-1]
-            data_read_arr.pop(-1)
-        else:
-            data_read_arr[-1] = data_read_arr[-1][:remaining - 2]
-        data_b = b''.join(data_read_arr)
+    def poll_batch(self):
+        """
+        Returns the next batch that can be framed from the bytes received so
+        far, without reading. Batches are decoded as configured by parse.
+        :return: batch or None if more data has to be received first
+        """
+        while True:
+            line = self.lines.next_line()
+            if line is None:
+                self._check_batch_size(len(self.lines))
+                if not self.decoder.decode_into(self._payload_sink):
+                    return None
+                continue
+            self._check_batch_size(len(line))
+            self.current_batch = line
+            if self.recorder is not None:
+                self.recorder.write(self.stream_id, line)
+            if self.metrics is not None:
+                self._record_batch(len(line))
+            batch = self.decode(line)
+            if batch is not None:
+                if self.metrics is not None and self.parse:
+                    self._record_events(batch)
+                return batch
 
-        if size == 0:
-            raise EndOfStreamException0
+    def decode(self, line):
+        """
+        Decodes a batch line as configured by parse.
+        :param line: batch line as bytes
+        :return: the batch, None for keep-alive batches of parsed streams
+        """
+        if not self.parse:
+            return line
+        batch = self._decode_lazy(line) if self.parse == 'lazy' else self.json_loads(line)
+        return batch if 'events' in batch else None
+
+    def finished(self):
+        """
+        :return: True once the terminating chunk was decoded
+        """
+        return self.decoder.finished
 
+    def read_chunk(self):
+        """
+        Reads the next chunk of the chunked transfer encoded response. This is
+        a low level alternative to iterating the stream, do not mix the two.
+        Chunks of compressed streams are returned as they are received.
+        :return: chunk payload
+        """
+        data_b = self.decoder.read_chunk()
+        while data_b is None:
+            self.read_buffer()
+            data_b = self.decoder.read_chunk()
+        if data_b == b'':
+            raise EndOfStreamException0
         return data_b
 
     def __iter__(self):
         return self
 
     def __next__(self):
-        data_read_arr = list()
-        data_read = self.buffer
-        data_read_arr.append(data_read)
-        while b'\n' not in data_read:
-            data_read = self.read_chunk()
-            data_read_arr.append(data_read)
-        data_read_arr[-1], self.buffer = data_read_arr[-1].split(b'\n', 1)
-        data_b = b''.join(data_read_arr)
-        self.current_batch = data_b
+        if self.parse:
+            return self.next_parsed_batch(lazy=self.parse == 'lazy')
+        return self.next_batch()
+
+    def next_batch(self, view=False):
+        """
+        Reads the next batch line of the stream.
+        :param view: return a memoryview on the stream's buffer instead of a
+            bytes copy. The view stays valid after further reads.
+        :return: batch without its trailing newline
+        """
+        if self.metrics is not None and self._returned_at is not None:
+            self.metrics.timing(STREAM_USER, time.perf_counter() - self._returned_at)
+        batch = self.lines.next_line(view)
+        while batch is None:
+            self._check_batch_size(len(self.lines))
+            if not self.decoder.decode_into(self._payload_sink):
+                if self.decoder.finished:
+                    raise EndOfStreamException0
+                self.read_buffer()
+            batch = self.lines.next_line(view)
+        self._check_batch_size(len(batch))
+        self.current_batch = batch
+        if self.recorder is not None:
+            self.recorder.write(self.stream_id, batch)
+        if self.metrics is not None:
+            self._record_batch(len(batch))
+            self._returned_at = time.perf_counter()
         return self.current_batch
 
+    def next_parsed_batch(self, lazy=False, keep_alive=False):
+        """
+        Reads and decodes the next batch that carries events. Keep-alive
+        batches without events are skipped.
+        :param lazy: only decode the cursor and return a LazyBatch
+        :param keep_alive: return keep-alive batches too
+        :return: batch map with cursor, events and optionally info
+        """
+        decode = self._decode_lazy if lazy else self.json_loads
+        batch = decode(self.next_batch())
+        while 'events' not in batch and not keep_alive:
+            batch = decode(self.next_batch())
+        if self.metrics is not None:
+            self._record_events(batch)
+        return batch
+
+    def batches(self, lazy=False):
+        """
+        Generates decoded batches that carry events.
+        :param lazy: generate LazyBatch objects
+        :return: generator of batch maps
+        """
+        while True:
+            yield self.next_parsed_batch(lazy)
+
+    def _decode_lazy(self, raw):
+        return LazyBatch(raw, self.json_loads)
+
+    def _record_batch(self, nbytes):
+        self.metrics.increment(STREAM_BYTES, nbytes + 1)
+        self.metrics.increment(STREAM_BATCHES)
+        self.metrics.timing(STREAM_RECV, self._recv_seconds)
+        self._recv_seconds = 0.0
+
+    def _record_events(self, batch):
+        if isinstance(batch, LazyBatch):
+            self.metrics.increment(STREAM_EVENTS, batch.count_events())
+        elif 'events' in batch:
+            self.metrics.increment(STREAM_EVENTS, len(batch['events']))
+
+    def _check_batch_size(self, nbytes):
+        if self.max_batch_bytes is not None and nbytes > self.max_batch_bytes:
+            raise NakadiException(
+                code=1,
+                msg=f"Batch of stream {self.stream_id} exceeds max_batch_bytes={self.max_batch_bytes}")
+
     def get_stream_id(self):
         """
         :return: X-Nakadi-StreamId
@@ -123,9 +531,13 @@ class NakadiStream():
 
     def close(self):
         """
-        Closes network stream.
+        Closes network stream. A read blocked in another thread returns.
         :return:
         """
+        try:
+            self._socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
         self.response.raw.close()
 
     def closed(self):
@@ -137,29 +549,106 @@ class NakadiStream():
 
 
 class NakadiClient:
-    def __init__(self, token, nakadi_url):
+    PUBLISH_COMPRESS_LEVEL = 1
+    PUBLISH_RETRY_BACKOFF = 0.1
+    PUBLISH_RETRY_BACKOFF_MAX = 5
+
+    def __init__(self, token, nakadi_url, json_decoder=None, json_encoder=None,
+                 pool_connections=10, pool_maxsize=10, pool_block=False, metadata_cache=None, metrics=None):
         """
         Initiates a Nakadi client using the token and aiming for url
         :param token: token string to be used
         :param nakadi_url: url for nakadi server
+        :param json_decoder: json decoder of parsed streams, see
+            pyNakadi.serialization.get_json_decoder
+        :param json_encoder: json encoder of published events, see
+            pyNakadi.serialization.get_json_encoder
+        :param pool_connections: number of connection pools to cache
+        :param pool_maxsize: max connections kept open per host. Size it to
+            the number of threads using the client at once.
+        :param pool_block: wait for a free connection instead of opening
+            connections beyond pool_maxsize that are not reused
+        :param metadata_cache: pyNakadi.cache.MetadataCache for event types
+            and their partitions, None fetches them on every call
+        :param metrics: sink of request and stream metrics, see
+            pyNakadi.metrics.NoopMetrics. None records nothing.
         """
         self.token = token
         self.nakadi_url = nakadi_url
-        self.session = self.__create_session(token)
+        self.json_decoder = json_decoder
+        self.json_dumps = get_json_encoder(json_encoder)
+        self.pool_maxsize = pool_maxsize
+        self.metadata_cache = metadata_cache
+        self.metrics = metrics
+        self.session = self.__create_session(token, pool_connections, pool_maxsize, pool_block)
+        if metrics is not None:
+            self.session.hooks['response'].append(self.__record_request)
 
-    def __create_session(self, token):
+    def __create_session(self, token, pool_connections, pool_maxsize, pool_block):
         result = requests.Session()
         result.headers.update({
             "Authorization": f"Bearer {token}",
             "Content-Type": "application/json"
         })
+        adapter = HTTPAdapter(pool_connections=pool_connections,
+                              pool_maxsize=pool_maxsize,
+                              pool_block=pool_block)
+        result.mount('http://', adapter)
+        result.mount('https://', adapter)
         return result
 
+    def __record_request(self, response, *args, **kwargs):
+        path = response.request.path_url
+        base_path = urlsplit(self.nakadi_url).path.rstrip('/')
+        if base_path and path.startswith(base_path):
+            path = path[len(base_path):]
+        self.metrics.timing(REQUEST, response.elapsed.total_seconds(),
+                            {'method': response.request.method, 'endpoint': endpoint(path),
+                             'status': response.status_code})
+
+    @classmethod
+    def __set_stream_encoding(cls, headers, compression):
+        cls.assert_it(compression in [None, 'gzip'],
+                      NakadiException(code=1, msg='compression must be None or gzip'))
+        if compression is None:
+            # None drops the session default instead of falling back to it
+            headers['Accept-Encoding'] = None
+        else:
+            headers['Accept-Encoding'] = compression
+
     @classmethod
     def assert_it(cls, condition, exception):
         if not condition:
             raise exception
 
+    def __get_metadata(self, page, name):
+        cached = None if self.metadata_cache is None else self.metadata_cache.get(page)
+        if cached is not None and cached[2]:
+            return cached[0]
+        headers = None
+        if cached is not None and cached[1] is not None:
+            headers = {'If-None-Match': cached[1]}
+        response = self.session.get(page, headers=headers)
+        if response.status_code == 304 and cached is not None:
+            self.metadata_cache.put(page, cached[0], cached[1])
+            return cached[0]
+        response_content_str = response.content.decode('utf-8')
+        if response.status_code not in [200]:
+            raise NakadiException(
+                code=response.status_code,
+                msg=f"Error during {name}. "
+                    + f"Message from server:{response.status_code} {response_content_str}")
+        result_map = json.loads(response_content_str)
+        if self.metadata_cache is not None:
+            self.metadata_cache.put(page, result_map, response.headers.get('ETag'))
+        return result_map
+
+    def __invalidate_metadata(self, event_type_name=None):
+        if self.metadata_cache is not None:
+            self.metadata_cache.invalidate(f"{self.nakadi_url}/event-types", below=False)
+            if event_type_name is not None:
+                self.metadata_cache.invalidate(f"{self.nakadi_url}/event-types/{event_type_name}")
+
     def get_metrics(self):
         """
         GET /metrics
@@ -182,15 +671,7 @@ class NakadiClient:
         :return:
         """
         page = f"{self.nakadi_url}/event-types"
-        response = self.session.get(page)
-        response_content_str = response.content.decode('utf-8')
-        if response.status_code not in [200]:
-            raise NakadiException(
-                code=response.status_code,
-                msg="Error during get_event_types. "
-                    + f"Message from server:{response.status_code} {response_content_str}")
-        result_map = json.loads(response_content_str)
-        return result_map
+        return self.__get_metadata(page, 'get_event_types')
 
     def create_event_type(self, event_type_data_map):
         """
@@ -200,6 +681,7 @@ class NakadiClient:
         """
         page = f"{self.nakadi_url}/event-types"
         response = self.session.post(page, json=event_type_data_map)
+        self.__invalidate_metadata()
         response_content_str = response.content.decode('utf-8')
         if response.status_code not in [201]:
             raise NakadiException(
@@ -215,15 +697,7 @@ class NakadiClient:
         :return:
         """
         page = f"{self.nakadi_url}/event-types/{event_type_name}"
-        response = self.session.get(page)
-        response_content_str = response.content.decode('utf-8')
-        if response.status_code not in [200]:
-            raise NakadiException(
-                code=response.status_code,
-                msg="Error during get_event_type. "
-                    + f"Message from server:{response.status_code} {response_content_str}")
-        result_map = json.loads(response_content_str)
-        return result_map
+        return self.__get_metadata(page, 'get_event_type')
 
     def update_event_type(self, event_type_name, event_type_data_map):
         """
@@ -234,6 +708,7 @@ class NakadiClient:
         """
         page = f"{self.nakadi_url}/event-types/{event_type_name}"
         response = self.session.put(page, json=event_type_data_map)
+        self.__invalidate_metadata(event_type_name)
         response_content_str = response.content.decode('utf-8')
         if response.status_code not in [200]:
             raise NakadiException(
@@ -250,6 +725,7 @@ class NakadiClient:
         """
         page = f"{self.nakadi_url}/event-types/{event_type_name}"
         response = self.session.delete(page)
+        self.__invalidate_metadata(event_type_name)
         response_content_str = response.content.decode('utf-8')
         if response.status_code not in [200]:
             raise NakadiException(
@@ -283,7 +759,7 @@ class NakadiClient:
         :param cursors_map:
         :return:
         """
-        page = f"{self.nakadi_url}/event-types/{event_type_name}/cursor-lag"
+        page = f"{self.nakadi_url}/event-types/{event_type_name}/cursors-lag"
         response = self.session.post(page, json=cursors_map)
         response_content_str = response.content.decode('utf-8')
         if response.status_code not in [200]:
@@ -294,23 +770,71 @@ class NakadiClient:
         result_map = json.loads(response_content_str)
         return result_map
 
-    def post_events(self, event_type_name, events):
+    def post_events(self, event_type_name, events, compression=None,
+                    retry_failed_only=False, max_retries=3):
         """
         POST /event-types/{name}/events
         :param event_type_name:
-        :param events:
-        :return:
+        :param events: list of events, a json array as bytes or an iterable
+            of events that are each already json encoded as bytes
+        :param compression: 'gzip' to send a compressed request body
+        :param retry_failed_only: after a 207/422 response re-post only the
+            events that failed at the publishing step or were aborted, with
+            exponential backoff. Events failing validation, partitioning or
+            enrichment are not retried.
+        :param max_retries: max re-posts when retry_failed_only is set
+        :return: True, NakadiPublishException names the events not published
         """
+        events = _prepare_publish(events, compression)
+        if not retry_failed_only:
+            return self.__post_events(event_type_name, events, compression)
+
+        retry = _PublishRetry(events, max_retries, self.PUBLISH_RETRY_BACKOFF, self.PUBLISH_RETRY_BACKOFF_MAX)
+        for delay, pending_events in retry.attempts():
+            if delay:
+                time.sleep(delay)
+            try:
+                self.__post_events(event_type_name, pending_events, compression)
+            except NakadiPublishException as ex:
+                retry.failed(ex)
+            else:
+                retry.submitted()
+        return retry.result()
+
+    def __post_events(self, event_type_name, events, compression):
         page = f"{self.nakadi_url}/event-types/{event_type_name}/events"
-        response = self.session.post(page, json=events)
-        response_content_str = response.content.decode('utf-8')
-        if response.status_code not in [200]:
-            raise NakadiException(
-                code=response.status_code,
-                msg="Error during post_events. "
-                    + f"Message from server:{response.status_code} {response_content_str}")
+        headers = self.session.headers.copy()
+        data, body_headers = _encode_publish_body(events, self.json_dumps, compression, self.PUBLISH_COMPRESS_LEVEL)
+        headers.update(body_headers)
+        response = self.session.post(page, headers=headers, data=data)
+        _check_publish_response(response.status_code, response.content.decode('utf-8'), events)
         return True
 
+    def post_events_many(self, events_by_event_type, max_workers=None, compression=None):
+        """
+        Posts events of several event types concurrently, one post_events
+        request per event type.
+        :param events_by_event_type: map of event type name to events
+        :param max_workers: max concurrent requests, defaults to pool_maxsize
+        :param compression: see post_events
+        :return: map of event type name to True, or to the exception its
+            post_events raised
+        """
+        workers = min(max_workers or self.pool_maxsize, len(events_by_event_type))
+        if workers == 0:
+            return {}
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {event_type_name: executor.submit(self.post_events, event_type_name, events,
+                                                        compression=compression)
+                       for event_type_name, events in events_by_event_type.items()}
+        result_map = {}
+        for event_type_name, future in futures.items():
+            try:
+                result_map[event_type_name] = future.result()
+            except Exception as ex:
+                result_map[event_type_name] = ex
+        return result_map
+
     def get_event_type_events_stream(self,
                                      event_name,
                                      batch_limit=1,
@@ -318,7 +842,10 @@ class NakadiClient:
                                      batch_flush_timeout=30,
                                      stream_timeout=0,
                                      stream_keep_alive_limit=0,
-                                     cursors=None):
+                                     cursors=None,
+                                     parse=False,
+                                     compression=None,
+                                     options=None):
         """
         GET /event-types/{name}/events
         :param event_name:
@@ -328,12 +855,16 @@ class NakadiClient:
         :param stream_timeout:
         :param stream_keep_alive_limit:
         :param cursors:
+        :param parse: stream yields decoded batches with events, 'lazy'
+            yields LazyBatch objects
+        :param compression: 'gzip' to receive a compressed stream
+        :param options: StreamOptions of the stream
         :return: NakadiStream
         """
-        headers = copy.copy(self.session.headers)
+        headers = self.session.headers.copy()
         if cursors is not None:
             headers['X-nakadi-cursors'] = json.dumps(cursors)
-        page = f"{self.nakadi_url}/event-types/{''}/events"
+        page = f"{self.nakadi_url}/event-types/{event_name}/events"
         query_str = ''
         if batch_limit is not None:
             query_str += f'&batch_limit={batch_limit}'
@@ -348,8 +879,7 @@ class NakadiClient:
         if query_str != '':
             page += '?' + query_str[1:]
 
-        if 'Accept-Encoding' in headers:
-            del (headers['Accept-Encoding'])
+        self.__set_stream_encoding(headers, compression)
 
         response = self.session.get(url=page, headers=headers,
                                     stream=True)
@@ -359,9 +889,10 @@ class NakadiClient:
             response_content_str = response.content.decode('utf-8')
             raise NakadiException(
                 code=response.status_code,
-                msg="Error during get_subscription_events_stream. "
+                msg="Error during get_event_type_events_stream. "
                     + f"Message from server:{response.status_code} {response_content_str}")
-        return NakadiStream(response)
+        return NakadiStream(response, parse=parse, json_decoder=self.json_decoder, options=options,
+                            batch_flush_timeout=batch_flush_timeout, metrics=self.metrics)
 
     def get_event_type_partitions(self, event_type_name):
         """
@@ -370,15 +901,7 @@ class NakadiClient:
         :return:
         """
         page = f"{self.nakadi_url}/event-types/{event_type_name}/partitions"
-        response = self.session.get(page)
-        response_content_str = response.content.decode('utf-8')
-        if response.status_code not in [200]:
-            raise NakadiException(
-                code=response.status_code,
-                msg="Error during get_event_type_partitions. "
-                    + f"Message from server:{response.status_code} {response_content_str}")
-        result_map = json.loads(response_content_str)
-        return result_map
+        return self.__get_metadata(page, 'get_event_type_partitions')
 
     def get_event_type_partition(self, event_type_name, partition_id):
         """
@@ -388,15 +911,7 @@ class NakadiClient:
         :return:
         """
         page = f"{self.nakadi_url}/event-types/{event_type_name}/partitions/{partition_id}"
-        response = self.session.get(page)
-        response_content_str = response.content.decode('utf-8')
-        if response.status_code not in [200]:
-            raise NakadiException(
-                code=response.status_code,
-                msg="Error during get_event_type_partition. "
-                    + f"Message from server:{response.status_code} {response_content_str}")
-        result_map = json.loads(response_content_str)
-        return result_map
+        return self.__get_metadata(page, 'get_event_type_partition')
 
     def get_subscriptions(self, owning_application=None, event_type=None,
                           limit=20,
@@ -538,7 +1053,10 @@ class NakadiClient:
                                        batch_flush_timeout=None,
                                        stream_timeout=None,
                                        stream_keep_alive_limit=None,
-                                       commit_timeout=None):
+                                       commit_timeout=None,
+                                       parse=False,
+                                       compression=None,
+                                       options=None):
         """
         GET /subscriptions/{subscription_id}/events
         :param subscription_id:
@@ -548,6 +1066,10 @@ class NakadiClient:
         :param batch_flush_timeout:
         :param stream_timeout:
         :param stream_keep_alive_limit:
+        :param parse: stream yields decoded batches with events, 'lazy'
+            yields LazyBatch objects
+        :param compression: 'gzip' to receive a compressed stream
+        :param options: StreamOptions of the stream
         :return: NakadiStream
         """
         page = f"{self.nakadi_url}/subscriptions/{subscription_id}/events"
@@ -569,9 +1091,8 @@ class NakadiClient:
         if query_str != '':
             page += '?' + query_str[1:]
 
-        headers = copy.copy(self.session.headers)
-        if 'Accept-Encoding' in headers:
-            del (headers['Accept-Encoding'])
+        headers = self.session.headers.copy()
+        self.__set_stream_encoding(headers, compression)
         response = self.session.get(url=page, headers=headers,
                                     stream=True)
         if response.status_code not in [200]:
@@ -580,7 +1101,8 @@ class NakadiClient:
                 code=response.status_code,
                 msg="Error during get_subscription_events_stream. "
                     + f"Message from server:{response.status_code} {response_content_str}")
-        return NakadiStream(response)
+        return NakadiStream(response, parse=parse, json_decoder=self.json_decoder, options=options,
+                            batch_flush_timeout=batch_flush_timeout, metrics=self.metrics)
 
     def get_subscription_stats(self, subscription_id, show_time_lag=False):
         """
@@ -626,7 +1148,7 @@ class NakadiClient:
         :return:
         """
         page = f"{self.nakadi_url}/subscriptions/{subscription_id}/cursors"
-        headers = copy.copy(self.session.headers)
+        headers = self.session.headers.copy()
         headers["X-Nakadi-StreamId"] = stream_id
         cursors_data = {'items': cursors}
         response = self.session.post(page, headers=headers,
@@ -0,0 +1,321 @@
+import os
+import socket
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+from pyNakadi.client import NakadiException, EndOfStreamException, EndOfStreamException0
+
+
+class CursorCommitter:
+    """
+    Commits subscription cursors from a background thread. Marked cursors are
+    coalesced to the latest one per event type and partition and committed
+    every commit_interval seconds, every commit_every_batches batches, or
+    once half of max_uncommitted_events are uncommitted, whatever comes
+    first. The first commit error is kept in error and stops committing.
+    """
+
+    def __init__(self, client, subscription_id, stream_id,
+                 commit_interval=1.0,
+                 commit_every_batches=None,
+                 max_uncommitted_events=None):
+        """
+        :param client: NakadiClient cursors are committed with
+        :param subscription_id:
+        :param stream_id: X-Nakadi-StreamId of the stream cursors belong to
+        :param commit_interval: max seconds between commits
+        :param commit_every_batches: commit after that many marked batches
+        :param max_uncommitted_events: max_uncommitted_events of the stream
+        """
+        self.client = client
+        self.subscription_id = subscription_id
+        self.stream_id = stream_id
+        self.commit_interval = commit_interval
+        self.commit_every_batches = commit_every_batches
+        self.commit_threshold = None if max_uncommitted_events is None else max(1, max_uncommitted_events // 2)
+        self.error = None
+        self.commits = 0
+        self._cursors = {}
+        self._batches = 0
+        self._events = 0
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='NakadiCursorCommitter', daemon=True)
+        self._thread.start()
+
+    def mark(self, cursor, events=1):
+        """
+        Marks a batch as processed. Its cursor is committed in the background.
+        :param cursor: cursor of the batch
+        :param events: number of events of the batch
+        :return:
+        """
+        if self.error is not None:
+            raise self.error
+        with self._lock:
+            self._cursors[(cursor['event_type'], cursor['partition'])] = cursor
+            self._batches += 1
+            self._events += events
+            due = (self.commit_every_batches is not None and self._batches >= self.commit_every_batches) or \
+                  (self.commit_threshold is not None and self._events >= self.commit_threshold)
+        if due:
+            self._wakeup.set()
+
+    def uncommitted_events(self):
+        """
+        :return: events marked but not committed yet
+        """
+        return self._events
+
+    def commit(self):
+        """
+        Commits the marked cursors now, in the calling thread.
+        :return:
+        """
+        with self._lock:
+            cursors = list(self._cursors.values())
+            batches, events = self._batches, self._events
+            self._cursors = {}
+            self._batches = self._events = 0
+        if not cursors or self.error is not None:
+            return
+        try:
+            self.client.commit_subscription_cursors(self.subscription_id, self.stream_id, cursors)
+        except NakadiException as ex:
+            # 200 means some cursors were behind already committed ones
+            if ex.code != 200:
+                self.error = ex
+                with self._lock:
+                    for cursor in cursors:
+                        self._cursors.setdefault((cursor['event_type'], cursor['partition']), cursor)
+                    self._batches += batches
+                    self._events += events
+                raise
+        self.commits += 1
+
+    def close(self):
+        """
+        Commits what is left and stops the background thread.
+        :return:
+        """
+        self._closed = True
+        self._wakeup.set()
+        self._thread.join()
+        if self.error is None:
+            self.commit()
+
+    def _run(self):
+        while not self._closed:
+            self._wakeup.wait(self.commit_interval)
+            self._wakeup.clear()
+            if self._closed:
+                return
+            try:
+                self.commit()
+            except NakadiException:
+                return
+
+
+class PartitionDispatcher:
+    """
+    Runs handler on batches in a pool of workers while keeping the order of
+    every partition: all batches of a partition go to the same single-worker
+    executor. on_done is called with the cursor of a partition once all its
+    batches up to that cursor are handled, so a cursor never gets committed
+    ahead of an unfinished batch. Partitions are assigned to workers round
+    robin in the order they are first seen. The first handler error is kept in error,
+    stops on_done for its partition and is raised by the next submit.
+    """
+
+    def __init__(self, handler, on_done, workers=None, processes=False):
+        """
+        :param handler: called with every submitted batch. Must be picklable
+            when processes is True.
+        :param on_done: called with cursor and events of handled batches, in
+            partition order
+        :param workers: number of workers, defaults to the number of cpus
+        :param processes: run handler in worker processes instead of threads
+        """
+        self.handler = handler
+        self.on_done = on_done
+        self.workers = workers or os.cpu_count() or 1
+        executor_class = ProcessPoolExecutor if processes else ThreadPoolExecutor
+        self.error = None
+        self._executors = [executor_class(max_workers=1) for _ in range(self.workers)]
+        self._pending = {}
+        self._assigned = {}
+        self._lock = threading.Lock()
+
+    def submit(self, batch, events=1):
+        """
+        Queues a batch for its partition's worker.
+        :param batch: batch map or LazyBatch
+        :param events: number of events of the batch
+        :return:
+        """
+        if self.error is not None:
+            raise self.error
+        cursor = batch['cursor']
+        key = (cursor['event_type'], cursor['partition'])
+        with self._lock:
+            index = self._assigned.setdefault(key, len(self._assigned) % self.workers)
+            future = self._executors[index].submit(self.handler, batch)
+            self._pending.setdefault(key, deque()).append((future, cursor, events))
+        future.add_done_callback(lambda _: self._done(key))
+
+    def pending(self):
+        """
+        :return: batches submitted but not handled yet
+        """
+        with self._lock:
+            return sum(len(batches) for batches in self._pending.values())
+
+    def join(self):
+        """
+        Waits until all submitted batches are handled.
+        :return:
+        """
+        with self._lock:
+            futures = [future for batches in self._pending.values() for future, _, _ in batches]
+        wait(futures)
+
+    def close(self):
+        """
+        Handles all submitted batches and stops the workers.
+        :return:
+        """
+        for executor in self._executors:
+            executor.shutdown(wait=True)
+
+    def _done(self, key):
+        # on_done runs under the lock, so cursors of a partition are passed
+        # on in order even when its batches complete in different threads
+        with self._lock:
+            batches = self._pending.get(key)
+            cursor, events = None, 0
+            while batches and batches[0][0].done():
+                error = batches[0][0].exception()
+                if error is not None:
+                    if self.error is None:
+                        self.error = error
+                    break
+                _, cursor, handled = batches.popleft()
+                events += handled
+            if batches is not None and not batches:
+                del self._pending[key]
+            if cursor is not None:
+                try:
+                    self.on_done(cursor, events)
+                except Exception as ex:
+                    if self.error is None:
+                        self.error = ex
+
+
+class SubscriptionConsumer:
+    """
+    Consumes a subscription stream: batches are handed to handler in the
+    calling thread while a CursorCommitter commits their cursors in the
+    background, so reading and processing never wait for a commit.
+    """
+    # Nakadi's default when a stream is opened without max_uncommitted_events
+    DEFAULT_MAX_UNCOMMITTED_EVENTS = 10
+
+    def __init__(self, client, subscription_id, handler,
+                 commit_interval=1.0,
+                 commit_every_batches=None,
+                 lazy=False,
+                 workers=None,
+                 processes=False,
+                 **stream_params):
+        """
+        :param client: NakadiClient
+        :param subscription_id:
+        :param handler: called with every batch carrying events, its cursor
+            is committed once handler returns
+        :param commit_interval: max seconds between commits. Capped to half
+            of commit_timeout when that is given.
+        :param commit_every_batches: commit after that many batches
+        :param lazy: hand LazyBatch objects to handler
+        :param workers: handle batches in that many workers, keeping the order
+            within every partition. None handles them in the calling thread.
+        :param processes: use worker processes instead of threads
+        :param stream_params: passed to get_subscription_events_stream
+        """
+        self.client = client
+        self.subscription_id = subscription_id
+        self.handler = handler
+        self.commit_interval = commit_interval
+        if stream_params.get('commit_timeout') is not None:
+            self.commit_interval = min(commit_interval, stream_params['commit_timeout'] / 2)
+        self.commit_every_batches = commit_every_batches
+        self.lazy = lazy
+        self.workers = workers
+        self.processes = processes
+        self.stream_params = stream_params
+        self.stream = None
+        self.committer = None
+        self._stopped = False
+
+    def run(self):
+        """
+        Consumes one stream until it ends or stop is called, then commits the
+        remaining cursors.
+        :return: number of batches handled
+        """
+        self.stream = self.client.get_subscription_events_stream(self.subscription_id, **self.stream_params)
+        self.committer = CursorCommitter(self.client, self.subscription_id, self.stream.stream_id,
+                                         commit_interval=self.commit_interval,
+                                         commit_every_batches=self.commit_every_batches,
+                                         max_uncommitted_events=self.stream_params.get(
+                                             'max_uncommitted_events') or self.DEFAULT_MAX_UNCOMMITTED_EVENTS)
+        dispatcher = None
+        if self.workers is not None:
+            dispatcher = PartitionDispatcher(self.handler, self.committer.mark, self.workers, self.processes)
+        handled = 0
+        try:
+            while not self._stopped:
+                batch = self.stream.next_parsed_batch(self.lazy, keep_alive=True)
+                if 'events' not in batch:
+                    # lets stop take effect on idle subscriptions
+                    continue
+                if dispatcher is not None:
+                    dispatcher.submit(batch, self._count_events(batch))
+                else:
+                    self.handler(batch)
+                    self.committer.mark(batch['cursor'], self._count_events(batch))
+                handled += 1
+        except (EndOfStreamException, EndOfStreamException0):
+            pass
+        except socket.timeout:
+            if not self._stopped:
+                raise
+        finally:
+            try:
+                if dispatcher is not None:
+                    dispatcher.close()
+            finally:
+                try:
+                    self.committer.close()
+                finally:
+                    self.stream.close()
+        if dispatcher is not None and dispatcher.error is not None:
+            raise dispatcher.error
+        return handled
+
+    def stop(self):
+        """
+        Stops run after the batch being handled or the next keep-alive batch.
+        Keep-alive batches come every batch_flush_timeout seconds, keep it
+        below the read timeout of the stream. The stream stays open
+        until the last cursors are committed.
+        :return:
+        """
+        self._stopped = True
+
+    @classmethod
+    def _count_events(cls, batch):
+        if isinstance(batch, dict):
+            return len(batch['events'])
+        return batch.count_events()
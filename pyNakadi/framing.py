@@ -0,0 +1,233 @@
+import zlib
+
+
+class ChunkedDecoder:
+    """
+    Incremental decoder for HTTP/1.1 chunked transfer encoding.
+
+    Raw bytes are received straight into a reusable buffer (see get_buffer and
+    buffer_updated) and chunk headers and payloads are parsed out of it, so no
+    per-byte reads or intermediate bytes objects are needed. The decoder does
+    no I/O itself; NakadiStream drives it from a blocking socket.
+    """
+    CRLF = b'\r\n'
+
+    def __init__(self, buffer_size=64 * 1024):
+        self.buffer_size = buffer_size
+        self._buffer = bytearray(buffer_size)
+        self._view = memoryview(self._buffer)
+        # unparsed bytes are self._buffer[self._start:self._end]
+        self._start = 0
+        self._end = 0
+        # bytes left of the current chunk including its trailing CRLF,
+        # None while waiting for a chunk-size line
+        self._chunk_left = None
+        # bytes read_chunk waits for. Only read_chunk needs a whole chunk in
+        # the buffer, decode_into passes partial chunks on.
+        self._wanted = 0
+        self.finished = False
+
+    def pending(self):
+        """
+        :return: number of received bytes that are not decoded yet
+        """
+        return self._end - self._start
+
+    def get_buffer(self):
+        """
+        Returns a writable view on the free part of the receive buffer. Write
+        received bytes into it and report their count with buffer_updated.
+        :return: memoryview
+        """
+        if self._start == self._end:
+            self._start = self._end = 0
+            if len(self._buffer) > self.buffer_size and not self._wanted:
+                self._resize(self.buffer_size)
+        needed = max(self._end - self._start, self._wanted)
+        if needed >= len(self._buffer):
+            self._resize(2 * needed)
+        elif len(self._buffer) - self._end < self.buffer_size // 4 and self._start > 0:
+            self._compact()
+        return self._view[self._end:]
+
+    def buffer_updated(self, nbytes):
+        """
+        Marks nbytes written into the view returned by get_buffer as received.
+        :param nbytes:
+        :return:
+        """
+        self._end += nbytes
+
+    def feed(self, data):
+        """
+        Copies data into the receive buffer.
+        :param data: bytes-like object
+        :return:
+        """
+        data = memoryview(data)
+        while data:
+            view = self.get_buffer()
+            n = min(len(view), len(data))
+            view[:n] = data[:n]
+            self.buffer_updated(n)
+            data = data[n:]
+
+    def read_chunk(self):
+        """
+        Decodes the next complete chunk from the receive buffer.
+        :return: chunk payload as bytes, b'' for the terminating zero-size
+            chunk or None if more data has to be received first
+        """
+        if self._chunk_left is None and not self._read_chunk_size():
+            return None
+        if self.finished:
+            return b''
+        if self._end - self._start < self._chunk_left:
+            self._wanted = self._chunk_left
+            return None
+        self._wanted = 0
+        payload_end = self._start + self._chunk_left - 2
+        data = bytes(self._view[self._start:payload_end])
+        self._start = payload_end + 2
+        self._chunk_left = None
+        return data
+
+    def decode_into(self, sink):
+        """
+        Decodes all payload bytes available in the receive buffer, including
+        those of incomplete chunks, and writes them to sink.
+        :param sink: object with a write(bytes-like) method, e.g. LineBuffer
+        :return: number of payload bytes written
+        """
+        written = 0
+        while not self.finished:
+            if self._chunk_left is None and not self._read_chunk_size():
+                break
+            available = self._end - self._start
+            if not available:
+                break
+            if self._chunk_left > 2:
+                n = min(self._chunk_left - 2, available)
+                sink.write(self._view[self._start:self._start + n])
+                written += n
+            else:
+                n = min(self._chunk_left, available)
+            self._start += n
+            self._chunk_left -= n
+            if self._chunk_left == 0:
+                self._chunk_left = None
+        return written
+
+    def _read_chunk_size(self):
+        line_end = self._buffer.find(self.CRLF, self._start, self._end)
+        if line_end == -1:
+            return False
+        size_b = bytes(self._view[self._start:line_end]).split(b';', 1)[0]
+        size = int(size_b, 16)
+        self._start = line_end + 2
+        self._chunk_left = size + 2
+        if size == 0:
+            self.finished = True
+        return True
+
+    def _compact(self):
+        pending = self._end - self._start
+        self._view[:pending] = self._view[self._start:self._end]
+        self._start = 0
+        self._end = pending
+
+    def _resize(self, size):
+        buffer = bytearray(size)
+        pending = self._end - self._start
+        buffer[:pending] = self._view[self._start:self._end]
+        self._buffer = buffer
+        self._view = memoryview(buffer)
+        self._start = 0
+        self._end = pending
+
+
+class GzipDecompressor:
+    """
+    Sink that incrementally inflates a gzip stream and writes the inflated
+    bytes to another sink, so that batch framing works on the decompressed
+    stream.
+    """
+
+    def __init__(self, sink):
+        self.sink = sink
+        self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    def write(self, data):
+        inflated = self._decompressor.decompress(data)
+        if inflated:
+            self.sink.write(inflated)
+
+
+class LineBuffer:
+    """
+    Growable buffer that frames newline separated batches out of decoded
+    stream payload.
+
+    Newlines are searched from a remembered scan offset, so every byte is
+    scanned once no matter how many chunks a batch spans. Batches are handed
+    out as memoryview slices or copied exactly once into bytes. Space is
+    reused by compacting in place, or by moving to a new buffer once views
+    were handed out so that those stay valid.
+    """
+
+    def __init__(self, capacity=64 * 1024):
+        self._buffer = bytearray(capacity)
+        self._view = memoryview(self._buffer)
+        self._start = 0
+        self._end = 0
+        self._scan = 0
+        self._exported = False
+
+    def __len__(self):
+        return self._end - self._start
+
+    def write(self, data):
+        """
+        Appends data to the buffer.
+        :param data: bytes-like object
+        :return:
+        """
+        nbytes = len(data)
+        if len(self._buffer) - self._end < nbytes:
+            self._make_room(nbytes)
+        self._view[self._end:self._end + nbytes] = data
+        self._end += nbytes
+
+    def next_line(self, view=False):
+        """
+        Takes the next complete line out of the buffer.
+        :param view: return a memoryview slice instead of a bytes copy
+        :return: line without its newline or None if there is no complete line
+        """
+        line_end = self._buffer.find(b'\n', self._scan, self._end)
+        if line_end == -1:
+            self._scan = self._end
+            return None
+        line_start = self._start
+        self._start = self._scan = line_end + 1
+        if view:
+            self._exported = True
+            return self._view[line_start:line_end]
+        return bytes(self._view[line_start:line_end])
+
+    def _make_room(self, nbytes):
+        pending = self._end - self._start
+        capacity = len(self._buffer)
+        if pending + nbytes > capacity:
+            capacity = max(2 * capacity, pending + nbytes)
+        if self._exported or capacity != len(self._buffer):
+            buffer = bytearray(capacity)
+            buffer[:pending] = self._view[self._start:self._end]
+            self._buffer = buffer
+            self._view = memoryview(buffer)
+            self._exported = False
+        else:
+            self._view[:pending] = self._view[self._start:self._end]
+        self._scan -= self._start
+        self._start = 0
+        self._end = pending
@@ -0,0 +1,174 @@
+import re
+import socket
+import threading
+from bisect import bisect_left
+
+# names of the metrics recorded by the clients and streams
+REQUEST = 'request'
+STREAM_BYTES = 'stream.bytes'
+STREAM_BATCHES = 'stream.batches'
+STREAM_EVENTS = 'stream.events'
+STREAM_RECV = 'stream.recv'
+STREAM_USER = 'stream.user'
+
+_ID_SEGMENTS = {'event-types': '{name}', 'subscriptions': '{id}', 'partitions': '{partition}'}
+
+
+def endpoint(path):
+    """
+    :param path: request path, e.g. /event-types/orders/events
+    :return: path with names and ids replaced, e.g. /event-types/{name}/events
+    """
+    parts = path.split('?', 1)[0].split('/')
+    for i in range(1, len(parts)):
+        if parts[i - 1] in _ID_SEGMENTS and parts[i]:
+            parts[i] = _ID_SEGMENTS[parts[i - 1]]
+    return '/'.join(parts)
+
+
+class NoopMetrics:
+    """
+    Metrics sink interface, dropping everything. The clients record:
+
+    - request: seconds until the response headers arrived, with method,
+      endpoint and status tags. Commits are POST /subscriptions/{id}/cursors.
+    - stream.bytes, stream.batches and stream.events: counts read by streams,
+      events only for parsed streams
+    - stream.recv: seconds a stream waited in recv for a batch
+    - stream.user: seconds between a batch being returned and the next one
+      being requested, spent by the consumer
+    """
+
+    def increment(self, name, value=1, tags=None):
+        """
+        :param name: metric name
+        :param value: amount to add
+        :param tags: map of tag name to value
+        :return:
+        """
+
+    def timing(self, name, seconds, tags=None):
+        """
+        :param name: metric name
+        :param seconds: observed duration
+        :param tags: map of tag name to value
+        :return:
+        """
+
+
+class PrometheusMetrics(NoopMetrics):
+    """
+    Aggregates metrics in memory and renders them in the Prometheus text
+    format, to be served by the application's metrics endpoint. Counters are
+    named pyNakadi_<name>_total, timings are histograms named
+    pyNakadi_<name>_seconds.
+    """
+    BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+    def __init__(self, namespace='pyNakadi', buckets=BUCKETS):
+        """
+        :param namespace: prefix of the metric names
+        :param buckets: upper bounds of the histogram buckets in seconds
+        """
+        self.namespace = namespace
+        self.buckets = tuple(sorted(buckets))
+        self._counters = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def increment(self, name, value=1, tags=None):
+        key = (name, tuple(sorted(tags.items())) if tags else ())
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def timing(self, name, seconds, tags=None):
+        key = (name, tuple(sorted(tags.items())) if tags else ())
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                # bucket counts, then sum and count
+                histogram = self._histograms[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            histogram[bisect_left(self.buckets, seconds)] += 1
+            histogram[-2] += seconds
+            histogram[-1] += 1
+
+    def render(self):
+        """
+        :return: all metrics in the Prometheus text exposition format
+        """
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, list(histogram)) for key, histogram in self._histograms.items())
+        lines = []
+        typed = set()
+        for (name, tags), value in counters:
+            metric = self._name(name, '_total')
+            if metric not in typed:
+                typed.add(metric)
+                lines.append(f'# TYPE {metric} counter')
+            lines.append(f'{metric}{self._labels(tags)} {value}')
+        for (name, tags), histogram in histograms:
+            metric = self._name(name, '_seconds')
+            if metric not in typed:
+                typed.add(metric)
+                lines.append(f'# TYPE {metric} histogram')
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), histogram):
+                cumulative += count
+                lines.append(f'{metric}_bucket{self._labels(tags + (("le", bound),))} {cumulative}')
+            lines.append(f'{metric}_sum{self._labels(tags)} {histogram[-2]}')
+            lines.append(f'{metric}_count{self._labels(tags)} {histogram[-1]}')
+        return '\n'.join(lines) + '\n'
+
+    def _name(self, name, suffix):
+        return re.sub(r'[^a-zA-Z0-9_]', '_', f'{self.namespace}_{name}') + suffix
+
+    @staticmethod
+    def _labels(tags):
+        if not tags:
+            return ''
+        labels = ','.join('{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                          for name, value in tags)
+        return '{' + labels + '}'
+
+
+class StatsdMetrics(NoopMetrics):
+    """
+    Sends every metric to a StatsD agent over UDP, timings in milliseconds.
+    Tags are appended in the DogStatsD format, or dropped with tags=False.
+    Send errors are ignored.
+    """
+
+    def __init__(self, host='127.0.0.1', port=8125, prefix='pyNakadi', tags=True):
+        """
+        :param host: agent host
+        :param port: agent UDP port
+        :param prefix: prefix of the metric names
+        :param tags: append tags to the metrics
+        """
+        self.address = (host, port)
+        self.prefix = prefix
+        self.tags = tags
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.setblocking(False)
+
+    def increment(self, name, value=1, tags=None):
+        self._send(f'{self.prefix}.{name}:{value}|c', tags)
+
+    def timing(self, name, seconds, tags=None):
+        self._send(f'{self.prefix}.{name}:{seconds * 1000:.3f}|ms', tags)
+
+    def close(self):
+        """
+        Closes the UDP socket.
+        :return:
+        """
+        self._socket.close()
+
+    def _send(self, metric, tags):
+        if tags and self.tags:
+            metric += '|#' + ','.join(f'{name}:{value}' for name, value in tags.items())
+        try:
+            self._socket.sendto(metric.encode(), self.address)
+        except OSError:
+            pass
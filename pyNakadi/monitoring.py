@@ -0,0 +1,112 @@
+import threading
+import time
+
+
+class LagMonitor:
+    """
+    Serves subscription stats, cursors and lag to many readers, e.g.
+    dashboards, at a constant load on Nakadi. Results are cached for ttl
+    seconds and concurrent callers of the same request share one request in
+    flight. The lag of a subscription is queried with one cursors-lag
+    request per event type covering all its partitions.
+    """
+
+    def __init__(self, client, ttl=5):
+        """
+        :param client: NakadiClient
+        :param ttl: seconds results are served from the cache
+        """
+        self.client = client
+        self.ttl = ttl
+        self._entries = {}
+        self._lags = {}
+        self._lock = threading.Lock()
+
+    def get_subscription_stats(self, subscription_id, show_time_lag=False):
+        """
+        Cached NakadiClient.get_subscription_stats
+        """
+        return self._get(('stats', subscription_id, show_time_lag),
+                         lambda: self.client.get_subscription_stats(subscription_id, show_time_lag))
+
+    def get_subscription_cursors(self, subscription_id):
+        """
+        Cached NakadiClient.get_subscription_cursors
+        """
+        return self._get(('cursors', subscription_id),
+                         lambda: self.client.get_subscription_cursors(subscription_id))
+
+    def get_subscription_lag(self, subscription_id):
+        """
+        Unconsumed events of every partition of the subscription, from its
+        committed cursors.
+        :param subscription_id:
+        :return: map of (event_type, partition) to unconsumed events
+        """
+        return self._get(('lag', subscription_id), lambda: self._fetch_lag(subscription_id))
+
+    def get_lag_changes(self, subscription_id):
+        """
+        Lag of the partitions whose lag changed since the previous call for
+        the subscription, all partitions on the first call.
+        :param subscription_id:
+        :return: map of (event_type, partition) to (lag, change)
+        """
+        lag = self.get_subscription_lag(subscription_id)
+        with self._lock:
+            previous = self._lags.get(subscription_id, {})
+            self._lags[subscription_id] = lag
+        return {key: (value, value - previous.get(key, 0)) for key, value in lag.items()
+                if key not in previous or previous[key] != value}
+
+    def invalidate(self, subscription_id=None):
+        """
+        Drops cached results, of one subscription or all.
+        :param subscription_id:
+        :return:
+        """
+        with self._lock:
+            if subscription_id is None:
+                self._entries.clear()
+            else:
+                for key in [key for key in self._entries if key[1] == subscription_id]:
+                    del self._entries[key]
+
+    def _fetch_lag(self, subscription_id):
+        cursors_by_event_type = {}
+        for cursor in self.get_subscription_cursors(subscription_id)['items']:
+            cursors_by_event_type.setdefault(cursor['event_type'], []).append(
+                {'partition': cursor['partition'], 'offset': cursor['offset']})
+        lag = {}
+        for event_type, cursors in cursors_by_event_type.items():
+            for partition in self.client.get_event_type_cursor_lag(event_type, cursors):
+                lag[(event_type, partition['partition'])] = partition['unconsumed_events']
+        return lag
+
+    def _get(self, key, fetch):
+        with self._lock:
+            entry = self._entries.get(key)
+            owner = entry is None or (entry.done.is_set() and entry.expires <= time.monotonic())
+            if owner:
+                entry = self._entries[key] = _Entry()
+        if owner:
+            try:
+                entry.value = fetch()
+                entry.expires = time.monotonic() + self.ttl
+            except Exception as ex:
+                # errors are shared by the waiting callers, not cached
+                entry.error = ex
+            entry.done.set()
+        else:
+            entry.done.wait()
+        if entry.error is not None:
+            raise entry.error
+        return entry.value
+
+
+class _Entry:
+    def __init__(self):
+        self.value = None
+        self.error = None
+        self.expires = 0
+        self.done = threading.Event()
@@ -0,0 +1,154 @@
+import selectors
+import time
+
+from pyNakadi.client import EndOfStreamException
+
+
+class StreamMultiplexer:
+    """
+    Reads many NakadiStream objects from a single thread. Stream sockets are
+    switched to non-blocking mode and registered with a selector; whichever
+    streams are readable are read into their own decoders and their batches
+    are returned as (stream_id, batch) tuples. Batches are decoded as
+    configured by the parse flag of their stream.
+
+    Streams that end, or send nothing (not even a keep-alive) for
+    read_timeout seconds, are closed and removed. on_end is called with
+    their stream_id and None, or the TimeoutError of a timed out stream.
+    Streams failing to read or decode are closed and removed too, and the
+    error is raised by poll.
+    """
+    # bytes read from one stream before the other ready streams get a turn
+    MAX_READ_BYTES = 1024 * 1024
+
+    def __init__(self, streams=(), read_timeout=30, on_end=None):
+        """
+        :param streams: NakadiStream objects to read
+        :param read_timeout: seconds a stream may stay silent
+        :param on_end: called with stream_id and error of removed streams
+        """
+        self.read_timeout = read_timeout
+        self.on_end = on_end
+        self.streams = {}
+        self.selector = selectors.DefaultSelector()
+        # streams that may have data the selector does not report, kept in
+        # an ordered dict so that they take turns
+        self._ready = {}
+        self._last_read = {}
+        # batches of other streams read before a stream failed
+        self._pending = []
+        for stream in streams:
+            self.add(stream)
+
+    def add(self, stream):
+        """
+        Starts reading a stream.
+        :param stream: NakadiStream
+        :return:
+        """
+        stream.setblocking(False)
+        self.selector.register(stream.fileno(), selectors.EVENT_READ, stream.stream_id)
+        self.streams[stream.stream_id] = stream
+        self._last_read[stream.stream_id] = time.monotonic()
+        # http.client may have buffered body bytes together with the headers
+        self._ready[stream.stream_id] = None
+
+    def remove(self, stream_id, close=True):
+        """
+        Stops reading a stream.
+        :param stream_id:
+        :param close: close the stream too
+        :return: the removed NakadiStream
+        """
+        stream = self.streams.pop(stream_id)
+        self.selector.unregister(stream.fileno())
+        self._ready.pop(stream_id, None)
+        del self._last_read[stream_id]
+        if close:
+            stream.close()
+        return stream
+
+    def poll(self, timeout=None):
+        """
+        Waits until streams have data and reads each ready stream once.
+        :param timeout: seconds to wait, None waits until a stream has data
+            or times out
+        :return: list of (stream_id, batch) tuples, empty on timeout
+        """
+        if self._pending:
+            batches, self._pending = self._pending, []
+            return batches
+        if not self.streams:
+            return []
+        if not self._ready:
+            for key, _ in self.selector.select(self._select_timeout(timeout)):
+                self._ready[key.data] = None
+        batches = []
+        now = time.monotonic()
+        for stream_id in list(self._ready):
+            self._ready.pop(stream_id, None)
+            # on_end may have removed it
+            stream = self.streams.get(stream_id)
+            if stream is None:
+                continue
+            ended = False
+            failed = True
+            try:
+                try:
+                    nbytes = stream.read_nowait(self.MAX_READ_BYTES)
+                    if nbytes:
+                        self._last_read[stream_id] = now
+                    if nbytes >= self.MAX_READ_BYTES:
+                        self._ready[stream_id] = None
+                except EndOfStreamException:
+                    ended = True
+                batch = stream.poll_batch()
+                while batch is not None:
+                    batches.append((stream_id, batch))
+                    batch = stream.poll_batch()
+                failed = False
+            finally:
+                if failed:
+                    # the error is raised, the batches read before it are
+                    # returned by the next poll
+                    self._pending = batches
+                    self.remove(stream_id)
+            if ended or stream.finished():
+                self._end(stream_id, None)
+        for stream_id, last_read in list(self._last_read.items()):
+            if stream_id in self.streams and now - last_read > self.read_timeout:
+                self._end(stream_id, TimeoutError(f'No data from stream {stream_id} for {self.read_timeout}s'))
+        return batches
+
+    def __iter__(self):
+        """
+        Generates (stream_id, batch) tuples until all streams are removed.
+        """
+        while self.streams:
+            yield from self.poll()
+
+    def close(self):
+        """
+        Closes all streams and the selector.
+        :return:
+        """
+        for stream_id in list(self.streams):
+            self.remove(stream_id)
+        self.selector.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _select_timeout(self, timeout):
+        expires = min(self._last_read.values()) + self.read_timeout - time.monotonic()
+        if timeout is not None:
+            expires = min(expires, timeout)
+        return max(0, expires)
+
+    def _end(self, stream_id, error):
+        self.remove(stream_id)
+        if self.on_end is not None:
+            self.on_end(stream_id, error)
@@ -0,0 +1,141 @@
+import json
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+from pyNakadi.client import NakadiException
+
+
+class Partitioner:
+    """
+    Computes the partitions Nakadi assigns events to, from the
+    partition_strategy and partition_key_fields of their event type:
+
+    - hash: like Nakadi's hash partitioning, the sum of the java string
+      hashes of the key field values modulo the number of partitions
+    - user_defined: metadata.partition of the event
+    - random: unknown before publishing, None
+
+    Key fields of data change events are resolved within their data.
+    """
+
+    def __init__(self, event_type, partitions):
+        """
+        :param event_type: event type map, as returned by get_event_type
+        :param partitions: partition ids of the event type
+        """
+        self.event_type_name = event_type['name']
+        self.strategy = event_type.get('partition_strategy', 'random')
+        self.key_fields = [field.split('.') for field in event_type.get('partition_key_fields') or []]
+        self.data_change = event_type.get('category') == 'data'
+        self.partitions = sorted(partitions, key=lambda p: (not p.isdigit(), int(p) if p.isdigit() else p))
+        if self.strategy == 'hash' and not self.key_fields:
+            raise NakadiException(code=1, msg=f'Event type {self.event_type_name} has no partition_key_fields')
+
+    @classmethod
+    def from_client(cls, client, event_type_name):
+        """
+        Reads event type and partitions through client, which serves them
+        from its metadata cache if it has one.
+        :param client: NakadiClient
+        :param event_type_name:
+        :return: Partitioner
+        """
+        event_type = client.get_event_type(event_type_name)
+        partitions = [partition['partition'] for partition in client.get_event_type_partitions(event_type_name)]
+        return cls(event_type, partitions)
+
+    def partition(self, event):
+        """
+        :param event: event map
+        :return: partition id, None for random partitioning
+        """
+        if self.strategy == 'hash':
+            if self.data_change:
+                event = event['data']
+            hash_value = 0
+            for field in self.key_fields:
+                hash_value += _java_string_hash(_key_value(event, field))
+            hash_value = (hash_value + 2 ** 31) % 2 ** 32 - 2 ** 31
+            # Nakadi takes abs(hash % n) with Java's truncated remainder,
+            # which equals abs(hash) % n here: unlike Java's Math.abs, abs
+            # does not overflow for -2 ** 31
+            return self.partitions[abs(hash_value) % len(self.partitions)]
+        if self.strategy == 'user_defined':
+            return event['metadata']['partition']
+        return None
+
+    def partitions_of(self, events):
+        """
+        :param events: list of event maps
+        :return: list of partition ids in the order of events
+        """
+        partition = self.partition
+        return [partition(event) for event in events]
+
+    def group(self, events):
+        """
+        Groups events by partition, keeping their order within each.
+        :param events: list of event maps
+        :return: map of partition id to events
+        """
+        groups = {}
+        for event, partition in zip(events, self.partitions_of(events)):
+            groups.setdefault(partition, []).append(event)
+        return groups
+
+    def counts(self, events):
+        """
+        Counts events per partition, to size batches or spot hot partitions.
+        :param events: list of event maps
+        :return: Counter of partition ids, most_common() lists the hottest
+            partitions first
+        """
+        return Counter(self.partitions_of(events))
+
+    def post_events(self, client, events, max_workers=None, compression=None):
+        """
+        Posts the events with one concurrent post_events request per
+        partition.
+        :param client: NakadiClient
+        :param events: list of event maps
+        :param max_workers: max concurrent requests, defaults to the
+            pool_maxsize of client
+        :param compression: see NakadiClient.post_events
+        :return: map of partition id to True, or to the exception its
+            post_events raised
+        """
+        groups = self.group(events)
+        workers = min(max_workers or client.pool_maxsize, len(groups))
+        if workers == 0:
+            return {}
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {partition: executor.submit(client.post_events, self.event_type_name, partition_events,
+                                                  compression=compression)
+                       for partition, partition_events in groups.items()}
+        result_map = {}
+        for partition, future in futures.items():
+            try:
+                result_map[partition] = future.result()
+            except Exception as ex:
+                result_map[partition] = ex
+        return result_map
+
+
+def _key_value(event, path):
+    value = event
+    for name in path:
+        value = value[name]
+    if isinstance(value, str):
+        return value
+    # Nakadi hashes the json text of other values
+    return json.dumps(value, separators=(',', ':'))
+
+
+@lru_cache(maxsize=4096)
+def _java_string_hash(value):
+    hash_value = 0
+    utf16 = value.encode('utf-16-be')
+    for i in range(0, len(utf16), 2):
+        hash_value = (31 * hash_value + (utf16[i] << 8 | utf16[i + 1])) & 0xFFFFFFFF
+    return hash_value - 2 ** 32 if hash_value >= 2 ** 31 else hash_value
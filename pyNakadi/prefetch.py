@@ -0,0 +1,113 @@
+import threading
+from collections import deque
+
+from pyNakadi.client import NakadiClient, NakadiException
+
+
+class PrefetchStream:
+    """
+    Iterator that reads batches of a NakadiStream ahead in a background
+    thread, so receiving overlaps with processing. At most max_batches
+    batches, or max_bytes bytes of them, wait in the queue. Once it is full
+    the reader stops reading the socket and TCP flow control makes Nakadi
+    pause, which bounds the memory of a consumer that falls behind.
+
+    Batches are decoded in the consuming thread as configured by the parse
+    flag of the stream. Errors of the reader, like the end of the stream,
+    are raised once the batches read before them are consumed.
+    """
+
+    def __init__(self, stream, max_batches=100, max_bytes=None):
+        """
+        :param stream: NakadiStream
+        :param max_batches: max batches read ahead
+        :param max_bytes: max bytes of batches read ahead, at least one batch
+            is always read ahead
+        """
+        NakadiClient.assert_it(max_batches > 0, NakadiException(code=1, msg='max_batches must be positive'))
+        self.stream = stream
+        self.max_batches = max_batches
+        self.max_bytes = max_bytes
+        self._queue = deque()
+        self._nbytes = 0
+        self._error = None
+        self._closed = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name='NakadiPrefetch', daemon=True)
+        self._thread.start()
+
+    @property
+    def stream_id(self):
+        return self.stream.stream_id
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        while True:
+            with self._condition:
+                while not self._queue and self._error is None:
+                    self._condition.wait()
+                if not self._queue:
+                    raise self._error
+                line = self._queue.popleft()
+                self._nbytes -= len(line)
+                self._condition.notify_all()
+            batch = self.stream.decode(line)
+            if batch is not None:
+                return batch
+
+    def pending(self):
+        """
+        :return: number of batches read ahead
+        """
+        with self._condition:
+            return len(self._queue)
+
+    def close(self):
+        """
+        Closes the stream and stops the reader, dropping queued batches.
+        :return:
+        """
+        with self._condition:
+            self._closed = True
+            self._queue.clear()
+            self._nbytes = 0
+            if self._error is None:
+                self._error = NakadiException(code=1, msg='Stream is closed')
+            self._condition.notify_all()
+        self.stream.close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _full(self):
+        if len(self._queue) >= self.max_batches:
+            return True
+        return self.max_bytes is not None and self._queue and self._nbytes >= self.max_bytes
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._full() and not self._closed:
+                    self._condition.wait()
+                if self._closed:
+                    return
+            try:
+                line = self.stream.next_batch()
+            except Exception as ex:
+                with self._condition:
+                    if self._error is None:
+                        self._error = ex
+                    self._condition.notify_all()
+                return
+            with self._condition:
+                if self._closed:
+                    return
+                self._queue.append(line)
+                self._nbytes += len(line)
+                self._condition.notify_all()
@@ -0,0 +1,185 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from pyNakadi.client import NakadiException, NakadiPublishException
+
+
+class NakadiPublisher:
+    """
+    Publishes single events in batches. Events are accumulated per event type
+    by a background thread and posted once a batch reaches max_batch_count
+    events or max_batch_bytes bytes, or once its oldest event waited linger
+    seconds. publish blocks when max_queue_size events are waiting, so
+    producers slow down to what Nakadi accepts.
+
+    Every publish returns a Future that resolves with True when its event was
+    submitted, or fails with the NakadiException of its event. Events
+    rejected in a 207/422 response fail with a NakadiPublishException whose
+    items holds just their own batch item response.
+    """
+    _FLUSH = object()
+    _CLOSE = object()
+
+    def __init__(self, client,
+                 max_batch_count=1000,
+                 max_batch_bytes=1024 * 1024,
+                 linger=0.05,
+                 max_queue_size=10000,
+                 compression=None,
+                 retry_failed_only=False):
+        """
+        :param client: NakadiClient events are posted with
+        :param max_batch_count: max events per publish request
+        :param max_batch_bytes: max encoded event bytes per publish request
+        :param linger: seconds an event may wait for its batch to fill up
+        :param max_queue_size: events waiting before publish blocks
+        :param compression: passed to NakadiClient.post_events
+        :param retry_failed_only: passed to NakadiClient.post_events
+        """
+        self.client = client
+        self.max_batch_count = max_batch_count
+        self.max_batch_bytes = max_batch_bytes
+        self.linger = linger
+        self.compression = compression
+        self.retry_failed_only = retry_failed_only
+        self._queue = queue.Queue(max_queue_size)
+        self._batches = {}
+        self._closed = False
+        # held while checking _closed and queueing, so nothing is queued
+        # after the close marker
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name='NakadiPublisher', daemon=True)
+        self._thread.start()
+
+    def publish(self, event_type_name, event, timeout=None):
+        """
+        Queues an event for publishing.
+        :param event_type_name:
+        :param event: event map, or event json encoded as bytes
+        :param timeout: seconds to wait for queue space, None waits forever
+        :return: concurrent.futures.Future
+        """
+        if not isinstance(event, (bytes, bytearray, memoryview)):
+            event = self.client.json_dumps(event)
+        future = Future()
+        with self._lock:
+            self._assert_open()
+            try:
+                self._queue.put((event_type_name, event, future), timeout=timeout)
+            except queue.Full:
+                raise NakadiException(code=1, msg='Publisher queue is full')
+        return future
+
+    def flush(self, timeout=None):
+        """
+        Publishes all events queued so far.
+        :param timeout: seconds to wait, None waits forever
+        :return: True if everything was published within timeout
+        """
+        done = threading.Event()
+        with self._lock:
+            self._assert_open()
+            self._queue.put((self._FLUSH, done, None))
+        return done.wait(timeout)
+
+    def close(self, timeout=None):
+        """
+        Publishes all queued events and stops the background thread.
+        :param timeout: seconds to wait, None waits forever
+        :return:
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put((self._CLOSE, None, None))
+        self._thread.join(timeout)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _assert_open(self):
+        if self._closed:
+            raise NakadiException(code=1, msg='Publisher is closed')
+
+    def _run(self):
+        while True:
+            try:
+                event_type_name, event, future = self._queue.get(timeout=self._next_timeout())
+            except queue.Empty:
+                self._flush_due()
+                continue
+            if event_type_name is self._FLUSH:
+                self._flush_all()
+                event.set()
+            elif event_type_name is self._CLOSE:
+                self._flush_all()
+                return
+            else:
+                self._add(event_type_name, event, future)
+                self._flush_due()
+
+    def _next_timeout(self):
+        if not self._batches:
+            return None
+        oldest = min(batch.started for batch in self._batches.values())
+        return max(0, oldest + self.linger - time.monotonic())
+
+    def _add(self, event_type_name, event, future):
+        batch = self._batches.get(event_type_name)
+        if batch is not None and batch.nbytes + len(event) + 1 > self.max_batch_bytes:
+            self._send(event_type_name)
+            batch = None
+        if batch is None:
+            batch = self._batches[event_type_name] = _Batch()
+        batch.add(event, future)
+        if len(batch.events) >= self.max_batch_count or batch.nbytes >= self.max_batch_bytes:
+            self._send(event_type_name)
+
+    def _flush_due(self):
+        now = time.monotonic()
+        for event_type_name, batch in list(self._batches.items()):
+            if batch.started + self.linger <= now:
+                self._send(event_type_name)
+
+    def _flush_all(self):
+        for event_type_name in list(self._batches):
+            self._send(event_type_name)
+
+    def _send(self, event_type_name):
+        batch = self._batches.pop(event_type_name)
+        try:
+            self.client.post_events(event_type_name, batch.events, compression=self.compression,
+                                    retry_failed_only=self.retry_failed_only)
+        except NakadiPublishException as ex:
+            for index, future in enumerate(batch.futures):
+                item = ex.items[index] if index < len(ex.items) else None
+                if item is not None and item.get('publishing_status') == 'submitted':
+                    future.set_result(True)
+                else:
+                    msg = f"Event not published: {item}" if item is not None else ex.msg
+                    future.set_exception(NakadiPublishException(code=ex.code, msg=msg, items=[item]))
+        except Exception as ex:
+            for future in batch.futures:
+                future.set_exception(ex)
+        else:
+            for future in batch.futures:
+                future.set_result(True)
+
+
+class _Batch:
+    def __init__(self):
+        self.events = []
+        self.futures = []
+        self.nbytes = 2
+        self.started = time.monotonic()
+
+    def add(self, event, future):
+        self.events.append(event)
+        self.futures.append(future)
+        self.nbytes += len(event) + 1
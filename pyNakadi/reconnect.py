@@ -0,0 +1,158 @@
+import random
+import time
+
+from pyNakadi.client import NakadiClient, NakadiException, EndOfStreamException, EndOfStreamException0
+
+
+class ReconnectingStream:
+    """
+    Iterator of parsed batches that reopens its stream when it ends or
+    breaks. Reconnects wait a random delay up to an exponentially growing
+    limit (full jitter), so consumers of a rebalanced subscription do not
+    come back all at once. 409 (no free slot) and 429 (throttled) responses
+    back off from larger delays, 5xx responses and network errors from
+    BACKOFF, and other errors are raised. The delay resets once a batch
+    arrives.
+
+    Subscription streams get a new stream_id on every reconnect, commit
+    with the current one. Event type streams resume after the cursors of the
+    last generated batches via X-nakadi-cursors. Without initial cursors they
+    start after the newest offsets of all partitions, read when the stream
+    is first opened.
+    """
+    BACKOFF = 0.5
+    BACKOFF_MAX = 30
+    # a slot frees up only when a consumer leaves or its session times out
+    CONFLICT_BACKOFF = 5
+    THROTTLE_BACKOFF = 2
+
+    def __init__(self, client, subscription_id=None, event_type_name=None, cursors=None,
+                 parse=True, max_retries=None, on_reconnect=None, **stream_params):
+        """
+        :param client: NakadiClient
+        :param subscription_id: read this subscription, or
+        :param event_type_name: read this event type
+        :param cursors: initial cursors of an event type stream
+        :param parse: True for batch maps, 'lazy' for LazyBatch objects
+        :param max_retries: max reconnect attempts in a row, None for no limit
+        :param on_reconnect: called with every new NakadiStream
+        :param stream_params: passed to the stream factory method
+        """
+        NakadiClient.assert_it((subscription_id is None) != (event_type_name is None),
+                               NakadiException(code=1, msg='Either subscription_id or event_type_name is required'))
+        NakadiClient.assert_it(parse in [True, 'lazy'],
+                               NakadiException(code=1, msg="parse must be True or 'lazy'"))
+        self.client = client
+        self.subscription_id = subscription_id
+        self.event_type_name = event_type_name
+        self.cursors = {cursor['partition']: cursor for cursor in cursors or []}
+        self.parse = parse
+        self.max_retries = max_retries
+        self.on_reconnect = on_reconnect
+        self.stream_params = stream_params
+        self.stream = None
+        self.reconnects = 0
+        self._attempt = 0
+        self._delay = 0
+        self._opened = False
+        self._closed = False
+
+    @property
+    def stream_id(self):
+        """
+        X-Nakadi-StreamId of the current stream
+        """
+        return self.stream.stream_id if self.stream is not None else None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        while True:
+            if self._closed:
+                raise StopIteration
+            if self.stream is None:
+                self._connect()
+            try:
+                batch = self.stream.next_parsed_batch(self.parse == 'lazy')
+            except (EndOfStreamException, EndOfStreamException0, OSError):
+                self._drop()
+                continue
+            self._attempt = 0
+            if self.event_type_name is not None:
+                self.cursors[batch['cursor']['partition']] = batch['cursor']
+            return batch
+
+    def close(self):
+        """
+        Closes the current stream and ends iteration.
+        :return:
+        """
+        self._closed = True
+        self._drop()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _open(self):
+        if self.subscription_id is not None:
+            return self.client.get_subscription_events_stream(self.subscription_id, parse=self.parse,
+                                                              **self.stream_params)
+        if not self.cursors:
+            # Nakadi streams only the partitions of the cursors, so all of
+            # them are needed to resume partitions idle before a reconnect
+            self.cursors = {partition['partition']: {'partition': partition['partition'],
+                                                     'offset': partition['newest_available_offset']}
+                            for partition in self.client.get_event_type_partitions(self.event_type_name)}
+        cursors = list(self.cursors.values())
+        return self.client.get_event_type_events_stream(self.event_type_name, cursors=cursors, parse=self.parse,
+                                                         **self.stream_params)
+
+    def _connect(self):
+        while True:
+            if self._attempt > 0:
+                time.sleep(self._delay)
+            try:
+                self.stream = self._open()
+            except NakadiException as ex:
+                if ex.code == 409:
+                    self._failed(self.CONFLICT_BACKOFF)
+                elif ex.code == 429:
+                    self._failed(self.THROTTLE_BACKOFF)
+                elif ex.code >= 500:
+                    self._failed(self.BACKOFF)
+                else:
+                    raise
+                self._raise_after_max_retries(ex)
+                continue
+            except OSError as ex:
+                self._failed(self.BACKOFF)
+                self._raise_after_max_retries(ex)
+                continue
+            if self._opened:
+                self.reconnects += 1
+                if self.on_reconnect is not None:
+                    self.on_reconnect(self.stream)
+            self._opened = True
+            return
+
+    def _drop(self):
+        if self.stream is not None:
+            try:
+                self.stream.close()
+            except OSError:
+                pass
+            self.stream = None
+            self._failed(self.BACKOFF)
+
+    def _failed(self, backoff):
+        self._delay = random.uniform(0, min(backoff * 2 ** self._attempt, self.BACKOFF_MAX))
+        self._attempt += 1
+
+    def _raise_after_max_retries(self, ex):
+        if self.max_retries is not None and self._attempt > self.max_retries:
+            raise ex
+
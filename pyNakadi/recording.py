@@ -0,0 +1,287 @@
+import mmap
+import struct
+import threading
+import time
+import zlib
+
+from pyNakadi.batch import LazyBatch
+from pyNakadi.client import NakadiClient, NakadiException, EndOfStreamException0
+from pyNakadi.serialization import get_json_decoder
+
+MAGIC = b'PYNAKADI-RECORDING-1\n'
+# kind, wall clock time and payload length of every record
+RECORD = struct.Struct('>cdI')
+SESSION = b'H'
+STREAM = b'S'
+BATCH = b'B'
+COMPRESSIONS = ('', 'deflate')
+
+
+class StreamRecorder:
+    """
+    Tees the raw batch lines read by streams, keep-alive batches included,
+    into an append-only file for RecordedStream. Every recorder appends a
+    session record naming its compression, a stream record whenever the
+    batches come from another stream_id, and a record per batch. Records are
+    length prefixed and stamped with the time they were read.
+
+    With compression='deflate' the batches of a session are compressed as
+    one deflate stream, flushed after every batch, so small batches compress
+    against the earlier ones. A recording cut off by a crash replays up to
+    its last complete record.
+    """
+
+    def __init__(self, path, compression=None, compresslevel=6):
+        """
+        :param path: file to append to, created if missing
+        :param compression: None or 'deflate'
+        :param compresslevel: see zlib.compressobj
+        """
+        NakadiClient.assert_it((compression or '') in COMPRESSIONS,
+                               NakadiException(code=1, msg=f'Unsupported compression {compression}'))
+        self.path = path
+        self.compression = compression
+        self._file = open(path, 'ab')
+        if self._file.tell() == 0:
+            self._file.write(MAGIC)
+        else:
+            with open(path, 'rb') as f:
+                magic = f.read(len(MAGIC))
+            if magic != MAGIC:
+                self._file.close()
+                raise NakadiException(code=1, msg=f'{path} is not a stream recording')
+        self._compressor = None
+        if compression:
+            self._compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, -zlib.MAX_WBITS)
+        self._stream_id = None
+        self._lock = threading.Lock()
+        self._write(SESSION, (compression or '').encode())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def record(self, stream):
+        """
+        Records the batches read from now on by a NakadiStream or
+        AsyncNakadiStream.
+        :param stream:
+        :return: the stream
+        """
+        stream.recorder = self
+        return stream
+
+    def write(self, stream_id, batch):
+        """
+        Appends a batch line, called by recorded streams.
+        :param stream_id: stream the batch was read from
+        :param batch: batch line as bytes or memoryview
+        :return:
+        """
+        with self._lock:
+            if stream_id != self._stream_id:
+                self._stream_id = stream_id
+                self._write(STREAM, stream_id.encode())
+            if self._compressor is not None:
+                batch = self._compressor.compress(batch) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+            self._write(BATCH, batch)
+
+    def flush(self):
+        """
+        Writes buffered records to the file.
+        :return:
+        """
+        with self._lock:
+            self._file.flush()
+
+    def close(self):
+        """
+        Flushes and closes the file.
+        :return:
+        """
+        with self._lock:
+            self._file.close()
+
+    def _write(self, kind, payload):
+        self._file.write(RECORD.pack(kind, time.time(), len(payload)))
+        self._file.write(payload)
+
+
+class RecordedStream:
+    """
+    Iterator that replays a recording of StreamRecorder with the interface of
+    NakadiStream: next_batch, next_parsed_batch, batches, current_batch and
+    stream_id, which changes where the recording switched streams. The file
+    is memory-mapped, so the page cache serves it without read calls, and
+    next_batch(view=True) returns batches of uncompressed recordings without
+    copying them. Like a stream that ended, the replay raises EndOfStreamException0
+    after the last batch.
+
+    By default batches are replayed as fast as they are consumed. With speed
+    the original timing is kept, scaled by speed, e.g. 1 for the recorded
+    rate or 10 for ten times faster; pauses between recording sessions are
+    skipped.
+    """
+
+    def __init__(self, path, parse=False, json_decoder=None, speed=None):
+        """
+        :param path: recording file
+        :param parse: see NakadiStream
+        :param json_decoder: see NakadiStream
+        :param speed: None to replay at max speed, otherwise the factor of
+            the recorded rate
+        """
+        NakadiClient.assert_it(speed is None or speed > 0, NakadiException(code=1, msg='speed must be positive'))
+        self.path = path
+        self.parse = parse
+        self.json_loads = get_json_decoder(json_decoder)
+        self.speed = speed
+        self.current_batch = None
+        self.stream_id = None
+        with open(path, 'rb') as f:
+            try:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # empty files can not be mapped
+                self._mmap = None
+        if self._mmap is None or self._mmap[:len(MAGIC)] != MAGIC:
+            if self._mmap is not None:
+                self._mmap.close()
+            raise NakadiException(code=1, msg=f'{path} is not a stream recording')
+        self._view = memoryview(self._mmap)
+        self._position = len(MAGIC)
+        self._decompressor = None
+        self._origin = None
+        self._closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.parse:
+            return self.next_parsed_batch(lazy=self.parse == 'lazy')
+        return self.next_batch()
+
+    def next_batch(self, view=False):
+        """
+        Replays the next batch line.
+        :param view: return a memoryview on the mapped file instead of a bytes
+            copy, for uncompressed recordings
+        :return: batch without its trailing newline
+        """
+        while True:
+            record = self._next_record()
+            if record is None:
+                raise EndOfStreamException0
+            kind, recorded_at, payload = record
+            if kind == BATCH:
+                break
+            if kind == STREAM:
+                self.stream_id = str(payload, 'utf-8')
+            elif kind == SESSION:
+                compression = str(payload, 'utf-8')
+                if compression not in COMPRESSIONS:
+                    raise NakadiException(code=1, msg=f'Unsupported compression {compression} in {self.path}')
+                self._decompressor = zlib.decompressobj(-zlib.MAX_WBITS) if compression else None
+                self._origin = None
+        if self._decompressor is not None:
+            batch = self._decompressor.decompress(payload)
+        elif view:
+            batch = payload
+        else:
+            batch = bytes(payload)
+        if self.speed is not None:
+            self._wait(recorded_at)
+        self.current_batch = batch
+        return self.current_batch
+
+    def next_parsed_batch(self, lazy=False, keep_alive=False):
+        """
+        Replays and decodes the next batch that carries events, see
+        NakadiStream.next_parsed_batch.
+        :param lazy: only decode the cursor and return a LazyBatch
+        :param keep_alive: return keep-alive batches too
+        :return: batch map with cursor, events and optionally info
+        """
+        decode = self._decode_lazy if lazy else self.json_loads
+        batch = decode(self.next_batch())
+        while 'events' not in batch and not keep_alive:
+            batch = decode(self.next_batch())
+        return batch
+
+    def batches(self, lazy=False):
+        """
+        Generates decoded batches that carry events.
+        :param lazy: generate LazyBatch objects
+        :return: generator of batch maps
+        """
+        while True:
+            yield self.next_parsed_batch(lazy)
+
+    def decode(self, line):
+        """
+        Decodes a batch line as configured by parse, see NakadiStream.decode.
+        :param line: batch line as bytes
+        :return: the batch, None for keep-alive batches of parsed streams
+        """
+        if not self.parse:
+            return line
+        batch = self._decode_lazy(line) if self.parse == 'lazy' else self.json_loads(line)
+        return batch if 'events' in batch else None
+
+    def get_stream_id(self):
+        """
+        :return: stream_id of the recorded stream of the current batch
+        """
+        return self.stream_id
+
+    def close(self):
+        """
+        Unmaps the file. While views returned by next_batch(view=True) are
+        referenced the mapping is left to be released with them.
+        :return:
+        """
+        self._closed = True
+        self._view.release()
+        try:
+            self._mmap.close()
+        except BufferError:
+            pass
+
+    def closed(self):
+        """
+        Flag if the file is unmapped or not.
+        :return:
+        """
+        return self._closed
+
+    def _next_record(self):
+        start = self._position + RECORD.size
+        if start > len(self._view):
+            return None
+        kind, recorded_at, length = RECORD.unpack_from(self._view, self._position)
+        if start + length > len(self._view):
+            # cut off while it was written
+            return None
+        self._position = start + length
+        return kind, recorded_at, self._view[start:start + length]
+
+    def _wait(self, recorded_at):
+        now = time.monotonic()
+        if self._origin is None:
+            self._origin = (recorded_at, now)
+            return
+        delay = self._origin[1] + (recorded_at - self._origin[0]) / self.speed - now
+        if delay > 0:
+            time.sleep(delay)
+
+    def _decode_lazy(self, raw):
+        return LazyBatch(raw, self.json_loads)
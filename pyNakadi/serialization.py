@@ -0,0 +1,123 @@
+import json
+
+# Preferred order when no decoder or encoder is requested explicitly.
+JSON_DECODERS = ['orjson', 'simdjson', 'ujson', 'json']
+JSON_ENCODERS = ['orjson', 'ujson', 'json']
+
+
+def _orjson_decoder():
+    import orjson
+    return orjson.loads
+
+
+def _simdjson_decoder():
+    import simdjson
+    parser = simdjson.Parser()
+
+    def loads(data):
+        return parser.parse(data, True)
+
+    return loads
+
+
+def _ujson_decoder():
+    import ujson
+    return ujson.loads
+
+
+def _json_decoder():
+    return json.loads
+
+
+_DECODER_FACTORIES = {
+    'orjson': _orjson_decoder,
+    'simdjson': _simdjson_decoder,
+    'ujson': _ujson_decoder,
+    'json': _json_decoder,
+}
+
+
+def get_json_decoder(decoder=None):
+    """
+    Resolves a function that decodes a JSON document given as bytes.
+    :param decoder: None for the fastest installed library, one of
+        JSON_DECODERS or a callable that is returned as is
+    :return: callable
+    """
+    if callable(decoder):
+        return decoder
+    if decoder is not None:
+        if decoder not in _DECODER_FACTORIES:
+            raise ValueError(f"Unknown json decoder {decoder}. Expected one of {JSON_DECODERS}")
+        return _DECODER_FACTORIES[decoder]()
+    for name in JSON_DECODERS:
+        try:
+            return _DECODER_FACTORIES[name]()
+        except ImportError:
+            pass
+
+
+def _orjson_encoder():
+    import orjson
+    return orjson.dumps
+
+
+def _ujson_encoder():
+    import ujson
+
+    def dumps(obj):
+        return ujson.dumps(obj, ensure_ascii=False).encode('utf-8')
+
+    return dumps
+
+
+def _json_encoder():
+    def dumps(obj):
+        return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+    return dumps
+
+
+_ENCODER_FACTORIES = {
+    'orjson': _orjson_encoder,
+    'ujson': _ujson_encoder,
+    'json': _json_encoder,
+}
+
+
+def get_json_encoder(encoder=None):
+    """
+    Resolves a function that encodes an object into a JSON document as bytes.
+    :param encoder: None for the fastest installed library, one of
+        JSON_ENCODERS or a callable that is returned as is
+    :return: callable
+    """
+    if callable(encoder):
+        return encoder
+    if encoder is not None:
+        if encoder not in _ENCODER_FACTORIES:
+            raise ValueError(f"Unknown json encoder {encoder}. Expected one of {JSON_ENCODERS}")
+        return _ENCODER_FACTORIES[encoder]()
+    for name in JSON_ENCODERS:
+        try:
+            return _ENCODER_FACTORIES[name]()
+        except ImportError:
+            pass
+
+
+def encode_events(events, dumps):
+    """
+    Encodes events into the JSON array body of a publish request.
+    :param events: list of events, a JSON array as bytes, or an iterable of
+        events that are each already encoded as bytes, which are spliced into
+        the array without re-encoding
+    :param dumps: encoder for events that are not encoded yet
+    :return: bytes
+    """
+    if isinstance(events, (bytes, bytearray, memoryview)):
+        return bytes(events)
+    if not isinstance(events, (list, tuple)):
+        events = list(events)
+    if events and isinstance(events[0], (bytes, bytearray, memoryview)):
+        return b'[' + b','.join(events) + b']'
+    return dumps(events)
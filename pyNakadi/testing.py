@@ -0,0 +1,754 @@
+"""
+In-process stand-in for a Nakadi server, for tests and benchmarks that can
+not run a real one. Use it as the pytest fixture fake_nakadi, with
+pytest_plugins = ['pyNakadi.testing'] in a conftest.py, or directly:
+
+    with FakeNakadi(partitions=4) as nakadi:
+        client = NakadiClient('token', nakadi.url)
+"""
+import gzip
+import json
+import re
+import socket
+import socketserver
+import threading
+import time
+import uuid
+import zlib
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from pyNakadi.partitioning import Partitioner
+
+BEGIN = 'BEGIN'
+
+
+def format_offset(offset):
+    """
+    :param offset: index of an event in its partition, -1 before the first
+    :return: Nakadi offset string
+    """
+    return BEGIN if offset < 0 else f'001-0001-{offset:018d}'
+
+
+def parse_offset(offset):
+    """
+    :param offset: Nakadi offset string
+    :return: index of the event in its partition, -1 for BEGIN
+    """
+    if offset == BEGIN:
+        return -1
+    return int(offset.rsplit('-', 1)[-1])
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat()
+
+
+class _Server(socketserver.ThreadingMixIn, HTTPServer):
+    # http.server.ThreadingHTTPServer needs Python 3.7
+    daemon_threads = True
+
+
+class _HttpError(Exception):
+
+    def __init__(self, status, detail, body=None):
+        super().__init__(detail)
+        self.status = status
+        self.detail = detail
+        self.body = body
+
+
+class _EventType:
+
+    def __init__(self, event_type, partitions):
+        self.map = event_type
+        self.partitions = [[] for _ in range(partitions)]
+        self.partitioner = Partitioner(event_type, [str(p) for p in range(partitions)])
+        self.next_partition = 0
+
+    def partition_of(self, event):
+        partition = self.partitioner.partition(event)
+        if partition is None:
+            partition = str(self.next_partition)
+            self.next_partition = (self.next_partition + 1) % len(self.partitions)
+        if partition not in self.partitioner.partitions:
+            raise ValueError(f'partition {partition} does not exist')
+        return partition
+
+    def newest(self, partition):
+        return len(self.partitions[int(partition)]) - 1
+
+
+class _Stream:
+    """
+    Read position of an event type stream, or of a subscription stream in
+    the partitions currently assigned to it.
+    """
+
+    def __init__(self, params, sent, subscription=None):
+        self.id = str(uuid.uuid4())
+        self.subscription = subscription
+        self.sent = sent
+        self.batch_limit = params.get('batch_limit', 1)
+        self.stream_limit = params.get('stream_limit', 0)
+        self.batch_flush_timeout = params.get('batch_flush_timeout', 30)
+        self.stream_timeout = params.get('stream_timeout', 0)
+        self.stream_keep_alive_limit = params.get('stream_keep_alive_limit', 0)
+        self.max_uncommitted_events = params.get('max_uncommitted_events', 10)
+        self.commit_timeout = params.get('commit_timeout', 60)
+        self.started = time.monotonic()
+        self.events_sent = 0
+        self.last_flush = {}
+        self.keep_alives = {}
+        self.terminated = False
+
+    def assigned(self):
+        if self.subscription is None:
+            return list(self.sent)
+        subscription = self.subscription
+        keys = sorted(subscription.committed)
+        streams = subscription.streams
+        assigned = keys[streams.index(self.id)::len(streams)]
+        for key in list(self.sent):
+            if key not in assigned:
+                del self.sent[key]
+        for key in assigned:
+            if key not in self.sent:
+                # a partition moved to this stream continues after its commit
+                self.sent[key] = subscription.committed[key]
+                self.last_flush[key] = time.monotonic()
+        return assigned
+
+    def budget(self, assigned):
+        budget = float('inf')
+        if self.subscription is not None:
+            committed = self.subscription.committed
+            budget = self.max_uncommitted_events - sum(self.sent[key] - committed[key] for key in assigned)
+        if self.stream_limit:
+            budget = min(budget, self.stream_limit - self.events_sent)
+        return budget
+
+    def uncommitted(self):
+        committed = self.subscription.committed
+        return sum(max(0, offset - committed[key]) for key, offset in self.sent.items())
+
+    def cursor(self, key, offset):
+        event_type_name, partition = key
+        cursor = {'partition': partition, 'offset': format_offset(offset)}
+        if self.subscription is not None:
+            cursor['event_type'] = event_type_name
+            cursor['cursor_token'] = str(uuid.uuid4())
+        return cursor
+
+
+class _Subscription:
+
+    def __init__(self, subscription):
+        self.map = subscription
+        self.committed = {}
+        self.streams = []
+
+
+class FakeNakadi:
+    """
+    Nakadi API served from memory: event types and their partitions,
+    publishing with Nakadi's partition strategies and metadata enrichment,
+    subscriptions with partitions balanced over their streams, cursor
+    commits, stats and lag, and event type and subscription streams
+    honouring their batch_limit, stream_limit, batch_flush_timeout,
+    stream_timeout, stream_keep_alive_limit, max_uncommitted_events and
+    commit_timeout.
+
+    Streams send one chunk per batch like Nakadi, or chunks of at most
+    chunk_size bytes. fragment_size splits every chunk over several socket
+    writes, throughput limits stream bytes per second and latency delays
+    every response.
+    """
+
+    def __init__(self, partitions=1, latency=0, throughput=None, chunk_size=None, fragment_size=None,
+                 batch_flush_timeout=None, host='127.0.0.1', port=0):
+        """
+        :param partitions: partitions of event types without default_statistic
+        :param latency: seconds every response is delayed
+        :param throughput: max stream bytes per second, None for no limit
+        :param chunk_size: max bytes of a stream chunk, None for one chunk per
+            batch
+        :param fragment_size: max bytes per socket write of stream chunks
+        :param batch_flush_timeout: seconds overriding the batch_flush_timeout
+            of all streams, e.g. 0.01 to send partial batches at once
+        :param host:
+        :param port: 0 for a free port
+        """
+        self.partitions = partitions
+        self.latency = latency
+        self.throughput = throughput
+        self.chunk_size = chunk_size
+        self.fragment_size = fragment_size
+        self.batch_flush_timeout = batch_flush_timeout
+        self.event_types = {}
+        self.subscriptions = {}
+        self.requests = []
+        self._failures = []
+        self._streams = {}
+        self._closed = False
+        self._condition = threading.Condition()
+        self._server = _Server((host, port), self._handler_class())
+        self.url = f'http://{host}:{self._server.server_address[1]}'
+        self._thread = threading.Thread(target=self._server.serve_forever, kwargs={'poll_interval': 0.05},
+                                        name='FakeNakadi', daemon=True)
+        self._thread.start()
+
+    def close(self):
+        """
+        Ends all streams and stops the server.
+        :return:
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def create_event_type(self, event_type):
+        """
+        Creates an event type without a request.
+        :param event_type: event type map
+        :return:
+        """
+        self._create_event_type(event_type)
+
+    def publish(self, event_type_name, events):
+        """
+        Publishes events without a request.
+        :param event_type_name:
+        :param events: list of event maps
+        :return:
+        """
+        self._publish(event_type_name, events, None)
+
+    def create_subscription(self, subscription):
+        """
+        Creates a subscription without a request.
+        :param subscription: subscription map
+        :return: the created or existing subscription map
+        """
+        return self._create_subscription(subscription)[1]
+
+    def fail(self, method, path, status, body=None, times=1):
+        """
+        Answers the next requests matching method and path prefix with an
+        error instead.
+        :param method:
+        :param path: path prefix, e.g. /subscriptions/{id}/events
+        :param status:
+        :param body: response body map, a problem by default
+        :param times: number of requests to fail
+        :return:
+        """
+        with self._condition:
+            self._failures.append([method, path, status, body, times])
+
+    # requests
+
+    ROUTES = [
+        ('GET', r'/metrics', '_get_metrics'),
+        ('GET', r'/event-types', '_get_event_types'),
+        ('POST', r'/event-types', '_post_event_types'),
+        ('GET', r'/event-types/([^/]+)', '_get_event_type'),
+        ('PUT', r'/event-types/([^/]+)', '_put_event_type'),
+        ('DELETE', r'/event-types/([^/]+)', '_delete_event_type'),
+        ('GET', r'/event-types/([^/]+)/partitions', '_get_partitions'),
+        ('GET', r'/event-types/([^/]+)/partitions/([^/]+)', '_get_partition'),
+        ('POST', r'/event-types/([^/]+)/events', '_post_events'),
+        ('GET', r'/event-types/([^/]+)/events', '_get_event_type_events'),
+        ('POST', r'/event-types/([^/]+)/cursors-lag', '_post_cursors_lag'),
+        ('POST', r'/event-types/([^/]+)/cursor-distances', '_post_cursor_distances'),
+        ('GET', r'/subscriptions', '_get_subscriptions'),
+        ('POST', r'/subscriptions', '_post_subscriptions'),
+        ('GET', r'/subscriptions/([^/]+)', '_get_subscription'),
+        ('DELETE', r'/subscriptions/([^/]+)', '_delete_subscription'),
+        ('GET', r'/subscriptions/([^/]+)/events', '_get_subscription_events'),
+        ('GET', r'/subscriptions/([^/]+)/cursors', '_get_cursors'),
+        ('POST', r'/subscriptions/([^/]+)/cursors', '_post_cursors'),
+        ('PATCH', r'/subscriptions/([^/]+)/cursors', '_patch_cursors'),
+        ('GET', r'/subscriptions/([^/]+)/stats', '_get_stats'),
+    ]
+
+    def _handler_class(self):
+        nakadi = self
+        routes = [(method, re.compile(pattern + '$'), name) for method, pattern, name in self.ROUTES]
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def handle_request(self):
+                url = urlsplit(self.path)
+                nakadi.requests.append((self.command, self.path))
+                if nakadi.latency:
+                    time.sleep(nakadi.latency)
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                if self.headers.get('Content-Encoding') == 'gzip':
+                    body = gzip.decompress(body)
+                try:
+                    nakadi._check_failures(self.command, url.path)
+                    for method, pattern, name in routes:
+                        match = pattern.match(url.path)
+                        if match and method == self.command:
+                            params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+                            request = (match.groups(), params, self.headers, json.loads(body) if body else None)
+                            result = getattr(nakadi, name)(self, *request)
+                            break
+                    else:
+                        raise _HttpError(404, f'{self.command} {url.path} not found')
+                except _HttpError as ex:
+                    body = ex.body if ex.body is not None else {'type': 'http://httpstatus.es/%d' % ex.status,
+                                                                'title': self.responses[ex.status][0],
+                                                                'status': ex.status, 'detail': ex.detail}
+                    self.respond(ex.status, body, 'application/problem+json')
+                    return
+                if result is not None:
+                    self.respond(*result)
+
+            def respond(self, status, body=None, content_type='application/json'):
+                data = b'' if body is None else json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = handle_request
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def _check_failures(self, method, path):
+        with self._condition:
+            for failure in self._failures:
+                if failure[0] == method and path.startswith(failure[1]):
+                    failure[4] -= 1
+                    if failure[4] == 0:
+                        self._failures.remove(failure)
+                    raise _HttpError(failure[2], 'Injected failure', failure[3])
+
+    def _event_type(self, name):
+        event_type = self.event_types.get(name)
+        if event_type is None:
+            raise _HttpError(404, f'EventType "{name}" does not exist.')
+        return event_type
+
+    def _subscription(self, subscription_id):
+        subscription = self.subscriptions.get(subscription_id)
+        if subscription is None:
+            raise _HttpError(404, f'Subscription with id "{subscription_id}" does not exist')
+        return subscription
+
+    def _get_metrics(self, handler, groups, params, headers, body):
+        return 200, {'version': '4.0.0', 'gauges': {}, 'counters': {}, 'histograms': {}, 'meters': {},
+                     'timers': {}}
+
+    def _get_event_types(self, handler, groups, params, headers, body):
+        with self._condition:
+            return 200, [event_type.map for event_type in self.event_types.values()]
+
+    def _post_event_types(self, handler, groups, params, headers, body):
+        self._create_event_type(body)
+        return 201, None
+
+    def _create_event_type(self, event_type):
+        if not isinstance(event_type, dict) or 'name' not in event_type:
+            raise _HttpError(422, 'Field "name" is required')
+        event_type = dict({'category': 'undefined', 'enrichment_strategies': [], 'partition_strategy': 'random',
+                           'compatibility_mode': 'forward', 'options': {'retention_time': 172800000}}, **event_type)
+        now = _now()
+        event_type['schema'] = dict({'type': 'json_schema', 'schema': '{}'}, **event_type.get('schema', {}))
+        event_type['schema'].update(version='1.0.0', created_at=now)
+        event_type['created_at'] = event_type['updated_at'] = now
+        statistic = event_type.get('default_statistic')
+        partitions = self.partitions
+        if statistic:
+            partitions = max(statistic.get('read_parallelism', 1), statistic.get('write_parallelism', 1))
+        try:
+            created = _EventType(event_type, partitions)
+        except Exception as ex:
+            raise _HttpError(422, str(ex))
+        with self._condition:
+            if event_type['name'] in self.event_types:
+                raise _HttpError(409, f"EventType with name {event_type['name']} already exists.")
+            self.event_types[event_type['name']] = created
+
+    def _get_event_type(self, handler, groups, params, headers, body):
+        with self._condition:
+            return 200, self._event_type(groups[0]).map
+
+    def _put_event_type(self, handler, groups, params, headers, body):
+        with self._condition:
+            event_type = self._event_type(groups[0])
+            old_schema = event_type.map['schema']
+            updated = dict(event_type.map, **body)
+            schema = dict(old_schema, **body.get('schema', {}))
+            if schema['schema'] != old_schema['schema']:
+                major, minor, patch = old_schema['version'].split('.')
+                schema.update(version=f'{major}.{int(minor) + 1}.0', created_at=_now())
+            updated.update(schema=schema, updated_at=_now())
+            event_type.map = updated
+            event_type.partitioner = Partitioner(updated, event_type.partitioner.partitions)
+        return 200, None
+
+    def _delete_event_type(self, handler, groups, params, headers, body):
+        with self._condition:
+            self._event_type(groups[0])
+            del self.event_types[groups[0]]
+        return 200, None
+
+    def _partition_map(self, event_type, partition):
+        events = event_type.partitions[int(partition)]
+        return {'partition': partition, 'oldest_available_offset': format_offset(0),
+                'newest_available_offset': format_offset(len(events) - 1)}
+
+    def _get_partitions(self, handler, groups, params, headers, body):
+        with self._condition:
+            event_type = self._event_type(groups[0])
+            return 200, [self._partition_map(event_type, partition)
+                         for partition in event_type.partitioner.partitions]
+
+    def _get_partition(self, handler, groups, params, headers, body):
+        with self._condition:
+            event_type = self._event_type(groups[0])
+            if groups[1] not in event_type.partitioner.partitions:
+                raise _HttpError(404, f'Partition {groups[1]} does not exist')
+            return 200, self._partition_map(event_type, groups[1])
+
+    def _post_events(self, handler, groups, params, headers, body):
+        if not isinstance(body, list):
+            raise _HttpError(400, 'Events must be a json array')
+        self._publish(groups[0], body, headers.get('X-Flow-Id'))
+        return 200, None
+
+    def _publish(self, event_type_name, events, flow_id):
+        with self._condition:
+            event_type = self._event_type(event_type_name)
+            partitions = []
+            items = []
+            for event in events:
+                try:
+                    partitions.append(event_type.partition_of(event))
+                    items.append({'publishing_status': 'aborted', 'step': 'none', 'detail': ''})
+                except (KeyError, TypeError, ValueError) as ex:
+                    partitions.append(None)
+                    items.append({'publishing_status': 'failed', 'step': 'partitioning',
+                                  'detail': f'could not partition event: {ex}'})
+            if None in partitions:
+                for item, event in zip(items, events):
+                    item['eid'] = event.get('metadata', {}).get('eid') if isinstance(event, dict) else None
+                raise _HttpError(422, 'Events were not published', items)
+            enrich = 'metadata_enrichment' in event_type.map['enrichment_strategies']
+            received_at = _now()
+            for event, partition in zip(events, partitions):
+                if enrich:
+                    event = dict(event, metadata=dict(event.get('metadata', {}), event_type=event_type_name,
+                                                      partition=partition, received_at=received_at,
+                                                      flow_id=flow_id or str(uuid.uuid4()),
+                                                      version=event_type.map['schema']['version']))
+                event_type.partitions[int(partition)].append(json.dumps(event, separators=(',', ':')).encode())
+            self._condition.notify_all()
+
+    def _post_cursors_lag(self, handler, groups, params, headers, body):
+        with self._condition:
+            event_type = self._event_type(groups[0])
+            result = []
+            for cursor in body:
+                lag = dict(self._partition_map(event_type, cursor['partition']))
+                lag['unconsumed_events'] = event_type.newest(cursor['partition']) - parse_offset(cursor['offset'])
+                result.append(lag)
+            return 200, result
+
+    def _post_cursor_distances(self, handler, groups, params, headers, body):
+        return 200, [dict(query, distance=parse_offset(query['final_cursor']['offset'])
+                          - parse_offset(query['initial_cursor']['offset'])) for query in body]
+
+    def _get_subscriptions(self, handler, groups, params, headers, body):
+        limit = int(params.get('limit', 20))
+        offset = int(params.get('offset', 0))
+        event_types = set(parse_qs(urlsplit(handler.path).query).get('event_type', []))
+        with self._condition:
+            items = [subscription.map for subscription in self.subscriptions.values()
+                     if params.get('owning_application') in [None, subscription.map['owning_application']]
+                     and event_types <= set(subscription.map['event_types'])]
+        links = {}
+        if offset > 0:
+            links['prev'] = {'href': f'/subscriptions?offset={max(0, offset - limit)}&limit={limit}'}
+        if offset + limit < len(items):
+            links['next'] = {'href': f'/subscriptions?offset={offset + limit}&limit={limit}'}
+        return 200, {'items': items[offset:offset + limit], '_links': links}
+
+    def _post_subscriptions(self, handler, groups, params, headers, body):
+        return self._create_subscription(body)
+
+    def _create_subscription(self, body):
+        subscription = dict({'consumer_group': 'default', 'read_from': 'end'}, **body)
+        with self._condition:
+            for existing in self.subscriptions.values():
+                if all(existing.map[name] == subscription[name]
+                       for name in ['owning_application', 'consumer_group', 'event_types']):
+                    return 200, existing.map
+            created = _Subscription(dict(subscription, id=str(uuid.uuid4()), created_at=_now()))
+            initial = {(cursor['event_type'], cursor['partition']): parse_offset(cursor['offset'])
+                       for cursor in subscription.get('initial_cursors', [])}
+            for event_type_name in subscription['event_types']:
+                event_type = self._event_type(event_type_name)
+                for partition in event_type.partitioner.partitions:
+                    key = (event_type_name, partition)
+                    if subscription['read_from'] == 'begin':
+                        created.committed[key] = -1
+                    elif subscription['read_from'] == 'cursors':
+                        created.committed[key] = initial.get(key, -1)
+                    else:
+                        created.committed[key] = event_type.newest(partition)
+            self.subscriptions[created.map['id']] = created
+            return 201, created.map
+
+    def _get_subscription(self, handler, groups, params, headers, body):
+        with self._condition:
+            return 200, self._subscription(groups[0]).map
+
+    def _delete_subscription(self, handler, groups, params, headers, body):
+        with self._condition:
+            subscription = self._subscription(groups[0])
+            for stream_id in subscription.streams:
+                self._streams[stream_id].terminated = True
+            del self.subscriptions[groups[0]]
+            self._condition.notify_all()
+        return 204, None
+
+    def _cursor_items(self, subscription):
+        return [{'event_type': event_type_name, 'partition': partition, 'offset': format_offset(offset),
+                 'cursor_token': str(uuid.uuid4())}
+                for (event_type_name, partition), offset in sorted(subscription.committed.items())]
+
+    def _get_cursors(self, handler, groups, params, headers, body):
+        with self._condition:
+            return 200, {'items': self._cursor_items(self._subscription(groups[0]))}
+
+    def _post_cursors(self, handler, groups, params, headers, body):
+        with self._condition:
+            subscription = self._subscription(groups[0])
+            if headers.get('X-Nakadi-StreamId') not in subscription.streams:
+                raise _HttpError(422, f"Session with stream id {headers.get('X-Nakadi-StreamId')} not found")
+            items = []
+            for cursor in body['items']:
+                key = (cursor['event_type'], cursor['partition'])
+                offset = parse_offset(cursor['offset'])
+                if key not in subscription.committed:
+                    raise _HttpError(422, f'Cursor {cursor} does not belong to the subscription')
+                if offset > subscription.committed[key]:
+                    subscription.committed[key] = offset
+                    items.append({'cursor': cursor, 'result': 'committed'})
+                else:
+                    items.append({'cursor': cursor, 'result': 'outdated'})
+            self._condition.notify_all()
+        if all(item['result'] == 'committed' for item in items):
+            return 204, None
+        return 200, {'items': items}
+
+    def _patch_cursors(self, handler, groups, params, headers, body):
+        with self._condition:
+            subscription = self._subscription(groups[0])
+            for cursor in body['items']:
+                subscription.committed[(cursor['event_type'], cursor['partition'])] = parse_offset(cursor['offset'])
+            # like Nakadi, resetting cursors ends the streams of the subscription
+            for stream_id in subscription.streams:
+                self._streams[stream_id].terminated = True
+            self._condition.notify_all()
+        return 204, None
+
+    def _get_stats(self, handler, groups, params, headers, body):
+        with self._condition:
+            subscription = self._subscription(groups[0])
+            owners = {}
+            for stream_id in subscription.streams:
+                for key in self._streams[stream_id].assigned():
+                    owners[key] = stream_id
+            items = {}
+            for (event_type_name, partition), offset in sorted(subscription.committed.items()):
+                stats = {'partition': partition, 'state': 'assigned' if owners.get((event_type_name, partition))
+                         else 'unassigned', 'stream_id': owners.get((event_type_name, partition), ''),
+                         'unconsumed_events': self.event_types[event_type_name].newest(partition) - offset}
+                if params.get('show_time_lag') == 'true':
+                    stats['consumer_lag_seconds'] = 0
+                items.setdefault(event_type_name, []).append(stats)
+        return 200, {'items': [{'event_type': name, 'partitions': partitions} for name, partitions in items.items()]}
+
+    # streams
+
+    @staticmethod
+    def _stream_params(params):
+        result = {}
+        for name in ['batch_limit', 'stream_limit', 'stream_timeout', 'stream_keep_alive_limit',
+                     'max_uncommitted_events', 'batch_flush_timeout', 'commit_timeout']:
+            if name in params:
+                result[name] = int(params[name])
+        return result
+
+    def _get_event_type_events(self, handler, groups, params, headers, body):
+        with self._condition:
+            event_type = self._event_type(groups[0])
+            sent = {(groups[0], partition): event_type.newest(partition)
+                    for partition in event_type.partitioner.partitions}
+            if headers.get('X-nakadi-cursors'):
+                # like Nakadi, only the partitions of the cursors are streamed
+                newest, sent = sent, {}
+                for cursor in json.loads(headers['X-nakadi-cursors']):
+                    if (groups[0], cursor['partition']) not in newest:
+                        raise _HttpError(422, f"Partition {cursor['partition']} does not exist")
+                    sent[(groups[0], cursor['partition'])] = parse_offset(cursor['offset'])
+            stream = _Stream(self._stream_params(params), sent)
+        self._serve_stream(handler, stream)
+
+    def _get_subscription_events(self, handler, groups, params, headers, body):
+        with self._condition:
+            subscription = self._subscription(groups[0])
+            if len(subscription.streams) >= len(subscription.committed):
+                raise _HttpError(409, 'No free slots for streaming available')
+            stream = _Stream(self._stream_params(params), {}, subscription)
+            subscription.streams.append(stream.id)
+            self._streams[stream.id] = stream
+        ended = False
+        try:
+            ended = self._serve_stream(handler, stream)
+        finally:
+            with self._condition:
+                # like Nakadi, the session of a stream ended by the server
+                # waits up to commit_timeout for the events it sent to be
+                # committed
+                deadline = time.monotonic() + stream.commit_timeout
+                while ended and not (self._closed or stream.terminated) and stream.uncommitted():
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                subscription.streams.remove(stream.id)
+                del self._streams[stream.id]
+                self._condition.notify_all()
+
+    def _serve_stream(self, handler, stream):
+        """
+        :return: True if the stream ended, False if the client went away
+        """
+        handler.close_connection = True
+        handler.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        compressor = None
+        handler.send_response(200)
+        handler.send_header('Content-Type', 'application/x-json-stream')
+        handler.send_header('Transfer-Encoding', 'chunked')
+        handler.send_header('X-Nakadi-StreamId', stream.id)
+        if 'gzip' in handler.headers.get('Accept-Encoding', ''):
+            handler.send_header('Content-Encoding', 'gzip')
+            compressor = zlib.compressobj(wbits=31)
+        handler.end_headers()
+        sent_bytes = 0
+        started = time.monotonic()
+        try:
+            while True:
+                lines, done = self._next_batches(stream)
+                data = b''.join(lines)
+                if compressor is not None:
+                    data = compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH if not done
+                                                                        else zlib.Z_FINISH)
+                if data:
+                    self._send_chunks(handler.connection, data)
+                    sent_bytes += len(data)
+                    if self.throughput:
+                        delay = started + sent_bytes / self.throughput - time.monotonic()
+                        if delay > 0:
+                            time.sleep(delay)
+                if done:
+                    handler.connection.sendall(b'0\r\n\r\n')
+                    return True
+        except OSError:
+            # the client went away
+            return False
+
+    def _send_chunks(self, connection, data):
+        chunk_size = self.chunk_size or len(data)
+        for start in range(0, len(data), chunk_size):
+            chunk = data[start:start + chunk_size]
+            frame = b'%x\r\n%s\r\n' % (len(chunk), chunk)
+            fragment_size = self.fragment_size or len(frame)
+            for fragment_start in range(0, len(frame), fragment_size):
+                connection.sendall(frame[fragment_start:fragment_start + fragment_size])
+
+    def _next_batches(self, stream):
+        """
+        Waits until stream has batches or ends.
+        :return: (batch lines, whether the stream ends after them)
+        """
+        flush_timeout = self.batch_flush_timeout
+        if flush_timeout is None:
+            flush_timeout = stream.batch_flush_timeout
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                if self._closed or stream.terminated:
+                    return [], True
+                if stream.stream_timeout and now - stream.started >= stream.stream_timeout:
+                    return [], True
+                assigned = stream.assigned()
+                budget = stream.budget(assigned)
+                lines = []
+                for key in assigned:
+                    events = self.event_types[key[0]].partitions[int(key[1])] if key[0] in self.event_types else []
+                    sent = stream.sent[key]
+                    last_flush = stream.last_flush.setdefault(key, stream.started)
+                    count = min(len(events) - 1 - sent, stream.batch_limit, max(0, budget))
+                    due = now - last_flush >= flush_timeout
+                    if count > 0 and (count == stream.batch_limit or count == budget or due):
+                        stream.sent[key] = sent + count
+                        stream.events_sent += count
+                        budget -= count
+                        stream.keep_alives[key] = 0
+                        lines.append(b'{"cursor":%s,"events":[%s]}\n' % (
+                            json.dumps(stream.cursor(key, sent + count)).encode(),
+                            b','.join(events[sent + 1:sent + 1 + count])))
+                    elif due:
+                        stream.keep_alives[key] = stream.keep_alives.get(key, 0) + 1
+                        lines.append(b'{"cursor":%s}\n' % json.dumps(stream.cursor(key, sent)).encode())
+                    else:
+                        continue
+                    stream.last_flush[key] = now
+                done = bool(stream.stream_limit and stream.events_sent >= stream.stream_limit)
+                if stream.stream_keep_alive_limit and assigned:
+                    done = done or all(stream.keep_alives.get(key, 0) >= stream.stream_keep_alive_limit
+                                       for key in assigned)
+                if lines or done:
+                    return lines, done
+                timeout = min([stream.last_flush[key] + flush_timeout - now for key in assigned]
+                              + [flush_timeout])
+                if stream.stream_timeout:
+                    timeout = min(timeout, stream.started + stream.stream_timeout - now)
+                self._condition.wait(max(timeout, 0.001))
+
+
+try:
+    import pytest
+except ImportError:
+    pytest = None
+
+if pytest is not None:
+    @pytest.fixture
+    def fake_nakadi():
+        """
+        FakeNakadi server, closed after the test.
+        """
+        with FakeNakadi() as nakadi:
+            yield nakadi
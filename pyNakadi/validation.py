@@ -0,0 +1,123 @@
+import json
+import threading
+
+from pyNakadi.client import NakadiException, NakadiPublishException
+
+
+class EventValidator:
+    """
+    Validates events against the json schema of their event type before
+    publishing, which needs the jsonschema package. Schemas are read through
+    client.get_event_type, served from its metadata cache if it has one, and
+    compiled once per event type and schema version.
+
+    Like Nakadi, data change events are validated by their data, and
+    business events without their metadata.
+    """
+
+    def __init__(self, client, format_checker=False):
+        """
+        :param client: NakadiClient
+        :param format_checker: also check the format keywords of schemas
+        """
+        try:
+            import jsonschema
+        except ImportError:
+            raise NakadiException(code=1, msg='EventValidator requires the jsonschema package')
+        self._jsonschema = jsonschema
+        self.client = client
+        self.format_checker = jsonschema.FormatChecker() if format_checker else None
+        self._validators = {}
+        self._lock = threading.Lock()
+
+    def get_validator(self, event_type_name):
+        """
+        :param event_type_name:
+        :return: (category, compiled jsonschema validator) of the current
+            schema of the event type
+        """
+        event_type = self.client.get_event_type(event_type_name)
+        schema = event_type['schema']
+        key = (event_type_name, schema.get('version'))
+        with self._lock:
+            cached = self._validators.get(key)
+        if cached is not None and cached[0] == schema['schema']:
+            return cached[1], cached[2]
+        if schema.get('type', 'json_schema') != 'json_schema':
+            raise NakadiException(code=1, msg=f"Can not validate {schema['type']} schema of {event_type_name}")
+        json_schema = json.loads(schema['schema'])
+        validator_class = self._jsonschema.validators.validator_for(json_schema)
+        validator_class.check_schema(json_schema)
+        validator = validator_class(json_schema, format_checker=self.format_checker)
+        category = event_type.get('category', 'undefined')
+        with self._lock:
+            # only the current version of each event type is kept
+            for old_key in [old_key for old_key in self._validators if old_key[0] == event_type_name]:
+                del self._validators[old_key]
+            self._validators[key] = (schema['schema'], category, validator)
+        return category, validator
+
+    def split(self, event_type_name, events):
+        """
+        Separates invalid events, e.g. to quarantine them.
+        :param event_type_name:
+        :param events: list of event maps
+        :return: (valid events, list of (index, event, detail) of the
+            invalid ones)
+        """
+        category, validator = self.get_validator(event_type_name)
+        valid = []
+        invalid = []
+        for index, event in enumerate(events):
+            errors = list(validator.iter_errors(_validated_part(category, event)))
+            if errors:
+                invalid.append((index, event, _detail(errors)))
+            else:
+                valid.append(event)
+        return valid, invalid
+
+    def validate(self, event_type_name, events):
+        """
+        Raises NakadiPublishException with items like the 422 response of
+        Nakadi if any of the events is invalid.
+        :param event_type_name:
+        :param events: list of event maps
+        :return:
+        """
+        _, invalid = self.split(event_type_name, events)
+        if not invalid:
+            return
+        items = [{'publishing_status': 'aborted', 'step': 'none', 'detail': ''} for _ in events]
+        for index, _, detail in invalid:
+            items[index] = {'publishing_status': 'failed', 'step': 'validating', 'detail': detail}
+        raise NakadiPublishException(
+            code=1,
+            msg=f'{len(invalid)} of {len(events)} events are not valid for {event_type_name}',
+            items=items,
+            events=events)
+
+    def post_valid_events(self, event_type_name, events, compression=None):
+        """
+        Posts the valid events only.
+        :param event_type_name:
+        :param events: list of event maps
+        :param compression: see NakadiClient.post_events
+        :return: list of (index, event, detail) of the invalid events
+        """
+        valid, invalid = self.split(event_type_name, events)
+        if valid:
+            self.client.post_events(event_type_name, valid, compression=compression)
+        return invalid
+
+
+def _validated_part(category, event):
+    if category == 'data':
+        return event.get('data')
+    if category == 'business' and 'metadata' in event:
+        return {name: value for name, value in event.items() if name != 'metadata'}
+    return event
+
+
+def _detail(errors):
+    return '; '.join(f"#/{'/'.join(str(part) for part in error.absolute_path)}: {error.message}"
+                     for error in errors)
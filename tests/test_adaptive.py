@@ -0,0 +1,106 @@
+import threading
+import time
+
+import pytest
+
+from pyNakadi import NakadiClient, NakadiException
+from pyNakadi.adaptive import AdaptiveConsumer, BatchSizeController
+from pyNakadi.testing import FakeNakadi
+
+
+def test_controller_grows_while_lag_grows_after_patience():
+    controller = BatchSizeController(batch_limit=10, max_batch_limit=40, patience=2, cooldown=0)
+    assert controller.stream_params() == {'batch_limit': 10, 'max_uncommitted_events': 40}
+    controller.observe(0.01)
+    assert controller.evaluate(500, now=0) is None
+    assert controller.evaluate(600, now=1) == 20
+    # the lag of 30 batches of 20 keeps growing
+    assert controller.evaluate(600, now=2) is None
+    assert controller.evaluate(700, now=3) == 40
+    assert controller.evaluate(800, now=4) is None
+    assert controller.evaluate(900, now=5) is None
+    assert controller.stream_params() == {'batch_limit': 40, 'max_uncommitted_events': 160}
+
+
+def test_controller_does_not_grow_while_lag_shrinks():
+    controller = BatchSizeController(batch_limit=10, patience=1, cooldown=0)
+    assert controller.evaluate(500, now=0) == 20
+    assert controller.evaluate(480, now=1) is None
+    assert controller.evaluate(400, now=2) is None
+
+
+def test_controller_shrinks_when_caught_up_or_slow():
+    controller = BatchSizeController(batch_limit=64, min_batch_limit=8, patience=2, cooldown=0)
+    assert controller.evaluate(10, now=0) is None
+    assert controller.evaluate(10, now=1) == 32
+    controller = BatchSizeController(batch_limit=64, patience=1, cooldown=0, target_batch_seconds=0.5)
+    controller.observe(0.2)
+    controller.observe(1.0)
+    # slow batches shrink even while lagging
+    assert controller.evaluate(100000, now=0) == 32
+    controller = BatchSizeController(batch_limit=8, min_batch_limit=8, patience=1, cooldown=0)
+    assert controller.evaluate(0, now=0) is None
+
+
+def test_controller_hysteresis():
+    controller = BatchSizeController(batch_limit=10, patience=2, cooldown=60)
+    # alternating votes never reach patience
+    for now, lag in enumerate([500, 5, 500, 5, 500, 5]):
+        assert controller.evaluate(lag, now=now) is None
+    # lag between the water marks resets the votes
+    assert controller.evaluate(500, now=10) is None
+    assert controller.evaluate(50, now=11) is None
+    assert controller.evaluate(500, now=12) is None
+    assert controller.evaluate(500, now=13) == 20
+    # no change within the cooldown
+    assert controller.evaluate(10, now=14) is None
+    assert controller.evaluate(10, now=15) is None
+    assert controller.evaluate(10, now=74) == 10
+
+
+def test_controller_and_consumer_validate_arguments():
+    with pytest.raises(NakadiException) as info:
+        BatchSizeController(min_batch_limit=0)
+    assert info.value.code == 1
+    with pytest.raises(NakadiException):
+        BatchSizeController(grow_lag_batches=1, shrink_lag_batches=1)
+    with pytest.raises(NakadiException):
+        AdaptiveConsumer(None, 'id', print, batch_limit=10)
+    with pytest.raises(NakadiException):
+        AdaptiveConsumer(None, 'id', print, workers=2, processes=True)
+
+
+def test_consumer_reopens_stream_with_larger_batches():
+    with FakeNakadi(partitions=2, batch_flush_timeout=0.01) as nakadi:
+        nakadi.create_event_type({'name': 'orders', 'owning_application': 'app'})
+        nakadi.publish('orders', [{'order': i} for i in range(2000)])
+        subscription = nakadi.create_subscription({'owning_application': 'app', 'event_types': ['orders'],
+                                                   'read_from': 'begin'})
+        sizes = []
+
+        def handle(batch):
+            sizes.append(len(batch['events']))
+            if sum(sizes) == 2000:
+                consumer.stop()
+
+        client = NakadiClient('token', nakadi.url)
+        get_subscription_stats = client.get_subscription_stats
+        stats_threads = set()
+
+        def get_stats(subscription_id):
+            stats_threads.add(threading.current_thread().name)
+            return get_subscription_stats(subscription_id)
+
+        client.get_subscription_stats = get_stats
+        controller = BatchSizeController(batch_limit=5, max_batch_limit=80, patience=1, cooldown=0)
+        consumer = AdaptiveConsumer(client, subscription['id'], lambda batch: (time.sleep(0.001), handle(batch)),
+                                    controller=controller, check_interval=0.02, batch_flush_timeout=1)
+        assert consumer.run() == len(sizes)
+        assert sum(sizes) == 2000
+        assert consumer.resizes >= 1
+        assert max(sizes) > 5
+        assert controller.batch_limit > 5
+        # the last cursors are committed before every reopen and at the end
+        assert consumer.get_lag() == 0
+        # lag is sampled outside of the consumer thread
+        assert stats_threads - {threading.current_thread().name} == {'NakadiLagSampler'}
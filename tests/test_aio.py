@@ -0,0 +1,150 @@
+import asyncio
+import json
+
+import pytest
+
+from pyNakadi.aio import AsyncNakadiClient
+from pyNakadi.client import NakadiException, NakadiPublishException, EndOfStreamException0
+
+
+def chunked(*payloads):
+    return b''.join(b'%x\r\n%s\r\n' % (len(p), p) for p in payloads) + b'0\r\n\r\n'
+
+
+class FakeNakadi:
+    """
+    Answers requests on keep-alive connections from a route map of
+    (method, path) to (status, extra headers, chunked body or bytes).
+    """
+
+    def __init__(self, routes):
+        self.routes = routes
+        self.connections = 0
+        self.requests = []
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        while True:
+            try:
+                head = await reader.readuntil(b'\r\n\r\n')
+            except asyncio.IncompleteReadError:
+                break
+            request_line, *header_lines = head.decode().split('\r\n')
+            method, path, _ = request_line.split(' ')
+            headers = dict(line.split(': ', 1) for line in header_lines if line)
+            body = await reader.readexactly(int(headers.get('Content-Length', 0)))
+            self.requests.append((method, path, headers, body))
+            route = self.routes[(method, path)]
+            if route == 'drop':
+                break
+            if route == 'hang':
+                await asyncio.sleep(10)
+            status, extra, response_body = route
+            if isinstance(response_body, tuple):
+                writer.write(b'HTTP/1.1 %d X\r\nTransfer-Encoding: chunked\r\n%s\r\n%s'
+                             % (status, extra, chunked(*response_body)))
+            else:
+                writer.write(b'HTTP/1.1 %d X\r\nContent-Length: %d\r\n%s\r\n%s'
+                             % (status, len(response_body), extra, response_body))
+            await writer.drain()
+        writer.close()
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, '127.0.0.1', 0)
+        return f'http://127.0.0.1:{self.server.sockets[0].getsockname()[1]}'
+
+
+def run(coroutine):
+    """
+    asyncio.run, which needs Python 3.7
+    """
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        all_tasks = getattr(asyncio, 'all_tasks', None) or asyncio.Task.all_tasks
+        pending = all_tasks(loop)
+        for task in pending:
+            task.cancel()
+        if pending:
+            loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+        loop.close()
+
+
+def test_async_client_requests():
+    async def scenario():
+        nakadi = FakeNakadi({
+            ('GET', '/event-types/et'): (200, b'', b'{"name": "et"}'),
+            ('GET', '/event-types/missing'): (404, b'', b'{"title": "Not Found"}'),
+            ('POST', '/subscriptions/s/cursors'): (204, b'', b''),
+            ('POST', '/event-types/et/events'): (207, b'', (b'[{"publishing_status":"submitted"},',
+                                                             b'{"publishing_status":"failed","step":"publishing"}]')),
+        })
+        async with AsyncNakadiClient('dummy_token', await nakadi.start()) as client:
+            assert await client.get_event_type('et') == {'name': 'et'}
+            with pytest.raises(NakadiException) as ex:
+                await client.get_event_type('missing')
+            assert ex.value.code == 404
+            assert await client.commit_subscription_cursors('s', 'stream', [{'partition': '0'}])
+            with pytest.raises(NakadiPublishException) as ex:
+                await client.post_events('et', [{'a': 1}, {'a': 2}])
+            assert ex.value.failed()[0][0] == 1
+        assert nakadi.connections == 1
+        method, path, headers, body = nakadi.requests[2]
+        assert headers['X-Nakadi-StreamId'] == 'stream'
+        assert headers['Authorization'] == 'Bearer dummy_token'
+        assert json.loads(body) == {'items': [{'partition': '0'}]}
+
+    run(scenario())
+
+
+def test_async_stream():
+    async def scenario():
+        nakadi = FakeNakadi({
+            ('GET', '/subscriptions/s/events?batch_limit=2'): (
+                200, b'X-Nakadi-StreamId: sid\r\n',
+                (b'{"cursor":{"partition":"0"}}\n{"cursor":{"par', b'tition":"1"},"events":[{"a":1}]}\n')),
+        })
+        client = AsyncNakadiClient('dummy_token', await nakadi.start())
+        streams = [await client.get_subscription_events_stream('s', batch_limit=2, parse=True)
+                   for _ in range(3)]
+        for stream in streams:
+            assert stream.get_stream_id() == 'sid'
+            batches = []
+            with pytest.raises(EndOfStreamException0):
+                async for batch in stream:
+                    batches.append(batch)
+            assert batches == [{'cursor': {'partition': '1'}, 'events': [{'a': 1}]}]
+            stream.close()
+        assert nakadi.connections == 3
+
+    run(scenario())
+
+
+def test_async_client_does_not_resend_posts():
+    async def scenario():
+        nakadi = FakeNakadi({
+            ('GET', '/event-types/et'): (200, b'', b'{"name": "et"}'),
+            ('POST', '/event-types/et/events'): 'drop',
+            ('GET', '/metrics'): 'hang',
+        })
+        async with AsyncNakadiClient('dummy_token', await nakadi.start()) as client:
+            connections = []
+            connect = client._connect
+
+            async def record_connect():
+                connections.append(await connect())
+                return connections[-1]
+
+            client._connect = record_connect
+            assert await client.get_event_type('et') == {'name': 'et'}
+            # the pooled connection is dropped while the post is handled
+            with pytest.raises((ConnectionError, asyncio.IncompleteReadError)):
+                await client.post_events('et', [{'a': 1}])
+            assert [request[:2] for request in nakadi.requests].count(('POST', '/event-types/et/events')) == 1
+            with pytest.raises(asyncio.TimeoutError):
+                await asyncio.wait_for(client.get_metrics(), 0.1)
+            assert connections[-1].closed()
+            assert client._idle == []
+
+    run(scenario())
@@ -0,0 +1,45 @@
+import json
+
+import pytest
+
+from pyNakadi.batch import LazyBatch
+
+CURSOR = {'partition': '0', 'offset': '001-0001-000000000000000001', 'event_type': 'et', 'cursor_token': 't'}
+EVENTS = [{'metadata': {'eid': '1'}, 'field': 'a ],"info": ['}, {'metadata': {'eid': '2'}, 'nested': [1, {'x': []}]}]
+
+
+@pytest.mark.parametrize('batch', [
+    {'cursor': CURSOR, 'events': EVENTS},
+    {'cursor': CURSOR, 'events': EVENTS, 'info': {'debug': 'x'}},
+    {'cursor': CURSOR, 'info': {'debug': 'x'}, 'events': EVENTS},
+    {'cursor': CURSOR, 'events': []},
+    {'cursor': CURSOR, 'events': EVENTS + [{'x': [1], 'info': 2}], 'info': {'a': [1], 'info': {'b': [2]}}},
+])
+def test_lazy_batch(batch):
+    for raw in [json.dumps(batch, separators=(',', ':')).encode(), json.dumps(batch).encode()]:
+        lazy = LazyBatch(raw)
+        assert lazy['cursor'] == CURSOR
+        assert lazy.get('info') == batch.get('info')
+        assert 'events' in lazy
+        assert lazy.count_events() == len(batch['events'])
+        assert list(lazy.iter_events()) == batch['events']
+        assert lazy.events == batch['events']
+        assert json.loads(lazy.raw_events) == batch['events']
+
+
+def test_lazy_batch_keep_alive():
+    lazy = LazyBatch(json.dumps({'cursor': CURSOR}).encode())
+    assert lazy.cursor == CURSOR
+    assert 'events' not in lazy
+    assert lazy.get('events') is None
+    assert lazy.raw_events is None
+    assert list(lazy.iter_events()) == []
+    with pytest.raises(KeyError):
+        lazy['events']
+
+
+def test_lazy_batch_skips_events_decoding():
+    raw = b'{"cursor":{"partition":"0"},"events":[{"a":1},not json]}'
+    lazy = LazyBatch(raw)
+    assert lazy.cursor == {'partition': '0'}
+    assert next(lazy.iter_events()) == {'a': 1}
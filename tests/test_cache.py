@@ -0,0 +1,77 @@
+import json
+import time
+from types import SimpleNamespace
+
+from pyNakadi.cache import MetadataCache
+from pyNakadi.client import NakadiClient
+
+
+class FakeSession:
+    """
+    Serves event types with an ETag per version and answers 304 to a
+    matching If-None-Match.
+    """
+
+    def __init__(self):
+        self.requests = []
+        self.versions = {'et': 1}
+
+    def get(self, url, headers=None):
+        self.requests.append(('GET', url, headers))
+        name = url.split('/event-types')[1].strip('/').split('/')[0]
+        etag = f'"{name}-{self.versions.get(name, 0)}"'
+        if headers is not None and headers.get('If-None-Match') == etag:
+            return SimpleNamespace(status_code=304, content=b'', headers={})
+        body = json.dumps({'name': name, 'version': self.versions.get(name, 0)}).encode()
+        return SimpleNamespace(status_code=200, content=body, headers={'ETag': etag})
+
+    def put(self, url, json=None):
+        self.requests.append(('PUT', url, None))
+        self.versions['et'] += 1
+        return SimpleNamespace(status_code=200, content=b'')
+
+
+def client_with_cache(cache):
+    client = NakadiClient('dummy_token', 'http://nakadi', metadata_cache=cache)
+    client.session = FakeSession()
+    return client
+
+
+def test_metadata_cache_ttl_and_etag():
+    cache = MetadataCache(ttl=0.05)
+    client = client_with_cache(cache)
+    assert client.get_event_type('et') == {'name': 'et', 'version': 1}
+    assert client.get_event_type('et') == {'name': 'et', 'version': 1}
+    assert len(client.session.requests) == 1
+    time.sleep(0.06)
+    assert client.get_event_type('et') == {'name': 'et', 'version': 1}
+    assert client.session.requests[-1][2] == {'If-None-Match': '"et-1"'}
+    assert cache.hits == 1
+
+
+def test_metadata_cache_invalidated_by_update():
+    client = client_with_cache(MetadataCache(ttl=60))
+    client.get_event_type('et')
+    client.get_event_type_partitions('et')
+    client.get_event_types()
+    client.update_event_type('et', {})
+    assert client.get_event_type('et') == {'name': 'et', 'version': 2}
+    client.get_event_type_partitions('et')
+    client.get_event_types()
+    assert [request[0] for request in client.session.requests].count('GET') == 6
+
+
+def test_metadata_cache_lru():
+    client = client_with_cache(MetadataCache(ttl=60, maxsize=2))
+    for name in ['a', 'b', 'a', 'c', 'a', 'b']:
+        client.get_event_type(name)
+    assert [request[1].rsplit('/', 1)[1] for request in client.session.requests] == ['a', 'b', 'c', 'b']
+    assert len(client.metadata_cache) == 2
+
+
+def test_no_metadata_cache():
+    client = client_with_cache(None)
+    client.get_event_type('et')
+    client.get_event_type('et')
+    assert client.session.requests[-1] == ('GET', 'http://nakadi/event-types/et', None)
+    assert len(client.session.requests) == 2
@@ -0,0 +1,221 @@
+import json
+import os
+import random
+import threading
+import time
+
+import pytest
+
+from pyNakadi import NakadiClient
+from pyNakadi.batch import LazyBatch
+from pyNakadi.client import NakadiException, EndOfStreamException0
+from pyNakadi.consumer import CursorCommitter, PartitionDispatcher, SubscriptionConsumer
+from pyNakadi.testing import FakeNakadi
+
+
+def cursor(partition, offset):
+    return {'event_type': 'et', 'partition': partition, 'offset': offset, 'cursor_token': f'{partition}-{offset}'}
+
+
+class FakeStream:
+    stream_id = 'sid'
+
+    def __init__(self, batches):
+        self.batches = list(batches)
+        self.closed = False
+
+    def next_parsed_batch(self, lazy=False, keep_alive=False):
+        if not self.batches:
+            raise EndOfStreamException0
+        batch = self.batches.pop(0)
+        while 'events' not in batch and not keep_alive:
+            batch = self.next_parsed_batch(lazy, keep_alive)
+        if lazy and 'events' in batch:
+            batch = LazyBatch(json.dumps(batch).encode())
+        return batch
+
+    def close(self):
+        self.closed = True
+
+
+class FakeClient:
+    def __init__(self, batches, commit_delay=0, fail_commit=None):
+        self.batches = batches
+        self.commit_delay = commit_delay
+        self.fail_commit = fail_commit
+        self.commits = []
+        self.stream_params = None
+
+    def get_subscription_events_stream(self, subscription_id, **stream_params):
+        self.stream_params = stream_params
+        return FakeStream(self.batches)
+
+    def commit_subscription_cursors(self, subscription_id, stream_id, cursors):
+        time.sleep(self.commit_delay)
+        if self.fail_commit is not None:
+            raise self.fail_commit
+        self.commits.append((subscription_id, stream_id, sorted(c['offset'] for c in cursors)))
+        return True
+
+
+def test_consumer_coalesces_commits_per_partition():
+    batches = [{'cursor': cursor(str(i % 2), f'{i:03d}'), 'events': [{}]} for i in range(100)]
+    client = FakeClient(batches, commit_delay=0.01)
+    handled = []
+    consumer = SubscriptionConsumer(client, 'sub', handled.append, commit_interval=10,
+                                    max_uncommitted_events=1000, batch_limit=1)
+    started = time.monotonic()
+    assert consumer.run() == 100
+    assert time.monotonic() - started < 0.5
+    assert handled == batches
+    assert client.stream_params == {'max_uncommitted_events': 1000, 'batch_limit': 1}
+    assert client.commits == [('sub', 'sid', ['098', '099'])]
+
+
+def test_committer_commits_before_max_uncommitted_events():
+    client = FakeClient([])
+    committer = CursorCommitter(client, 'sub', 'sid', commit_interval=10, max_uncommitted_events=10)
+    for i in range(5):
+        committer.mark(cursor('0', f'{i:03d}'))
+    deadline = time.monotonic() + 5
+    while not client.commits and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert client.commits == [('sub', 'sid', ['004'])]
+    assert committer.uncommitted_events() == 0
+    committer.close()
+
+
+def test_committer_error_stops_consumer():
+    batches = [{'cursor': cursor('0', f'{i:03d}'), 'events': [{}]} for i in range(50)]
+    client = FakeClient(batches, fail_commit=NakadiException(code=422, msg='stream gone'))
+    consumer = SubscriptionConsumer(client, 'sub', lambda batch: time.sleep(0.001), commit_every_batches=1)
+    with pytest.raises(NakadiException):
+        consumer.run()
+    assert consumer.stream.closed
+
+
+def test_dispatcher_keeps_partition_order():
+    handled = {}
+    marked = []
+    lock = threading.Lock()
+
+    def handler(batch):
+        time.sleep(random.random() / 1000)
+        with lock:
+            handled.setdefault(batch['cursor']['partition'], []).append(batch['cursor']['offset'])
+
+    def on_done(done_cursor, events):
+        partition = done_cursor['partition']
+        with lock:
+            # every batch up to the cursor has been handled
+            assert handled[partition][-1] >= done_cursor['offset']
+            marked.append((partition, done_cursor['offset'], events))
+
+    dispatcher = PartitionDispatcher(handler, on_done, workers=3)
+    for i in range(200):
+        dispatcher.submit({'cursor': cursor(str(i % 5), f'{i:03d}'), 'events': [{}]})
+    dispatcher.join()
+    dispatcher.close()
+    assert dispatcher.error is None and dispatcher.pending() == 0
+    for partition, offsets in handled.items():
+        assert offsets == sorted(offsets)
+        done = [offset for marked_partition, offset, _ in marked if marked_partition == partition]
+        assert done == sorted(done) and done[-1] == offsets[-1]
+    assert sum(events for _, _, events in marked) == 200
+
+
+def test_consumer_handles_partitions_in_parallel():
+    batches = [{'cursor': cursor(str(i % 4), f'{i:03d}'), 'events': [{}]} for i in range(40)]
+    client = FakeClient(batches)
+    consumer = SubscriptionConsumer(client, 'sub', lambda batch: time.sleep(0.02), workers=4,
+                                    commit_interval=10, max_uncommitted_events=1000)
+    started = time.monotonic()
+    assert consumer.run() == 40
+    assert time.monotonic() - started < 40 * 0.02 / 2
+    assert client.commits == [('sub', 'sid', ['036', '037', '038', '039'])]
+
+
+def test_dispatcher_handler_error_holds_back_partition():
+    marked = []
+
+    def handler(batch):
+        if batch['cursor']['offset'] == '001':
+            raise ValueError('bad batch')
+
+    dispatcher = PartitionDispatcher(handler, lambda c, events: marked.append(c['offset']), workers=2)
+    for i in range(4):
+        dispatcher.submit({'cursor': cursor('0', f'{i:03d}'), 'events': [{}]})
+    dispatcher.join()
+    assert marked == ['000']
+    with pytest.raises(ValueError):
+        dispatcher.submit({'cursor': cursor('0', '004'), 'events': [{}]})
+    dispatcher.close()
+
+
+def process_handler(batch):
+    return os.getpid()
+
+
+def test_dispatcher_with_processes():
+    marked = []
+    dispatcher = PartitionDispatcher(process_handler, lambda c, events: marked.append(c['offset']),
+                                     workers=2, processes=True)
+    for i in range(10):
+        dispatcher.submit({'cursor': cursor(str(i % 2), f'{i:03d}'), 'events': [{}]})
+    dispatcher.join()
+    dispatcher.close()
+    assert dispatcher.error is None
+    assert sorted(marked)[-2:] == ['008', '009']
+
+
+def test_consumer_stops_on_keep_alive():
+    class IdleStream(FakeStream):
+        def next_parsed_batch(self, lazy=False, keep_alive=False):
+            time.sleep(0.01)
+            if self.batches:
+                return self.batches.pop(0)
+            if keep_alive:
+                return {'cursor': cursor('0', '000')}
+            raise AssertionError('idle stream read past stop')
+
+    client = FakeClient([{'cursor': cursor('0', '000'), 'events': [{}]}])
+    client.get_subscription_events_stream = lambda subscription_id, **params: IdleStream(client.batches)
+    consumer = SubscriptionConsumer(client, 'sub', lambda batch: None)
+    threading.Timer(0.1, consumer.stop).start()
+    assert consumer.run() == 1
+    assert client.commits == [('sub', 'sid', ['000'])]
+
+
+def test_consumer_counts_lazy_batch_events():
+    batches = [{'cursor': cursor('0', f'{i:03d}'), 'events': [{}] * 5} for i in range(4)]
+    client = FakeClient(batches)
+    consumer = SubscriptionConsumer(client, 'sub', lambda batch: time.sleep(0.05), lazy=True,
+                                    commit_interval=10, max_uncommitted_events=20)
+    consumer.run()
+    # 10 events are half of max_uncommitted_events
+    assert client.commits[0] == ('sub', 'sid', ['001'])
+
+
+def test_consumer_closes_stream_when_final_commit_fails():
+    batches = [{'cursor': cursor('0', f'{i:03d}'), 'events': [{}]} for i in range(5)]
+    client = FakeClient(batches, fail_commit=NakadiException(code=422, msg='stream gone'))
+    consumer = SubscriptionConsumer(client, 'sub', lambda batch: None, commit_interval=60)
+    with pytest.raises(NakadiException):
+        consumer.run()
+    assert consumer.stream.closed
+
+
+def test_consumer_commits_stream_ended_by_stream_limit():
+    with FakeNakadi(partitions=2, batch_flush_timeout=0.01) as nakadi:
+        nakadi.create_event_type({'name': 'orders', 'owning_application': 'app'})
+        nakadi.publish('orders', [{'order': i} for i in range(20)])
+        subscription = nakadi.create_subscription({'owning_application': 'app', 'event_types': ['orders'],
+                                                   'read_from': 'begin'})
+        client = NakadiClient('token', nakadi.url)
+        consumer = SubscriptionConsumer(client, subscription['id'], lambda batch: None, commit_interval=60,
+                                        batch_limit=2, stream_limit=10, max_uncommitted_events=20)
+        assert consumer.run() == 5
+        assert consumer.stream.closed()
+        # the session waits for the final commit after the stream ended
+        stats = client.get_subscription_stats(subscription['id'])
+        assert sum(p['unconsumed_events'] for item in stats['items'] for p in item['partitions']) == 10
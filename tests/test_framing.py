@@ -0,0 +1,255 @@
+import gzip
+import socket
+import threading
+import time
+
+import pytest
+import requests
+
+from pyNakadi.client import NakadiClient, NakadiException, NakadiStream, StreamOptions, EndOfStreamException, EndOfStreamException0
+from pyNakadi.framing import ChunkedDecoder, LineBuffer
+
+
+def chunked(*payloads, terminate=True):
+    result = b''.join(b'%x\r\n%s\r\n' % (len(p), p) for p in payloads)
+    if terminate:
+        result += b'0\r\n\r\n'
+    return result
+
+
+def serve_once(body, fragment_size=None, headers=b'', received=None):
+    """
+    Serves a single chunked response with body on a local port.
+    :param received: list the raw request is appended to
+    :return: url
+    """
+    server = socket.socket()
+    server.bind(('127.0.0.1', 0))
+    server.listen(1)
+
+    def serve():
+        conn, _ = server.accept()
+        request = conn.recv(65536)
+        if received is not None:
+            received.append(request)
+        conn.sendall(b'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n'
+                     b'X-Nakadi-StreamId: test-stream\r\n' + headers + b'\r\n')
+        step = fragment_size or len(body) or 1
+        for i in range(0, len(body), step):
+            conn.sendall(body[i:i + step])
+        conn.close()
+        server.close()
+
+    threading.Thread(target=serve, daemon=True).start()
+    return f'http://127.0.0.1:{server.getsockname()[1]}/'
+
+
+def decode_all(decoder, data, step):
+    chunks = []
+    for i in range(0, len(data), step):
+        decoder.feed(data[i:i + step])
+        chunk = decoder.read_chunk()
+        while chunk:
+            chunks.append(chunk)
+            chunk = decoder.read_chunk()
+    return chunks
+
+
+@pytest.mark.parametrize('step', [1, 2, 3, 7, 64, 100000])
+def test_chunked_decoder_fragmented(step):
+    payloads = [b'{"a":1}\n', b'x' * 5000, b'{"b":2}\n']
+    decoder = ChunkedDecoder(buffer_size=16)
+    assert decode_all(decoder, chunked(*payloads), step) == payloads
+    assert decoder.finished
+
+
+def test_chunked_decoder_extension_and_partial():
+    decoder = ChunkedDecoder()
+    decoder.feed(b'5;name=value\r\nhel')
+    assert decoder.read_chunk() is None
+    decoder.feed(b'lo\r')
+    assert decoder.read_chunk() is None
+    decoder.feed(b'\n0\r\n\r\n')
+    assert decoder.read_chunk() == b'hello'
+    assert decoder.read_chunk() == b''
+
+
+def test_line_buffer_views_survive_growth():
+    lines = LineBuffer(capacity=8)
+    lines.write(b'first\nsec')
+    first = lines.next_line(view=True)
+    assert lines.next_line() is None
+    lines.write(b'ond' + b'x' * 100 + b'\n')
+    assert lines.next_line() == b'second' + b'x' * 100
+    lines.write(b'third\n')
+    assert lines.next_line(view=True).tobytes() == b'third'
+    assert first.tobytes() == b'first'
+    assert len(lines) == 0
+
+
+def test_chunked_decoder_decode_into():
+    data = chunked(b'{"a":1}\n{"b"', b':2}\n')
+    decoder = ChunkedDecoder(buffer_size=16)
+    lines = LineBuffer(capacity=4)
+    for i in range(len(data)):
+        decoder.feed(data[i:i + 1])
+        decoder.decode_into(lines)
+    assert decoder.finished
+    assert lines.next_line() == b'{"a":1}'
+    assert lines.next_line(view=True).tobytes() == b'{"b":2}'
+    assert lines.next_line() is None
+
+
+def test_chunked_decoder_buffer_size():
+    payload = b'x' * 100000 + b'\n'
+    data = chunked(payload)
+    decoder = ChunkedDecoder(buffer_size=1024)
+    lines = LineBuffer()
+    for i in range(0, len(data), 1000):
+        decoder.feed(data[i:i + 1000])
+        decoder.decode_into(lines)
+        # partial chunks are passed on, the receive buffer does not grow
+        assert len(decoder.get_buffer()) <= 1024
+    assert lines.next_line() == payload[:-1]
+
+    decoder = ChunkedDecoder(buffer_size=1024)
+    assert decode_all(decoder, chunked(payload, terminate=False), 1000) == [payload]
+    # grown for read_chunk and back to buffer_size once drained
+    assert len(decoder.get_buffer()) == 1024
+
+
+@pytest.mark.parametrize('fragment_size', [None, 1, 5])
+def test_nakadi_stream_batches(fragment_size):
+    body = chunked(b'{"batch":1}\n{"ba', b'tch":2}', b'\n', b'{"batch":3}\n')
+    url = serve_once(body, fragment_size)
+    stream = NakadiStream(requests.get(url, stream=True))
+    assert stream.get_stream_id() == 'test-stream'
+    assert list(zip(range(3), stream)) == [(0, b'{"batch":1}'), (1, b'{"batch":2}'), (2, b'{"batch":3}')]
+    with pytest.raises(EndOfStreamException0):
+        next(stream)
+
+
+def test_nakadi_stream_large_batch_view():
+    batch = b'{"events":[' + b','.join([b'{"e":"' + b'x' * 100 + b'"}'] * 20000) + b']}'
+    body = chunked(*[batch[i:i + 1000] for i in range(0, len(batch), 1000)], b'\n{}\n')
+    stream = NakadiStream(requests.get(serve_once(body), stream=True))
+    assert stream.next_batch(view=True) == batch
+    assert next(stream) == b'{}'
+
+
+def test_nakadi_stream_parse():
+    body = chunked(b'{"cursor":{"partition":"0"}}\n',
+                   b'{"cursor":{"partition":"0"},"events":[{"a":1}],"info":{"debug":"x"}}\n')
+    stream = NakadiStream(requests.get(serve_once(body), stream=True), parse=True, json_decoder='json')
+    assert next(stream) == {'cursor': {'partition': '0'}, 'events': [{'a': 1}], 'info': {'debug': 'x'}}
+    with pytest.raises(EndOfStreamException0):
+        next(stream.batches())
+
+
+def test_nakadi_stream_parse_lazy():
+    body = chunked(b'{"cursor":{"partition":"0"}}\n{"cursor":{"partition":"1"},"events":[{"a":1}]}\n')
+    stream = NakadiStream(requests.get(serve_once(body), stream=True), parse='lazy')
+    batch = next(stream)
+    assert batch.cursor == {'partition': '1'}
+    assert batch.raw_events == b'[{"a":1}]'
+
+
+def test_nakadi_stream_reads_body_buffered_with_headers():
+    server = socket.socket()
+    server.bind(('127.0.0.1', 0))
+    server.listen(1)
+    hold = threading.Event()
+    line = b'{"cursor":{},"events":[%s1]}\n' % (b'1,' * 1300)
+
+    def serve():
+        conn, _ = server.accept()
+        conn.recv(65536)
+        # headers and a chunk larger than http.client's buffer in one packet
+        conn.sendall(b'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n' + chunked(line * 2, terminate=False))
+        hold.wait(5)
+        conn.close()
+        server.close()
+
+    threading.Thread(target=serve, daemon=True).start()
+    stream = NakadiStream(requests.get(f'http://127.0.0.1:{server.getsockname()[1]}/', stream=True))
+    started = time.monotonic()
+    assert stream.next_batch() == line[:-1]
+    assert stream.next_batch() == line[:-1]
+    assert time.monotonic() - started < 1
+    hold.set()
+
+
+@pytest.mark.parametrize('fragment_size', [None, 3])
+def test_nakadi_stream_gzip(fragment_size):
+    payload = b''.join(b'{"cursor":{"offset":"%d"},"events":[{"a":1}]}\n' % i for i in range(500))
+    compressed = gzip.compress(payload)
+    body = chunked(*[compressed[i:i + 100] for i in range(0, len(compressed), 100)])
+    received = []
+    url = serve_once(body, fragment_size, headers=b'Content-Encoding: gzip\r\n', received=received)
+    stream = NakadiClient('dummy_token', url[:-1]).get_subscription_events_stream('sid', compression='gzip')
+    assert b'accept-encoding: gzip\r\n' in received[0].lower()
+    assert [next(stream) for _ in range(500)] == payload.splitlines()
+    with pytest.raises(EndOfStreamException0):
+        next(stream)
+
+
+def test_event_type_events_stream():
+    payload = b'{"cursor":{"partition":"0","offset":"1"},"events":[{"a":1}]}\n'
+    compressed = gzip.compress(payload)
+    received = []
+    url = serve_once(chunked(compressed), headers=b'Content-Encoding: gzip\r\n', received=received)
+    cursors = [{'partition': '0', 'offset': '0'}]
+    stream = NakadiClient('dummy_token', url[:-1]).get_event_type_events_stream('et', batch_limit=10, cursors=cursors,
+                                                                                 parse=True, compression='gzip')
+    request = received[0].lower()
+    assert request.startswith(b'get /event-types/et/events?batch_limit=10&')
+    assert b'accept-encoding: gzip\r\n' in request
+    assert b'x-nakadi-cursors: [{"partition": "0", "offset": "0"}]\r\n' in request
+    assert next(stream) == {'cursor': {'partition': '0', 'offset': '1'}, 'events': [{'a': 1}]}
+
+
+def test_uncompressed_stream_does_not_accept_gzip():
+    received = []
+    client = NakadiClient('dummy_token', serve_once(chunked(b'{"cursor":{}}\n'), received=received)[:-1])
+    client.get_subscription_events_stream('sid')
+    assert b'gzip' not in received[0].lower()
+    assert 'gzip' in client.session.headers['Accept-Encoding']
+
+
+def test_stream_options():
+    url = serve_once(chunked(b'{}\n'))
+    stream = NakadiClient('dummy_token', url[:-1]).get_subscription_events_stream('sid', batch_flush_timeout=2)
+    assert stream.read_timeout == 2 + StreamOptions.KEEP_ALIVE_GRACE
+    assert stream.sock.gettimeout() == stream.read_timeout
+    assert NakadiStream.BUFFER_SIZE == StreamOptions.BUFFER_SIZE
+
+    options = StreamOptions(read_timeout=7, buffer_size=1024, receive_buffer=64 * 1024, keepalive=True,
+                            keepalive_idle=60)
+    url = serve_once(chunked(b'{}\n'))
+    stream = NakadiClient('dummy_token', url[:-1]).get_event_type_events_stream('et', options=options)
+    sock = stream.sock
+    assert sock.gettimeout() == 7
+    assert sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY)
+    assert sock.getsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE)
+    assert sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF) >= 64 * 1024
+    if hasattr(socket, 'TCP_KEEPIDLE'):
+        assert sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE) == 60
+    assert next(stream) == b'{}'
+
+
+@pytest.mark.parametrize('body', [b'x' * 5000 + b'\n', b'{}\n' + b'x' * 5000])
+def test_max_batch_bytes(body):
+    stream = NakadiStream(requests.get(serve_once(chunked(body), fragment_size=100), stream=True),
+                          options=StreamOptions(max_batch_bytes=1000))
+    with pytest.raises(NakadiException) as ex:
+        list(stream)
+    assert ex.value.code == 1
+    stream.close()
+
+
+def test_nakadi_stream_eof():
+    url = serve_once(chunked(b'{"batch":1}\n{"b', terminate=False))
+    stream = NakadiStream(requests.get(url, stream=True))
+    assert next(stream) == b'{"batch":1}'
+    with pytest.raises(EndOfStreamException):
+        next(stream)
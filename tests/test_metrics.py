@@ -0,0 +1,99 @@
+import socket
+
+from pyNakadi import AsyncNakadiClient, NakadiClient
+from pyNakadi.metrics import PrometheusMetrics, StatsdMetrics, endpoint
+from pyNakadi.testing import FakeNakadi
+from test_aio import run
+
+
+class RecordingMetrics:
+    def __init__(self):
+        self.counters = {}
+        self.timings = []
+
+    def increment(self, name, value=1, tags=None):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def timing(self, name, seconds, tags=None):
+        self.timings.append((name, seconds, tags))
+
+
+def test_endpoint():
+    assert endpoint('/event-types/orders/events?batch_limit=1') == '/event-types/{name}/events'
+    assert endpoint('/event-types/orders/partitions/3') == '/event-types/{name}/partitions/{partition}'
+    assert endpoint('/subscriptions/abc/cursors') == '/subscriptions/{id}/cursors'
+    assert endpoint('/event-types') == '/event-types'
+
+
+def test_prometheus_render():
+    metrics = PrometheusMetrics(buckets=(0.01, 0.1))
+    metrics.increment('stream.bytes', 10)
+    metrics.increment('stream.bytes', 5)
+    metrics.timing('request', 0.05, {'endpoint': '/event-types', 'status': 200})
+    metrics.timing('request', 0.01, {'endpoint': '/event-types', 'status': 200})
+    assert metrics.render().splitlines() == [
+        '# TYPE pyNakadi_stream_bytes_total counter',
+        'pyNakadi_stream_bytes_total 15',
+        '# TYPE pyNakadi_request_seconds histogram',
+        'pyNakadi_request_seconds_bucket{endpoint="/event-types",status="200",le="0.01"} 1',
+        'pyNakadi_request_seconds_bucket{endpoint="/event-types",status="200",le="0.1"} 2',
+        'pyNakadi_request_seconds_bucket{endpoint="/event-types",status="200",le="+Inf"} 2',
+        'pyNakadi_request_seconds_sum{endpoint="/event-types",status="200"} 0.060000000000000005',
+        'pyNakadi_request_seconds_count{endpoint="/event-types",status="200"} 2',
+    ]
+
+
+def test_statsd():
+    agent = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    agent.bind(('127.0.0.1', 0))
+    agent.settimeout(2)
+    metrics = StatsdMetrics(port=agent.getsockname()[1])
+    metrics.increment('stream.events', 3)
+    metrics.timing('request', 0.25, {'method': 'GET', 'status': 200})
+    assert agent.recv(1024) == b'pyNakadi.stream.events:3|c'
+    assert agent.recv(1024) == b'pyNakadi.request:250.000|ms|#method:GET,status:200'
+    metrics.close()
+    agent.close()
+
+
+def test_client_and_stream_metrics():
+    metrics = RecordingMetrics()
+    with FakeNakadi(batch_flush_timeout=0.01) as nakadi:
+        nakadi.create_event_type({'name': 'orders'})
+        nakadi.publish('orders', [{'order': i} for i in range(10)])
+        subscription = nakadi.create_subscription({'owning_application': 'app', 'event_types': ['orders'],
+                                                   'read_from': 'begin'})
+        client = NakadiClient('token', nakadi.url, metrics=metrics)
+        stream = client.get_subscription_events_stream(subscription['id'], batch_limit=5, parse=True)
+        for _ in range(2):
+            batch = stream.next_parsed_batch()
+            client.commit_subscription_cursors(subscription['id'], stream.stream_id, [batch['cursor']])
+        stream.close()
+    requests = [tags for name, _, tags in metrics.timings if name == 'request']
+    assert requests == [{'method': 'GET', 'endpoint': '/subscriptions/{id}/events', 'status': 200},
+                        {'method': 'POST', 'endpoint': '/subscriptions/{id}/cursors', 'status': 204},
+                        {'method': 'POST', 'endpoint': '/subscriptions/{id}/cursors', 'status': 204}]
+    assert metrics.counters['stream.events'] == 10
+    assert metrics.counters['stream.batches'] == 2
+    assert metrics.counters['stream.bytes'] > 10
+    assert len([name for name, _, _ in metrics.timings if name == 'stream.recv']) == 2
+    assert len([name for name, _, _ in metrics.timings if name == 'stream.user']) == 1
+
+
+def test_async_client_metrics():
+    metrics = RecordingMetrics()
+
+    async def scenario(url):
+        async with AsyncNakadiClient('token', url, metrics=metrics) as client:
+            await client.get_event_type('orders')
+
+    with FakeNakadi() as nakadi:
+        nakadi.create_event_type({'name': 'orders'})
+        run(scenario(nakadi.url))
+    assert metrics.timings[0][0] == 'request'
+    assert metrics.timings[0][2] == {'method': 'GET', 'endpoint': '/event-types/{name}', 'status': 200}
+
+
+def test_disabled_metrics_install_no_hooks():
+    client = NakadiClient('token', 'http://nakadi')
+    assert client.session.hooks['response'] == []
@@ -0,0 +1,69 @@
+import threading
+import time
+
+import pytest
+
+from pyNakadi.client import NakadiException
+from pyNakadi.monitoring import LagMonitor
+
+
+class FakeClient:
+    def __init__(self):
+        self.calls = []
+        self.offsets = {('a', '0'): 10, ('a', '1'): 20, ('b', '0'): 5}
+        self.fail = False
+
+    def get_subscription_stats(self, subscription_id, show_time_lag=False):
+        self.calls.append(('stats', subscription_id))
+        time.sleep(0.05)
+        if self.fail:
+            raise NakadiException(code=503, msg='unavailable')
+        return {'items': []}
+
+    def get_subscription_cursors(self, subscription_id):
+        self.calls.append(('cursors', subscription_id))
+        return {'items': [{'event_type': event_type, 'partition': partition, 'offset': str(offset)}
+                          for (event_type, partition), offset in self.offsets.items()]}
+
+    def get_event_type_cursor_lag(self, event_type_name, cursors_map):
+        self.calls.append(('lag', event_type_name, len(cursors_map)))
+        return [{'partition': cursor['partition'], 'unconsumed_events': 100 - int(cursor['offset'])}
+                for cursor in cursors_map]
+
+
+def test_concurrent_callers_share_one_request():
+    client = FakeClient()
+    monitor = LagMonitor(client, ttl=10)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(monitor.get_subscription_stats('s')))
+               for _ in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == [{'items': []}] * 20
+    assert monitor.get_subscription_stats('s') == {'items': []}
+    assert client.calls == [('stats', 's')]
+    monitor.invalidate('s')
+    monitor.get_subscription_stats('s')
+    assert len(client.calls) == 2
+
+
+def test_errors_are_not_cached():
+    client = FakeClient()
+    client.fail = True
+    monitor = LagMonitor(client)
+    with pytest.raises(NakadiException):
+        monitor.get_subscription_stats('s')
+    client.fail = False
+    assert monitor.get_subscription_stats('s') == {'items': []}
+
+
+def test_lag_per_event_type_and_changes():
+    client = FakeClient()
+    monitor = LagMonitor(client, ttl=0)
+    assert monitor.get_lag_changes('s') == {('a', '0'): (90, 90), ('a', '1'): (80, 80), ('b', '0'): (95, 95)}
+    assert sorted(call for call in client.calls if call[0] == 'lag') == [('lag', 'a', 2), ('lag', 'b', 1)]
+    client.offsets[('a', '1')] = 50
+    assert monitor.get_lag_changes('s') == {('a', '1'): (50, -30)}
+    assert monitor.get_subscription_lag('s')[('b', '0')] == 95
@@ -0,0 +1,133 @@
+import socket
+import threading
+import time
+
+import pytest
+import requests
+
+from pyNakadi.client import NakadiStream
+from pyNakadi.multiplexer import StreamMultiplexer
+from test_framing import chunked, serve_once
+
+
+def serve_pieces(stream_id, pieces, hold=None):
+    """
+    Serves a chunked response whose first piece is sent together with the
+    headers, and the rest after their delays.
+    :param pieces: list of (delay, bytes)
+    :param hold: event the connection stays open until
+    :return: url
+    """
+    server = socket.socket()
+    server.bind(('127.0.0.1', 0))
+    server.listen(1)
+
+    def serve():
+        conn, _ = server.accept()
+        conn.recv(65536)
+        head = (b'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n'
+                b'X-Nakadi-StreamId: %s\r\n\r\n' % stream_id.encode())
+        conn.sendall(head + pieces[0][1])
+        for delay, data in pieces[1:]:
+            time.sleep(delay)
+            conn.sendall(data)
+        if hold is not None:
+            hold.wait(5)
+        conn.close()
+        server.close()
+
+    threading.Thread(target=serve, daemon=True).start()
+    return f'http://127.0.0.1:{server.getsockname()[1]}/'
+
+
+def open_stream(url, parse=False):
+    return NakadiStream(requests.get(url, stream=True), parse=parse)
+
+
+def test_multiplexer_reads_many_streams():
+    streams = []
+    for i in range(20):
+        body = chunked(*[b'{"cursor":{"offset":"%d"},"events":[{"stream":%d}]}\n' % (j, i) for j in range(10)])
+        streams.append(NakadiStream(requests.get(serve_once(body, fragment_size=7), stream=True), parse=True))
+    for i, stream in enumerate(streams):
+        stream.stream_id = f'stream-{i}'
+    ended = []
+    received = {}
+    threads = threading.active_count()
+    with StreamMultiplexer(streams, on_end=lambda stream_id, error: ended.append((stream_id, error))) as mux:
+        for stream_id, batch in mux:
+            received.setdefault(stream_id, []).append(batch)
+            assert threading.active_count() <= threads
+    assert sorted(ended) == sorted((f'stream-{i}', None) for i in range(20))
+    for i in range(20):
+        assert received[f'stream-{i}'] == [{'cursor': {'offset': str(j)}, 'events': [{'stream': i}]}
+                                              for j in range(10)]
+
+
+def test_multiplexer_reads_bytes_buffered_with_headers():
+    hold = threading.Event()
+    url = serve_pieces('buffered', [(0, chunked(b'{"a":1}\n{"a":2}\n', terminate=False))], hold)
+    mux = StreamMultiplexer([open_stream(url)])
+    started = time.monotonic()
+    assert mux.poll(timeout=2) == [('buffered', b'{"a":1}'), ('buffered', b'{"a":2}')]
+    assert time.monotonic() - started < 1
+    hold.set()
+    mux.close()
+
+
+def test_multiplexer_interleaves_streams():
+    hold = threading.Event()
+    slow = serve_pieces('slow', [(0, b''), (0.3, chunked(b'{"cursor":{},"events":["slow"]}\n', terminate=False))],
+                        hold)
+    fast = serve_pieces('fast', [(0, b''), (0.05, chunked(b'{"cursor":{},"events":["fast"]}\n', terminate=False))],
+                        hold)
+    mux = StreamMultiplexer([open_stream(slow, parse=True), open_stream(fast, parse=True)])
+    received = []
+    deadline = time.monotonic() + 5
+    while len(received) < 2 and time.monotonic() < deadline:
+        received.extend(mux.poll(timeout=1))
+    assert received == [('fast', {'cursor': {}, 'events': ['fast']}), ('slow', {'cursor': {}, 'events': ['slow']})]
+    hold.set()
+    mux.close()
+
+
+def test_multiplexer_times_out_silent_stream():
+    hold = threading.Event()
+    url = serve_pieces('silent', [(0, b'')], hold)
+    ended = []
+    mux = StreamMultiplexer([open_stream(url)], read_timeout=0.2,
+                            on_end=lambda stream_id, error: ended.append((stream_id, error)))
+    assert list(mux) == []
+    assert ended[0][0] == 'silent' and isinstance(ended[0][1], TimeoutError)
+    assert not mux.streams
+    hold.set()
+
+
+def test_multiplexer_skips_streams_removed_by_on_end():
+    first = serve_pieces('first', [(0, chunked(b'{"a":1}\n'))])
+    second = serve_pieces('second', [(0, chunked(b'{"a":2}\n'))])
+    ended = []
+
+    def on_end(stream_id, error):
+        ended.append(stream_id)
+        if 'second' in mux.streams:
+            mux.remove('second')
+
+    mux = StreamMultiplexer([open_stream(first), open_stream(second)], on_end=on_end)
+    assert mux.poll(timeout=2) == [('first', b'{"a":1}')]
+    assert ended == ['first'] and not mux.streams
+
+
+def test_multiplexer_removes_stream_failing_to_decode():
+    hold = threading.Event()
+    good = serve_pieces('good', [(0, chunked(b'{"cursor":{},"events":[1]}\n', terminate=False))], hold)
+    bad = serve_pieces('bad', [(0, chunked(b'not json\n', terminate=False))], hold)
+    bad_stream = open_stream(bad, parse=True)
+    mux = StreamMultiplexer([open_stream(good, parse=True), bad_stream])
+    with pytest.raises(ValueError):
+        mux.poll(timeout=2)
+    assert list(mux.streams) == ['good'] and bad_stream.closed()
+    # batches read before the error are not lost
+    assert mux.poll(timeout=0) == [('good', {'cursor': {}, 'events': [1]})]
+    hold.set()
+    mux.close()
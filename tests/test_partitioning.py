@@ -0,0 +1,70 @@
+import pytest
+
+from pyNakadi.client import NakadiException
+from pyNakadi.partitioning import Partitioner, _java_string_hash
+
+EVENT_TYPE = {'name': 'et', 'category': 'business', 'partition_strategy': 'hash',
+              'partition_key_fields': ['order.id', 'region']}
+
+
+def test_java_string_hash():
+    # values of java.lang.String#hashCode
+    assert _java_string_hash('') == 0
+    assert _java_string_hash('hello') == 99162322
+    assert _java_string_hash('polygenelubricants') == -2147483648
+    assert _java_string_hash('\U0001F600') == 1772899
+
+
+def test_hash_partitioner():
+    partitioner = Partitioner(EVENT_TYPE, ['10', '2', '0', '1'])
+    assert partitioner.partitions == ['0', '1', '2', '10']
+    event = {'order': {'id': 'hello'}, 'region': 'polygenelubricants'}
+    # 99162322 + -2147483648 = -2048321326, abs(-2048321326 % 4) = 2
+    assert partitioner.partition(event) == '2'
+    # for a hash of -2 ** 31 Nakadi's abs(hash % n) is 2 ** 31 % 3 = 2, where
+    # Java's Math.abs(hash) % n would be negative
+    region_only = Partitioner(dict(EVENT_TYPE, partition_key_fields=['region']), ['0', '1', '2'])
+    assert region_only.partition({'region': 'polygenelubricants'}) == '2'
+    events = [{'order': {'id': str(i)}, 'region': 'eu'} for i in range(100)]
+    groups = partitioner.group(events)
+    assert sorted(sum(groups.values(), []), key=lambda e: int(e['order']['id'])) == events
+    for partition, partition_events in groups.items():
+        assert partitioner.partitions_of(partition_events) == [partition] * len(partition_events)
+    assert partitioner.counts(events) == {partition: len(e) for partition, e in groups.items()}
+
+
+def test_data_change_user_defined_and_random():
+    data = Partitioner(dict(EVENT_TYPE, category='data', partition_key_fields=['id']), ['0', '1', '2'])
+    assert data.partition({'data': {'id': 7}}) == ['0', '1', '2'][_java_string_hash('7') % 3]
+    user_defined = Partitioner({'name': 'et', 'partition_strategy': 'user_defined'}, ['0', '1'])
+    assert user_defined.partition({'metadata': {'partition': '1'}}) == '1'
+    assert Partitioner({'name': 'et'}, ['0']).partition({}) is None
+    with pytest.raises(NakadiException):
+        Partitioner({'name': 'et', 'partition_strategy': 'hash'}, ['0'])
+
+
+def test_post_events_per_partition():
+    class Client:
+        pool_maxsize = 4
+        posted = []
+
+        def get_event_type(self, name):
+            return EVENT_TYPE
+
+        def get_event_type_partitions(self, name):
+            return [{'partition': '0'}, {'partition': '1'}]
+
+        def post_events(self, name, events, compression=None):
+            self.posted.append((name, events))
+            if events[0]['region'] == 'fail':
+                raise NakadiException(code=500, msg='error')
+            return True
+
+    client = Client()
+    partitioner = Partitioner.from_client(client, 'et')
+    events = [{'order': {'id': str(i)}, 'region': 'eu'} for i in range(10)]
+    result = partitioner.post_events(client, events)
+    assert set(result.values()) == {True}
+    assert sorted(len(events) for _, events in client.posted) == sorted(len(e) for e in partitioner.group(events).values())
+    result = partitioner.post_events(client, [{'order': {'id': '1'}, 'region': 'fail'}])
+    assert isinstance(list(result.values())[0], NakadiException)
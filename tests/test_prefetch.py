@@ -0,0 +1,36 @@
+import time
+
+import pytest
+import requests
+
+from pyNakadi.client import NakadiException, NakadiStream, EndOfStreamException0
+from pyNakadi.prefetch import PrefetchStream
+from test_framing import chunked, serve_once
+
+
+def batch(i, size=10):
+    return b'{"cursor":{"offset":"%d"},"events":["%s"]}\n' % (i, b'x' * size)
+
+
+def test_prefetch_stream():
+    body = chunked(*[b'{"cursor":{}}\n' + batch(i) for i in range(50)])
+    stream = NakadiStream(requests.get(serve_once(body, fragment_size=100), stream=True), parse=True)
+    offsets = []
+    with pytest.raises(EndOfStreamException0):
+        with PrefetchStream(stream, max_batches=4) as prefetch:
+            for batch_map in prefetch:
+                offsets.append(batch_map['cursor']['offset'])
+    assert offsets == [str(i) for i in range(50)]
+
+
+def test_prefetch_stream_is_bounded():
+    body = chunked(*[batch(i, 1000) for i in range(200)])
+    stream = NakadiStream(requests.get(serve_once(body), stream=True))
+    prefetch = PrefetchStream(stream, max_batches=50, max_bytes=10 * 1024)
+    time.sleep(0.2)
+    # reading stops once 10 KiB of batches are queued
+    assert prefetch.pending() == 10
+    assert next(prefetch).startswith(b'{"cursor":{"offset":"0"}')
+    prefetch.close()
+    with pytest.raises(NakadiException):
+        next(prefetch)
@@ -0,0 +1,151 @@
+import json
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from pyNakadi import NakadiClient, NakadiPublisher, NakadiException, NakadiPublishException
+
+
+class RecordingClient:
+    def __init__(self, fail=None):
+        self.posts = []
+        self.fail = fail
+
+    def json_dumps(self, event):
+        return json.dumps(event).encode()
+
+    def post_events(self, event_type_name, events, compression=None, retry_failed_only=False):
+        self.posts.append((event_type_name, [json.loads(e) for e in events]))
+        if self.fail is not None:
+            raise self.fail(events)
+        return True
+
+
+def test_publisher_batches_by_count_and_event_type():
+    client = RecordingClient()
+    with NakadiPublisher(client, max_batch_count=2, linger=10) as publisher:
+        futures = [publisher.publish(f'et{i % 2}', {'i': i}) for i in range(5)]
+        assert [f.result(timeout=5) for f in futures[:4]] == [True] * 4
+        assert not futures[4].done()
+    assert futures[4].result() is True
+    assert sorted(client.posts, key=str) == [('et0', [{'i': 0}, {'i': 2}]), ('et0', [{'i': 4}]),
+                                             ('et1', [{'i': 1}, {'i': 3}])]
+
+
+def test_publisher_linger_and_bytes():
+    client = RecordingClient()
+    publisher = NakadiPublisher(client, max_batch_bytes=30, linger=0.05)
+    first = publisher.publish('et', b'{"payload":"xxxxxxxxxx"}')
+    second = publisher.publish('et', {'payload': 'yyyyyyyyyy'})
+    started = time.monotonic()
+    assert first.result(timeout=5) and second.result(timeout=5)
+    assert time.monotonic() - started < 1
+    assert len(client.posts) == 2
+    publisher.close()
+    with pytest.raises(NakadiException):
+        publisher.publish('et', {})
+
+
+def test_publisher_resolves_every_future_queued_before_close():
+    publisher = NakadiPublisher(RecordingClient(), linger=10)
+    futures = []
+
+    def produce():
+        while True:
+            try:
+                futures.append(publisher.publish('et', {}))
+            except NakadiException:
+                return
+
+    producers = [threading.Thread(target=produce) for _ in range(4)]
+    for producer in producers:
+        producer.start()
+    time.sleep(0.05)
+    publisher.close()
+    for producer in producers:
+        producer.join()
+    assert futures and all(future.result(timeout=5) for future in futures)
+
+
+def test_publisher_partial_failure():
+    def fail(events):
+        return NakadiPublishException(code=207, msg='partial', items=[
+            {'publishing_status': 'submitted', 'step': 'none'},
+            {'publishing_status': 'failed', 'step': 'validating', 'detail': 'bad'}])
+
+    publisher = NakadiPublisher(RecordingClient(fail), linger=0.01)
+    ok, bad = publisher.publish('et', {'a': 1}), publisher.publish('et', {'a': 2})
+    assert ok.result(timeout=5) is True
+    with pytest.raises(NakadiPublishException) as ex:
+        bad.result(timeout=5)
+    assert ex.value.items == [{'publishing_status': 'failed', 'step': 'validating', 'detail': 'bad'}]
+    publisher.close()
+
+
+def test_post_events_many(monkeypatch):
+    client = NakadiClient('dummy_token', 'http://nakadi', pool_maxsize=4)
+    assert client.session.get_adapter('http://nakadi')._pool_maxsize == 4
+
+    def post_events(event_type_name, events, compression=None):
+        time.sleep(0.1)
+        if event_type_name == 'bad':
+            raise NakadiException(code=422, msg='bad')
+        return True
+
+    monkeypatch.setattr(client, 'post_events', post_events)
+    started = time.monotonic()
+    result = client.post_events_many(dict({f'et{i}': [{'i': i}] for i in range(3)}, bad=[{}]))
+    assert time.monotonic() - started < 0.3
+    assert {k: v for k, v in result.items() if k != 'bad'} == {'et0': True, 'et1': True, 'et2': True}
+    assert isinstance(result['bad'], NakadiException)
+
+
+def publish_responses(monkeypatch, client, responses):
+    posted = []
+
+    def post(url, headers, data):
+        posted.append(json.loads(data))
+        status, items = responses.pop(0)
+        return SimpleNamespace(status_code=status, content=json.dumps(items).encode())
+
+    monkeypatch.setattr(client.session, 'post', post)
+    return posted
+
+
+def test_post_events_retry_failed_only(monkeypatch):
+    client = NakadiClient('dummy_token', 'http://nakadi')
+    client.PUBLISH_RETRY_BACKOFF = 0
+    posted = publish_responses(monkeypatch, client, [
+        (207, [{'eid': '0', 'publishing_status': 'submitted', 'step': 'none'},
+               {'eid': '1', 'publishing_status': 'failed', 'step': 'publishing'},
+               {'eid': '2', 'publishing_status': 'submitted', 'step': 'none'}]),
+        (200, None)])
+    events = [{'metadata': {'eid': str(i)}} for i in range(3)]
+    assert client.post_events('et', events, retry_failed_only=True)
+    assert posted == [events, [events[1]]]
+
+
+def test_post_events_partial_failure(monkeypatch):
+    client = NakadiClient('dummy_token', 'http://nakadi')
+    client.PUBLISH_RETRY_BACKOFF = 0
+    posted = publish_responses(monkeypatch, client, [
+        (422, [{'eid': '0', 'publishing_status': 'failed', 'step': 'validating', 'detail': 'bad'},
+               {'eid': '1', 'publishing_status': 'aborted', 'step': 'validating'},
+               {'eid': '2', 'publishing_status': 'aborted', 'step': 'validating'}]),
+        (207, [{'eid': '1', 'publishing_status': 'submitted', 'step': 'none'},
+               {'eid': '2', 'publishing_status': 'failed', 'step': 'publishing'}]),
+        (207, [{'eid': '2', 'publishing_status': 'failed', 'step': 'publishing'}])])
+    events = [{'metadata': {'eid': str(i)}} for i in range(3)]
+    with pytest.raises(NakadiPublishException) as ex:
+        client.post_events('et', events, retry_failed_only=True, max_retries=2)
+    assert posted == [events, events[1:], events[2:]]
+    assert [index for index, _ in ex.value.failed()] == [0, 2]
+    assert ex.value.failed_steps() == {'validating': 1, 'publishing': 1}
+    assert ex.value.events == events
+
+    publish_responses(monkeypatch, client, [(207, [{'publishing_status': 'failed', 'step': 'publishing'}])])
+    with pytest.raises(NakadiPublishException) as ex:
+        client.post_events('et', events[:1])
+    assert ex.value.failed() == [(0, {'publishing_status': 'failed', 'step': 'publishing'})]
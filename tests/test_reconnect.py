@@ -0,0 +1,135 @@
+import threading
+
+import pytest
+
+from pyNakadi import NakadiClient
+from pyNakadi.client import NakadiException, EndOfStreamException, EndOfStreamException0
+from pyNakadi.reconnect import ReconnectingStream
+from pyNakadi.testing import FakeNakadi
+
+
+class FakeStream:
+    def __init__(self, stream_id, batches, end=EndOfStreamException0):
+        self.stream_id = stream_id
+        self.batches = list(batches)
+        self.end = end
+        self.closed = False
+
+    def next_parsed_batch(self, lazy=False):
+        if not self.batches:
+            raise self.end
+        return self.batches.pop(0)
+
+    def close(self):
+        self.closed = True
+
+
+class FakeClient:
+    """
+    Opens the streams, or raises the exceptions, of outcomes in order.
+    """
+
+    def __init__(self, outcomes):
+        self.outcomes = list(outcomes)
+        self.opened = []
+
+    def get_subscription_events_stream(self, subscription_id, **params):
+        return self._open(('subscription', subscription_id, params))
+
+    def get_event_type_events_stream(self, event_name, cursors=None, **params):
+        return self._open(('event_type', event_name, cursors, params))
+
+    def _open(self, call):
+        self.opened.append(call)
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+def batch(partition, offset):
+    return {'cursor': {'partition': partition, 'offset': offset}, 'events': [{}]}
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    delays = []
+    monkeypatch.setattr('pyNakadi.reconnect.time.sleep', delays.append)
+    monkeypatch.setattr('pyNakadi.reconnect.random.uniform', lambda low, high: high)
+    return delays
+
+
+def test_reconnects_subscription_stream(sleeps):
+    client = FakeClient([
+        FakeStream('s1', [batch('0', '1')], end=EndOfStreamException),
+        NakadiException(code=409, msg='no free slots'),
+        NakadiException(code=503, msg='unavailable'),
+        ConnectionError('refused'),
+        NakadiException(code=429, msg='throttled'),
+        FakeStream('s2', [batch('0', '2')]),
+    ])
+    reconnected = []
+    stream = ReconnectingStream(client, subscription_id='sub', batch_limit=10, on_reconnect=reconnected.append)
+    assert next(stream) == batch('0', '1')
+    assert stream.stream_id == 's1'
+    assert next(stream) == batch('0', '2')
+    assert stream.stream_id == 's2'
+    assert [s.stream_id for s in reconnected] == ['s2']
+    assert stream.reconnects == 1
+    # dropped stream, 409, 503, connection error, 429 capped to BACKOFF_MAX
+    assert sleeps == [0.5, 5 * 2, 0.5 * 4, 0.5 * 8, 30]
+    assert client.opened[0] == ('subscription', 'sub', {'parse': True, 'batch_limit': 10})
+    stream.close()
+    with pytest.raises(StopIteration):
+        next(stream)
+
+
+def test_resumes_event_type_stream_from_cursors(sleeps):
+    client = FakeClient([
+        FakeStream('s1', [batch('0', '1'), batch('1', '5'), batch('0', '2')]),
+        FakeStream('s2', [batch('1', '6')]),
+    ])
+    stream = ReconnectingStream(client, event_type_name='et', cursors=[{'partition': '1', 'offset': '4'}],
+                                parse='lazy')
+    assert [next(stream) for _ in range(4)][-1] == batch('1', '6')
+    assert client.opened[0] == ('event_type', 'et', [{'partition': '1', 'offset': '4'}], {'parse': 'lazy'})
+    assert client.opened[1][2] == [{'partition': '1', 'offset': '5'}, {'partition': '0', 'offset': '2'}]
+
+
+def test_resumes_partitions_idle_before_reconnect(sleeps):
+    def event(partition):
+        return {'metadata': {'partition': partition}}
+
+    with FakeNakadi(partitions=2) as nakadi:
+        nakadi.create_event_type({'name': 'orders', 'owning_application': 'app',
+                                  'partition_strategy': 'user_defined'})
+        nakadi.publish('orders', [event('0')])
+        stream = ReconnectingStream(NakadiClient('token', nakadi.url), event_type_name='orders',
+                                    batch_limit=1, stream_limit=2, batch_flush_timeout=1)
+        threading.Timer(0.2, nakadi.publish, ['orders', [event('0'), event('0')]]).start()
+        # the first stream ends after two events of partition 0
+        assert [next(stream)['cursor']['partition'] for _ in range(2)] == ['0', '0']
+        nakadi.publish('orders', [event('1'), event('0')])
+        partitions = []
+        reader = threading.Thread(target=lambda: partitions.extend(
+            next(stream)['cursor']['partition'] for _ in range(2)), daemon=True)
+        reader.start()
+        reader.join(5)
+        stream.close()
+        assert sorted(partitions) == ['0', '1']
+        assert stream.reconnects == 1
+
+
+def test_raises_client_errors_and_after_max_retries(sleeps):
+    client = FakeClient([NakadiException(code=404, msg='not found')])
+    with pytest.raises(NakadiException) as ex:
+        next(ReconnectingStream(client, subscription_id='sub'))
+    assert ex.value.code == 404 and sleeps == []
+
+    client = FakeClient([NakadiException(code=500, msg='error')] * 3)
+    with pytest.raises(NakadiException) as ex:
+        next(ReconnectingStream(client, subscription_id='sub', max_retries=2))
+    assert ex.value.code == 500 and len(client.opened) == 3
+
+    with pytest.raises(NakadiException):
+        ReconnectingStream(client)
@@ -0,0 +1,112 @@
+import json
+import time
+
+import pytest
+
+from pyNakadi import NakadiClient, NakadiException, RecordedStream, StreamRecorder
+from pyNakadi.batch import LazyBatch
+from pyNakadi.client import EndOfStreamException0
+from pyNakadi.recording import MAGIC
+from pyNakadi.testing import FakeNakadi
+
+
+def record_stream(path, compression, events=30):
+    with FakeNakadi(partitions=2, batch_flush_timeout=0.05) as nakadi:
+        nakadi.create_event_type({'name': 'orders', 'owning_application': 'app'})
+        nakadi.publish('orders', [{'order': i} for i in range(events)])
+        client = NakadiClient('token', nakadi.url)
+        lines = []
+        with StreamRecorder(path, compression=compression) as recorder:
+            stream = recorder.record(client.get_event_type_events_stream(
+                'orders', cursors=[{'partition': '0', 'offset': 'BEGIN'}, {'partition': '1', 'offset': 'BEGIN'}],
+                batch_limit=4, stream_limit=events, batch_flush_timeout=1))
+            try:
+                while True:
+                    lines.append(stream.next_batch())
+            except EndOfStreamException0:
+                pass
+            stream.close()
+        return stream.stream_id, lines
+
+
+@pytest.mark.parametrize('compression', [None, 'deflate'])
+def test_replays_recorded_batch_lines(tmp_path, compression):
+    path = str(tmp_path / 'orders.rec')
+    stream_id, lines = record_stream(path, compression)
+    assert sum(len(json.loads(line).get('events', [])) for line in lines) == 30
+    with RecordedStream(path) as replay:
+        assert list(replay_lines(replay)) == lines
+        assert replay.stream_id == stream_id
+        assert replay.current_batch == lines[-1]
+    with RecordedStream(path, parse=True) as replay:
+        assert sum(len(batch['events']) for batch in replay_lines(replay)) == 30
+    with RecordedStream(path) as replay:
+        batch = replay.next_parsed_batch(lazy=True)
+        assert isinstance(batch, LazyBatch) and batch.count_events() == 4
+
+
+def test_compression_and_appended_sessions(tmp_path):
+    plain = str(tmp_path / 'plain.rec')
+    compressed = str(tmp_path / 'compressed.rec')
+    first_id, first = record_stream(plain, None, events=200)
+    record_stream(compressed, 'deflate', events=200)
+    assert (tmp_path / 'compressed.rec').stat().st_size < (tmp_path / 'plain.rec').stat().st_size / 2
+    # a second session appends a new stream with another compression
+    second_id, second = record_stream(plain, 'deflate')
+    stream_ids = []
+    with RecordedStream(plain) as replay:
+        for line in replay_lines(replay):
+            if replay.stream_id not in stream_ids:
+                stream_ids.append(replay.stream_id)
+        assert stream_ids == [first_id, second_id]
+
+
+def test_truncated_and_invalid_recordings(tmp_path):
+    path = tmp_path / 'orders.rec'
+    _, lines = record_stream(str(path), None)
+    data = path.read_bytes()
+    path.write_bytes(data[:-3])
+    with RecordedStream(str(path)) as replay:
+        assert list(replay_lines(replay)) == lines[:-1]
+    invalid = tmp_path / 'invalid.rec'
+    invalid.write_bytes(b'not a recording')
+    for target in [invalid, tmp_path / 'empty.rec']:
+        target.touch()
+        with pytest.raises(NakadiException) as info:
+            RecordedStream(str(target))
+        assert info.value.code == 1
+    with pytest.raises(NakadiException):
+        StreamRecorder(str(invalid))
+    with pytest.raises(NakadiException):
+        StreamRecorder(str(tmp_path / 'other.rec'), compression='gzip')
+    assert (tmp_path / 'empty.rec').read_bytes() == b''
+    with StreamRecorder(str(tmp_path / 'empty.rec')):
+        pass
+    assert (tmp_path / 'empty.rec').read_bytes().startswith(MAGIC)
+
+
+def test_replays_with_original_timing(tmp_path):
+    path = str(tmp_path / 'timed.rec')
+    with StreamRecorder(path) as recorder:
+        for i in range(3):
+            recorder.write('sid', json.dumps({'cursor': {}, 'events': [{'i': i}]}).encode())
+            time.sleep(0.1)
+    for speed, low, high in [(None, 0, 0.05), (1, 0.18, 0.5), (4, 0.04, 0.15)]:
+        with RecordedStream(path, speed=speed) as replay:
+            started = time.monotonic()
+            assert len(list(replay_lines(replay))) == 3
+            assert low <= time.monotonic() - started < high
+    with RecordedStream(path) as replay:
+        view = replay.next_batch(view=True)
+        assert isinstance(view, memoryview)
+        replay.close()
+        assert replay.closed()
+        assert json.loads(bytes(view))['events'] == [{'i': 0}]
+
+
+def replay_lines(replay):
+    try:
+        while True:
+            yield next(replay)
+    except EndOfStreamException0:
+        return
@@ -0,0 +1,53 @@
+import gzip
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from pyNakadi.client import NakadiClient
+from pyNakadi.serialization import encode_events, get_json_decoder, get_json_encoder
+
+
+def test_get_json_decoder_default():
+    loads = get_json_decoder()
+    assert loads(b'{"cursor": {"partition": "0"}, "events": [1]}') == {'cursor': {'partition': '0'}, 'events': [1]}
+
+
+def test_get_json_decoder_explicit():
+    assert get_json_decoder('json') is json.loads
+    assert get_json_decoder(len) is len
+    with pytest.raises(ValueError):
+        get_json_decoder('yaml')
+
+
+@pytest.mark.parametrize('encoder', ['json', None])
+def test_encode_events(encoder):
+    dumps = get_json_encoder(encoder)
+    events = [{'metadata': {'eid': '1'}, 'field_1': 'ü'}, {'metadata': {'eid': '2'}}]
+    assert json.loads(encode_events(events, dumps)) == events
+    assert json.loads(encode_events(iter(events), dumps)) == events
+    assert encode_events([dumps(event) for event in events], dumps) == dumps(events)
+    assert encode_events((e for e in [b'{"a":1}', bytearray(b'{"b":2}')]), dumps) == b'[{"a":1},{"b":2}]'
+    assert encode_events(memoryview(b'[{"a":1}]'), dumps) == b'[{"a":1}]'
+    assert encode_events([], dumps) == b'[]'
+
+
+@pytest.mark.parametrize('compression', [None, 'gzip'])
+def test_post_events_body(monkeypatch, compression):
+    client = NakadiClient('dummy_token', 'http://nakadi')
+    posted = {}
+
+    def post(url, headers, data):
+        posted.update(url=url, headers=headers, data=data)
+        return SimpleNamespace(status_code=200, content=b'')
+
+    monkeypatch.setattr(client.session, 'post', post)
+    assert client.post_events('et', [b'{"a":1}', b'{"b":2}'], compression=compression)
+    assert posted['url'] == 'http://nakadi/event-types/et/events'
+    if compression:
+        assert posted['headers']['Content-Encoding'] == 'gzip'
+        assert gzip.decompress(posted['data']) == b'[{"a":1},{"b":2}]'
+    else:
+        assert 'Content-Encoding' not in posted['headers']
+        assert posted['data'] == b'[{"a":1},{"b":2}]'
+    assert 'Content-Encoding' not in client.session.headers
@@ -0,0 +1,144 @@
+import time
+
+import pytest
+
+from pyNakadi import NakadiClient, NakadiException, NakadiPublishException
+from pyNakadi.client import EndOfStreamException0
+from pyNakadi.testing import FakeNakadi, fake_nakadi  # noqa: F401
+
+EVENT_TYPE = {'name': 'orders', 'owning_application': 'app', 'category': 'business',
+              'enrichment_strategies': ['metadata_enrichment'], 'partition_strategy': 'hash',
+              'partition_key_fields': ['order'], 'default_statistic': {'read_parallelism': 2, 'write_parallelism': 2},
+              'schema': {'type': 'json_schema', 'schema': '{}'}}
+
+
+def events(start, count):
+    return [{'metadata': {'eid': str(i), 'occurred_at': '2020-02-01T20:00:00+00:00'}, 'order': str(i)}
+            for i in range(start, start + count)]
+
+
+def test_event_types_and_publishing(fake_nakadi):
+    client = NakadiClient('token', fake_nakadi.url)
+    assert 'counters' in client.get_metrics()
+    client.create_event_type(EVENT_TYPE)
+    with pytest.raises(NakadiException) as info:
+        client.create_event_type(EVENT_TYPE)
+    assert info.value.code == 409
+    assert [event_type['name'] for event_type in client.get_event_types()] == ['orders']
+    assert client.post_events('orders', events(0, 10), compression='gzip')
+    with pytest.raises(NakadiPublishException) as info:
+        client.post_events('orders', [{'metadata': {'eid': 'x'}}])
+    assert info.value.failed_steps() == {'partitioning': 1}
+    partitions = client.get_event_type_partitions('orders')
+    assert [partition['partition'] for partition in partitions] == ['0', '1']
+    lag = client.get_event_type_cursor_lag('orders', [{'partition': '0', 'offset': 'BEGIN'},
+                                                      {'partition': '1', 'offset': 'BEGIN'}])
+    assert sum(partition['unconsumed_events'] for partition in lag) == 10
+    client.update_event_type('orders', dict(EVENT_TYPE, schema={'type': 'json_schema', 'schema': '{"a":1}'}))
+    assert client.get_event_type('orders')['schema']['version'] == '1.1.0'
+    with pytest.raises(NakadiException) as info:
+        client.get_event_type('missing')
+    assert info.value.code == 404
+
+
+def test_event_type_stream_fragmented():
+    with FakeNakadi(chunk_size=7, fragment_size=3, batch_flush_timeout=0.01) as nakadi:
+        nakadi.create_event_type(dict(EVENT_TYPE, default_statistic=None))
+        nakadi.publish('orders', events(0, 25))
+        client = NakadiClient('token', nakadi.url)
+        stream = client.get_event_type_events_stream('orders', batch_limit=10, stream_limit=25, parse=True,
+                                                     cursors=[{'partition': '0', 'offset': 'BEGIN'}])
+        batches = [stream.next_parsed_batch() for _ in range(3)]
+        with pytest.raises(EndOfStreamException0):
+            stream.next_parsed_batch()
+        assert [len(batch['events']) for batch in batches] == [10, 10, 5]
+        assert batches[-1]['cursor'] == {'partition': '0', 'offset': '001-0001-000000000000000024'}
+        assert batches[0]['events'][0]['metadata']['event_type'] == 'orders'
+
+
+def test_subscription_stream_commit_and_stats(fake_nakadi):
+    fake_nakadi.create_event_type(EVENT_TYPE)
+    client = NakadiClient('token', fake_nakadi.url)
+    subscription = client.create_subscription({'owning_application': 'app', 'event_types': ['orders'],
+                                               'read_from': 'begin'})
+    assert client.create_subscription_v2({'owning_application': 'app', 'event_types': ['orders'],
+                                          'read_from': 'begin'}) == (200, subscription)
+    fake_nakadi.publish('orders', events(0, 30))
+    stream = client.get_subscription_events_stream(subscription['id'], batch_limit=5, max_uncommitted_events=10,
+                                                   stream_timeout=1, parse=True)
+    started = time.monotonic()
+    received = 0
+    for batch in stream.batches():
+        received += len(batch['events'])
+        client.commit_subscription_cursors(subscription['id'], stream.stream_id, [batch['cursor']])
+        if received == 30:
+            stats = client.get_subscription_stats(subscription['id'])
+            assert {partition['state'] for partition in stats['items'][0]['partitions']} == {'assigned'}
+            assert sum(partition['unconsumed_events'] for partition in stats['items'][0]['partitions']) == 0
+            break
+    assert time.monotonic() - started < 1
+    stream.close()
+    cursors = client.get_subscription_cursors(subscription['id'])['items']
+    assert sum(int(cursor['offset'].rsplit('-', 1)[1]) + 1 for cursor in cursors) == 30
+    with pytest.raises(NakadiException) as info:
+        client.commit_subscription_cursors(subscription['id'], 'unknown', [cursors[0]])
+    assert info.value.code == 422
+
+
+def test_subscription_max_uncommitted_events_and_balancing(fake_nakadi):
+    fake_nakadi.create_event_type(EVENT_TYPE)
+    subscription = fake_nakadi.create_subscription({'owning_application': 'app', 'event_types': ['orders'],
+                                                    'read_from': 'begin'})
+    fake_nakadi.publish('orders', events(0, 40))
+    client = NakadiClient('token', fake_nakadi.url)
+    first = client.get_subscription_events_stream(subscription['id'], batch_limit=20, max_uncommitted_events=4,
+                                                  stream_timeout=1, parse=True)
+    second = client.get_subscription_events_stream(subscription['id'], batch_limit=20, max_uncommitted_events=4,
+                                                   stream_timeout=1, parse=True)
+    with pytest.raises(NakadiException) as info:
+        client.get_subscription_events_stream(subscription['id'])
+    assert info.value.code == 409
+    partitions = set()
+    for stream in [first, second]:
+        batch = stream.next_parsed_batch()
+        assert len(batch['events']) == 4
+        partitions.add(batch['cursor']['partition'])
+        stream.close()
+    assert partitions == {'0', '1'}
+
+
+def test_latency_and_injected_failures():
+    with FakeNakadi(latency=0.1) as nakadi:
+        client = NakadiClient('token', nakadi.url)
+        nakadi.fail('GET', '/event-types', 503, times=2)
+        for _ in range(2):
+            with pytest.raises(NakadiException) as info:
+                client.get_event_types()
+            assert info.value.code == 503
+        started = time.monotonic()
+        assert client.get_event_types() == []
+        assert time.monotonic() - started >= 0.1
+
+
+def test_gzip_stream_and_throughput():
+    with FakeNakadi(throughput=20000, batch_flush_timeout=0.01) as nakadi:
+        nakadi.create_event_type(dict(EVENT_TYPE, default_statistic=None))
+        nakadi.publish('orders', [dict(event, padding='x' * 1000) for event in events(0, 20)])
+        client = NakadiClient('token', nakadi.url)
+        started = time.monotonic()
+        stream = client.get_event_type_events_stream('orders', batch_limit=1, stream_limit=20, parse=True,
+                                                     compression='gzip',
+                                                     cursors=[{'partition': '0', 'offset': 'BEGIN'}])
+        assert stream.response.headers['Content-Encoding'] == 'gzip'
+        assert [stream.next_parsed_batch()['events'][0]['order'] for _ in range(20)] == [str(i) for i in range(20)]
+        # about 20 kB of uncompressed stream, compressed well below 20 kB/s
+        assert time.monotonic() - started < 0.5
+    with FakeNakadi(throughput=20000, batch_flush_timeout=0.01) as nakadi:
+        nakadi.create_event_type(dict(EVENT_TYPE, default_statistic=None))
+        nakadi.publish('orders', [dict(event, padding='x' * 1000) for event in events(0, 20)])
+        started = time.monotonic()
+        stream = NakadiClient('token', nakadi.url).get_event_type_events_stream(
+            'orders', batch_limit=1, stream_limit=20, cursors=[{'partition': '0', 'offset': 'BEGIN'}])
+        for _ in range(20):
+            stream.next_batch()
+        assert time.monotonic() - started >= 0.9
@@ -0,0 +1,71 @@
+import json
+
+import pytest
+
+from pyNakadi.client import NakadiException, NakadiPublishException
+
+jsonschema = pytest.importorskip('jsonschema')
+
+from pyNakadi.validation import EventValidator  # noqa: E402
+
+SCHEMA = {'type': 'object', 'properties': {'id': {'type': 'integer'}}, 'required': ['id'],
+          'additionalProperties': False}
+
+
+class Client:
+    def __init__(self, category='business'):
+        self.category = category
+        self.version = '1.0.0'
+        self.schema = SCHEMA
+        self.posted = []
+
+    def get_event_type(self, name):
+        return {'name': name, 'category': self.category,
+                'schema': {'type': 'json_schema', 'version': self.version, 'schema': json.dumps(self.schema)}}
+
+    def post_events(self, name, events, compression=None):
+        self.posted.extend(events)
+        return True
+
+
+def test_split_and_validate():
+    validator = EventValidator(Client())
+    events = [{'id': 1, 'metadata': {'eid': 'a'}}, {'id': 'x'}, {}, {'id': 2}]
+    valid, invalid = validator.split('et', events)
+    assert valid == [events[0], events[3]]
+    assert [(index, event) for index, event, _ in invalid] == [(1, events[1]), (2, events[2])]
+    assert invalid[0][2].startswith('#/id:')
+    with pytest.raises(NakadiPublishException) as info:
+        validator.validate('et', events)
+    assert info.value.code == 1
+    assert [index for index, _ in info.value.failed()] == [0, 1, 2, 3]
+    assert info.value.failed_steps() == {'validating': 2, 'none': 2}
+    validator.validate('et', valid)
+
+
+def test_data_change_events_and_post_valid_events():
+    client = Client(category='data')
+    validator = EventValidator(client)
+    invalid = validator.post_valid_events('et', [{'data': {'id': 1}, 'metadata': {}}, {'data': {'id': None}}])
+    assert client.posted == [{'data': {'id': 1}, 'metadata': {}}]
+    assert [index for index, _, _ in invalid] == [1]
+
+
+def test_validator_compiled_per_schema_version():
+    client = Client()
+    validator = EventValidator(client)
+    compiled = validator.get_validator('et')[1]
+    assert validator.get_validator('et')[1] is compiled
+    client.version = '1.1.0'
+    client.schema = dict(SCHEMA, additionalProperties=True)
+    assert validator.get_validator('et')[1] is not compiled
+    assert len(validator._validators) == 1
+    validator.validate('et', [{'id': 1, 'extra': True}])
+
+
+def test_unsupported_schema_type():
+    client = Client()
+    client.get_event_type = lambda name: {'name': name, 'schema': {'type': 'avro_schema', 'version': '1',
+                                                                   'schema': '{}'}}
+    with pytest.raises(NakadiException):
+        EventValidator(client).split('et', [{}])